@@ -303,6 +303,12 @@ _default_config = {'brisa':
                          'logging.field_type': 'entry',
                          'logging_output': 'file',
                          'logging_output.field_type': 'entry',
+                         'reactor': 'auto',
+                         'reactor.field_type': 'entry',
+                         'threadpool_size': '16',
+                         'threadpool_size.field_type': 'entry',
+                         'description_cache': 'on',
+                         'description_cache.field_type': 'entry',
                          'listen_interface': 'eth0'}}
 
 
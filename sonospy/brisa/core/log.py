@@ -162,6 +162,25 @@ def filtercheck(record):
     else:
         return 0
 
+# module names of source files, as set in record.module by logging
+_modules = {}
+
+def callercheck(frame):
+    """ Returns whether filtercheck would pass a record logged from frame,
+    without creating the record.
+
+    @param frame: stack frame of the caller
+    @type frame: frame
+    """
+    if 'all' in modcheck:
+        return True
+    filename = frame.f_code.co_filename
+    mod = _modules.get(filename)
+    if mod == None:
+        mod = os.path.splitext(os.path.basename(filename))[0]
+        _modules[filename] = mod
+    return modcheck.get(mod) == True
+
 
 
 def findCaller():
@@ -201,10 +220,13 @@ log_dict = {'WARNING': logging.WARNING,
             'ERROR': logging.ERROR}
 
 
+# whether records are filtered by module (see filtercheck)
+filtered = False
+
 def setup_logging():
     """ Method to setup the logging options. """
     global debug, info, warning, critical, error, root_logger, set_level,\
-           setLevel, filename, level
+           setLevel, filename, level, filtered
 
     level = log_dict.get(config.get_parameter('brisa', 'logging'),
                          logging.DEBUG)
@@ -221,7 +243,11 @@ def setup_logging():
         root_logger = getLogger('RootLogger')
         root_logger.setLevel(level)
         
-        root_logger.findCaller = findCaller
+        filtered = True
+
+    # records are made by the logger functions below, so skip this
+    # module when finding the caller (whichever output is used)
+    root_logger.findCaller = findCaller
         
         
 
@@ -239,8 +265,68 @@ root_logger = getLogger()
 if __enable_logging__:
     setup_logging()
 
-debug = root_logger.debug
-info = root_logger.info
-warning = root_logger.warning
-critical = root_logger.critical
-error = root_logger.error
+
+def is_enabled(lvl=logging.DEBUG):
+    """ Returns whether a message logged at lvl from the calling module
+    would be output. Use it to guard building log messages that are
+    expensive to create, e.g.
+
+        if log.is_enabled():
+            log.debug('items: %s', pformat(items))
+
+    @param lvl: log level (default logging.DEBUG)
+    @type lvl: integer
+
+    @rtype: boolean
+    """
+    if not root_logger.isEnabledFor(lvl):
+        return False
+    if filtered:
+        return callercheck(sys._getframe(1))
+    return True
+
+
+class lazy(object):
+    """ Log message argument that is only created when the message is
+    output, e.g.
+
+        log.debug('data: %s', log.lazy(pformat, data))
+
+    Arguments passed to the log functions are only formatted into the
+    message if it is output, so plain values need no wrapping.
+    """
+
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    def __unicode__(self):
+        return unicode(self.func(*self.args))
+
+    def __repr__(self):
+        return repr(self.func(*self.args))
+
+
+def _make_logfunc(lvl, name):
+    # check the level and module filter before the logger creates the
+    # record (which walks the stack to find the caller), so messages
+    # that won't be output cost little more than the call
+    def logfunc(msg, *args, **kwargs):
+        if not root_logger.isEnabledFor(lvl):
+            return
+        if filtered and not callercheck(sys._getframe(1)):
+            return
+        getattr(root_logger, name)(msg, *args, **kwargs)
+    logfunc.__name__ = name
+    return logfunc
+
+debug = _make_logfunc(logging.DEBUG, 'debug')
+info = _make_logfunc(logging.INFO, 'info')
+warning = _make_logfunc(logging.WARNING, 'warning')
+critical = _make_logfunc(logging.CRITICAL, 'critical')
+error = _make_logfunc(logging.ERROR, 'error')
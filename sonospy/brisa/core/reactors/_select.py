@@ -3,20 +3,34 @@
 # Copyright 2007-2008 Brisa Team <brisa-develop@garage.maemo.org>
 
 """ Default select-based reactor.
+
+Timers are kept in a heap ordered by when they are next due, and the
+reactor sleeps until the first of them is due (or an fd is ready).
+
+Fds are watched with select by default, or with epoll or poll where
+available. The mechanism is chosen with the brisa reactor parameter
+(auto, epoll, poll or select), e.g.
+
+    brisa-conf -s brisa -p reactor epoll
+
+auto (the default) uses the first of epoll, poll and select that the
+platform supports. select is limited to fds below FD_SETSIZE.
 """
 
 __all__ = ('SelectReactor', )
 
 import os
 import time
-import random
+import math
+import heapq
 import select
 import socket
 import signal
+import itertools
 
 from errno import EINTR, EBADF
 
-from brisa.core import log
+from brisa.core import log, config
 from brisa.core.ireactor import *
 
 
@@ -36,6 +50,7 @@ class Timer(object):
         self.timeout_rel = timeout_rel
         self.timeout_abs = timeout_abs
         self.threshold = threshold
+        self.cancelled = False
 
     def __call__(self):
         """ Performs the callback.
@@ -56,9 +71,171 @@ class Timer(object):
                str(self.timeout_abs), str(self.threshold))
 
 
+def _fileno(fd):
+    """ Returns the integer fd of a file, socket or integer fd.
+    """
+    if isinstance(fd, (int, long)):
+        return fd
+    return fd.fileno()
+
+
+class _SelectPoller(object):
+    """ Watches fds with select.select.
+    """
+
+    name = 'select'
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+
+    def update(self, fd):
+        pass
+
+    def poll(self, timeout):
+        r = self.reactor
+        return select.select(r._read_fds.keys(), r._write_fds.keys(),
+                             r._excpt_fds.keys(), timeout)
+
+    def check(self, fd):
+        select.select([fd], [fd], [fd], 0)
+
+
+class _PollPoller(object):
+    """ Watches fds with select.poll, which has no limit on fd numbers.
+    """
+
+    name = 'poll'
+    READ = select.POLLIN | select.POLLHUP | select.POLLERR \
+           if hasattr(select, 'poll') else 0
+    WRITE = select.POLLOUT if hasattr(select, 'poll') else 0
+    EXCPT = select.POLLPRI if hasattr(select, 'poll') else 0
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.poller = self.create()
+        # fileno -> (fd object, registered event mask)
+        self.fds = {}
+
+    def create(self):
+        return select.poll()
+
+    def update(self, fd):
+        """ Registers fd for the events it is currently watched for in the
+        reactor, or unregisters it if it isn't watched any more.
+        """
+        r = self.reactor
+        mask = 0
+        if fd in r._read_fds:
+            mask |= self.READ
+        if fd in r._write_fds:
+            mask |= self.WRITE
+        if fd in r._excpt_fds:
+            mask |= self.EXCPT
+        try:
+            fileno = _fileno(fd)
+        except (ValueError, socket.error, IOError):
+            # closed, drop whatever we had registered for it
+            for fileno, (f, m) in self.fds.items():
+                if f is fd:
+                    self.unregister(fileno)
+            return
+        current = self.fds.get(fileno)
+        if current and current[0] is not fd:
+            # fileno reused by a new fd
+            self.unregister(fileno)
+            current = None
+        if not mask:
+            if current:
+                self.unregister(fileno)
+        elif not current:
+            self.poller.register(fileno, mask)
+            self.fds[fileno] = (fd, mask)
+        elif current[1] != mask:
+            self.poller.modify(fileno, mask)
+            self.fds[fileno] = (fd, mask)
+
+    def unregister(self, fileno):
+        self.fds.pop(fileno, None)
+        try:
+            self.poller.unregister(fileno)
+        except (KeyError, ValueError, IOError, OSError):
+            pass
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = -1
+        else:
+            # round up to whole ms, so we don't wake just before a timer
+            # is due and spin until it is
+            timeout = int(math.ceil(timeout * 1000))
+        revt, wevt, eevt = [], [], []
+        for fileno, evt in self._poll(timeout):
+            entry = self.fds.get(fileno)
+            if not entry:
+                continue
+            fd = entry[0]
+            if evt & self.READ:
+                revt.append(fd)
+            if evt & self.WRITE:
+                wevt.append(fd)
+            if evt & self.EXCPT:
+                eevt.append(fd)
+        return revt, wevt, eevt
+
+    def _poll(self, ms):
+        return self.poller.poll(ms)
+
+    def check(self, fd):
+        os.fstat(_fileno(fd))
+
+
+class _EpollPoller(_PollPoller):
+    """ Watches fds with select.epoll (Linux), whose cost doesn't grow
+    with the number of fds watched.
+    """
+
+    name = 'epoll'
+    READ = select.EPOLLIN | select.EPOLLHUP | select.EPOLLERR \
+           if hasattr(select, 'epoll') else 0
+    WRITE = select.EPOLLOUT if hasattr(select, 'epoll') else 0
+    EXCPT = select.EPOLLPRI if hasattr(select, 'epoll') else 0
+
+    def create(self):
+        return select.epoll()
+
+    def _poll(self, ms):
+        # epoll takes seconds, which it truncates to ms
+        return self.poller.poll((ms + 0.5) / 1000.0)
+
+
+_pollers = {'select': (_SelectPoller, 'select'),
+            'poll': (_PollPoller, 'poll'),
+            'epoll': (_EpollPoller, 'epoll')}
+
+
+def _get_poller_class():
+    """ Returns the poller class set by the brisa reactor parameter, or
+    the best one available.
+    """
+    name = config.get_parameter('brisa', 'reactor') or 'auto'
+    if name in _pollers:
+        cls, func = _pollers[name]
+        if hasattr(select, func):
+            return cls
+        log.warning('Reactor %s not available, using auto', name)
+    elif name != 'auto':
+        log.warning('Unknown reactor %s, using auto', name)
+    for name in ('epoll', 'poll', 'select'):
+        cls, func = _pollers[name]
+        if hasattr(select, func):
+            return cls
+
+
 class SelectReactor(ReactorInterface):
 
     _timers = {}
+    _timer_heap = []
+    _timer_ids = itertools.count(1)
     _read_fds = {}
     _write_fds = {}
     _excpt_fds = {}
@@ -67,8 +244,14 @@ class SelectReactor(ReactorInterface):
 
     state = REACTOR_STATE_STOPPED
 
+    # longest sleep when no timer is due, so that main_quit() from another
+    # thread is noticed where there is no pipe of death to wake us
+    max_timeout = 1.0
+
     def __init__(self, *args, **kwargs):
         ReactorInterface.__init__(self, *args, **kwargs)
+        self._poller = _get_poller_class()(self)
+        log.debug('Reactor using %s', self._poller.name)
         p = os.pipe()
         self._death_pipe_w = os.fdopen(p[1], 'w')
         self._death_pipe_r = os.fdopen(p[0], 'r')
@@ -92,15 +275,18 @@ class SelectReactor(ReactorInterface):
         @return: unique ID for the callback
         @rtype: integer
         """
-        id = random.randint(-50000, 50000)
-
-        while id in self._timers:
-            id = random.randint(-50000, 50000)
-
-        self._timers[id] = Timer(callback, interval,interval + time.time(),
-                                 threshold)
+        id = self._timer_ids.next()
+        timer = Timer(callback, interval, interval + time.time(), threshold)
+        self._timers[id] = timer
+        self._push_timer(timer)
         return id
 
+    def _push_timer(self, timer):
+        # the id breaks ties so timers themselves are never compared
+        heapq.heappush(self._timer_heap,
+                       (timer.timeout_abs - timer.threshold,
+                        self._timer_ids.next(), timer))
+
     def rem_timer(self, id):
         """ Removes a timed callback given its id.
 
@@ -109,7 +295,8 @@ class SelectReactor(ReactorInterface):
         """
         if not id: return
         try:
-            self._timers.pop(id)
+            # left in the heap, dropped when it comes due
+            self._timers.pop(id).cancelled = True
         except KeyError:
             raise KeyError('No such timeout callback registered with id %d' %
                            id)
@@ -129,15 +316,16 @@ class SelectReactor(ReactorInterface):
         @type data: any
         """
         if evt_type & EVENT_TYPE_READ:
-            log.debug('Added fd %s watch for READ events' % str(fd))
+            log.debug('Added fd %s watch for READ events', fd)
             self._read_fds[fd] = evt_callback
         if evt_type & EVENT_TYPE_WRITE:
-            log.debug('Added fd %s watch for WRITE events' % str(fd))
+            log.debug('Added fd %s watch for WRITE events', fd)
             self._write_fds[fd] = evt_callback
         if evt_type & EVENT_TYPE_EXCEPTION:
-            log.debug('Added fd %s watch for EXCEPTION events' % str(fd))
+            log.debug('Added fd %s watch for EXCEPTION events', fd)
             self._excpt_fds[fd] = evt_callback
 
+        self._poller.update(fd)
         return fd
 
     def rem_fd(self, fd):
@@ -149,6 +337,7 @@ class SelectReactor(ReactorInterface):
         """
         for d in (self._read_fds, self._write_fds, self._excpt_fds):
             d.pop(fd, None)
+        self._poller.update(fd)
 
     def add_after_stop_func(self, func):
         """ Registers a function to be called before entering the STOPPED
@@ -239,20 +428,17 @@ class SelectReactor(ReactorInterface):
         @rtype: boolean
         """
         try:
-            revt, wevt, eevt = select.select(self._read_fds.keys(),
-                                             self._write_fds.keys(),
-                                             self._excpt_fds.keys(),
-                                             self._get_min_timeout())
+            revt, wevt, eevt = self._poller.poll(self._get_min_timeout())
             if not self._main_process_events(revt, wevt, eevt):
                 return False
         # Fix problems with problematic file descriptors
         except ValueError, v:
-            log.debug('Main loop ValueError: %s' % str(v))
+            log.debug('Main loop ValueError: %s', v)
             self._main_cleanup_fds()
         except TypeError, t:
-            log.debug('Main loop TypeError %s' % str(t))
+            log.debug('Main loop TypeError %s', t)
             self._main_cleanup_fds()
-        except (select.error, IOError), s:
+        except (select.error, IOError, OSError), s:
             if s.args[0] in (0, 2):
                 if not ((not self._read_fds) and (not self._write_fds)):
                     raise
@@ -272,6 +458,7 @@ class SelectReactor(ReactorInterface):
             if read == self._death_pipe_w:
                 log.debug('Pipe of death read')
                 self._read_fds.pop(read)
+                self._poller.update(read)
                 return False
             if read not in self._read_fds:
                 continue
@@ -281,6 +468,7 @@ class SelectReactor(ReactorInterface):
                 if not self._read_fds[read](read, EVENT_TYPE_READ):
                     # Returned False, remove it
                     self._read_fds.pop(read)
+                    self._poller.update(read)
             except Exception, e:
                 log.debug('Exception %s raised when handling a READ'\
                           ' event on file %s', e, read)
@@ -292,6 +480,7 @@ class SelectReactor(ReactorInterface):
                           self._write_fds[write])
                 if not self._write_fds[write](write, EVENT_TYPE_WRITE):
                     self._write_fds.pop(write)
+                    self._poller.update(write)
             except Exception, e:
                 log.debug('Exception %s raised when handling a WRITE'\
                           ' event on file %s', e, write)
@@ -303,6 +492,7 @@ class SelectReactor(ReactorInterface):
                           self._excpt_fds[excpt])
                 if not self._excpt_fds[excpt](excpt, EVENT_TYPE_EXCEPTION):
                     self._excpt_fds.pop(excpt)
+                    self._poller.update(excpt)
             except Exception, e:
                 log.debug('Exception %s raised when handling a EXCEPTION'\
                           ' event on file %s', e, excpt)
@@ -311,20 +501,26 @@ class SelectReactor(ReactorInterface):
     def _main_trigger_timers(self):
         """ Triggers the timers that are ready.
         """
-        for callback in self._timers.values():
-            if callback.timeout_abs - callback.threshold < time.time():
-                log.debug('Callback ready: %s' % str(callback))
-                if self.is_running():
-                    try:
-                        callback()
-                    except KeyboardInterrupt, k:
-                        # Ctrl-C would be ignored
-                        return False
-                    except:
-                        log.error('Error while processing timer %s' %
-                                  str(callback))
-                # Update the absolute timeout anyways
-                callback.update_abs_timeout()
+        heap = self._timer_heap
+        now = time.time()
+        while heap and heap[0][0] < now:
+            callback = heapq.heappop(heap)[2]
+            if callback.cancelled:
+                continue
+            log.debug('Callback ready: %s', callback)
+            if self.is_running():
+                try:
+                    callback()
+                except KeyboardInterrupt, k:
+                    # Ctrl-C would be ignored
+                    return False
+                except:
+                    log.error('Error while processing timer %s',
+                              callback)
+            # Update the absolute timeout anyways
+            callback.update_abs_timeout()
+            if not callback.cancelled:
+                self._push_timer(callback)
         return True
 
     def _main_cleanup_fds(self):
@@ -335,19 +531,22 @@ class SelectReactor(ReactorInterface):
         for d in [self._read_fds, self._write_fds, self._excpt_fds]:
             for s in d.keys():
                 try:
-                    select.select([s], [s], [s], 0)
+                    self._poller.check(s)
                 except Exception, e:
-                    log.debug('Removing problematic fd: %s' % str(s))
+                    log.debug('Removing problematic fd: %s', s)
                     d.pop(s)
+                    self._poller.update(s)
 
     def _get_min_timeout(self):
-        """ Returns the minimum timeout among registered timers.
+        """ Returns the time until the next timer is due, at most
+        max_timeout.
         """
-        min = 0
-        for callback in self._timers.values():
-            if min == 0 or callback.timeout_rel < min:
-                min = callback.timeout_rel
-        return min
+        heap = self._timer_heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            return self.max_timeout
+        return max(0, min(heap[0][0] - time.time(), self.max_timeout))
 
     def _main_call_before_stop_funcs(self):
         for cb in self._stop_funcs:
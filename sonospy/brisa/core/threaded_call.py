@@ -4,16 +4,306 @@
 
 """ Runs a call asynchronously and forwards the result/error to specified
 callbacks.
+
+Calls are run by a bounded pool of worker threads fed from a task queue,
+rather than a thread per call. Delayed calls wait in a scheduler heap
+until they are due. The pool size is set by the brisa threadpool_size
+parameter (default 16), e.g.
+
+    brisa-conf -s brisa -p threadpool_size 32
+
+A call that runs for longer than task_timeout seconds is treated as
+stuck: it no longer counts against the pool size, so that it can't
+starve the calls queued behind it. Pool metrics are returned by
+get_pool().stats().
 """
 
+import os
 import sys, traceback
+import time
+import heapq
+import select
+import itertools
+import collections
 
-import thread
 import threading
 
 
-from brisa.core import log
-from brisa.utils.safe_sleep import safe_sleep
+from brisa.core import log, config
+
+
+class ThreadPool(object):
+    """ Bounded pool of daemon worker threads that run queued calls.
+    Workers are started as they are needed, up to size, and then wait
+    for more work. Workers whose call has run for over task_timeout are
+    stuck and not counted, and while calls are queued the scheduler
+    thread starts more workers as running calls become stuck.
+
+    @param size: maximum number of workers (not counting stuck ones)
+    @param task_timeout: seconds after which a running call is stuck
+
+    @type size: integer
+    @type task_timeout: float
+    """
+
+    def __init__(self, size=16, task_timeout=30):
+        self.size = size
+        self.task_timeout = task_timeout
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.tasks = collections.deque()
+        # worker thread -> start time of the call it is running
+        self.running = {}
+        self.workers = 0
+        self.idle = 0
+        self.stuck = 0
+        # delayed calls, (due time, seq, call)
+        self.scheduled = []
+        self.seq = itertools.count()
+        self.scheduler = None
+        self.wake_r = self.wake_w = None
+        self.wake_event = None
+        # metrics
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.started = 0
+
+    def submit(self, function, *args, **kwargs):
+        """ Queues function(*args, **kwargs) to be run by a worker.
+        """
+        wake = False
+        self.lock.acquire()
+        try:
+            self.tasks.append((function, args, kwargs))
+            self.submitted += 1
+            queued = len(self.tasks)
+            if queued > self.max_queued:
+                self.max_queued = queued
+                if queued > self.size:
+                    log.debug('Thread pool queue depth %s', queued)
+            if self.idle:
+                self.ready.notify()
+            elif self.workers - self.check_stuck() < self.size:
+                self.start_worker()
+            elif queued == 1 and self.task_timeout:
+                # all workers are busy - have the scheduler start another
+                # if a running call becomes stuck before one finishes
+                if not self.scheduler:
+                    self.start_scheduler()
+                wake = True
+        finally:
+            self.lock.release()
+        if wake:
+            self.wake()
+
+    def schedule(self, delay, function, *args, **kwargs):
+        """ Queues function(*args, **kwargs) to be run by a worker after
+        delay seconds.
+        """
+        due = time.time() + delay
+        self.lock.acquire()
+        try:
+            heapq.heappush(self.scheduled, (due, self.seq.next(),
+                                            (function, args, kwargs)))
+            first = self.scheduled[0][0] == due
+            if not self.scheduler:
+                self.start_scheduler()
+        finally:
+            self.lock.release()
+        if first:
+            self.wake()
+
+    def check_stuck(self):
+        """ Returns the number of workers running a call that started more
+        than task_timeout seconds ago. Called with the lock held.
+        """
+        if not self.task_timeout or not self.running:
+            return 0
+        stuck = 0
+        limit = time.time() - self.task_timeout
+        for started in self.running.itervalues():
+            if started <= limit:
+                stuck += 1
+        if stuck > self.stuck:
+            log.warning('%s thread pool calls running for over %ss',
+                        stuck, self.task_timeout)
+        self.stuck = stuck
+        return stuck
+
+    def next_stuck(self, now):
+        """ Returns the number of seconds until the next running call
+        becomes stuck, or None. Called with the lock held.
+        """
+        if not self.task_timeout:
+            return None
+        limit = now - self.task_timeout
+        pending = [started for started in self.running.itervalues()
+                   if started > limit]
+        if not pending:
+            return None
+        return min(pending) - limit
+
+    def start_workers(self):
+        # called with the lock held
+        # start workers for queued calls that idle workers won't take,
+        # while there are fewer than size workers that aren't stuck
+        wanted = len(self.tasks) - self.idle
+        stuck = self.check_stuck()
+        while wanted > 0 and self.workers - stuck < self.size:
+            self.start_worker()
+            wanted -= 1
+
+    def start_worker(self):
+        # called with the lock held
+        t = threading.Thread(target=self.work, name='ThreadPool-%s' %
+                             (self.started + 1))
+        t.setDaemon(True)
+        self.workers += 1
+        self.started += 1
+        t.start()
+
+    def work(self):
+        me = threading.currentThread()
+        while True:
+            self.lock.acquire()
+            try:
+                while not self.tasks:
+                    self.idle += 1
+                    self.ready.wait()
+                    self.idle -= 1
+                function, args, kwargs = self.tasks.popleft()
+                self.running[me] = time.time()
+            finally:
+                self.lock.release()
+            try:
+                function(*args, **kwargs)
+                failed = 0
+            except Exception, e:
+                log.error('Thread pool call %s raised %s', function, e)
+                if log.is_enabled():
+                    log.debug('Thread pool call traceback: %s',
+                              traceback.format_exc())
+                failed = 1
+            # don't hold on to the call's objects while idle
+            function = args = kwargs = None
+            self.lock.acquire()
+            try:
+                del self.running[me]
+                self.completed += 1
+                self.failed += failed
+                # if stuck workers let the pool grow past size, shrink back
+                if self.workers - self.check_stuck() > self.size:
+                    self.workers -= 1
+                    return
+            finally:
+                self.lock.release()
+
+    def start_scheduler(self):
+        # called with the lock held
+        if os.name == 'posix':
+            self.wake_r, self.wake_w = os.pipe()
+        else:
+            self.wake_event = threading.Event()
+        self.scheduler = threading.Thread(target=self.run_scheduled,
+                                          name='ThreadPool-scheduler')
+        self.scheduler.setDaemon(True)
+        self.scheduler.start()
+
+    def wake(self):
+        """ Wakes the scheduler to look at the first due time again.
+        """
+        if self.wake_w is not None:
+            os.write(self.wake_w, 'x')
+        elif self.wake_event is not None:
+            self.wake_event.set()
+
+    def wait(self, timeout):
+        # a timed Condition.wait polls in python 2, so block on a pipe
+        # where we can
+        if self.wake_r is not None:
+            try:
+                if select.select([self.wake_r], [], [], timeout)[0]:
+                    os.read(self.wake_r, 512)
+            except (select.error, OSError):
+                pass
+        else:
+            self.wake_event.wait(timeout)
+            self.wake_event.clear()
+
+    def run_scheduled(self):
+        while True:
+            due = []
+            self.lock.acquire()
+            try:
+                now = time.time()
+                while self.scheduled and self.scheduled[0][0] <= now:
+                    due.append(heapq.heappop(self.scheduled)[2])
+                if self.scheduled:
+                    timeout = self.scheduled[0][0] - now
+                else:
+                    timeout = None
+                if self.tasks:
+                    self.start_workers()
+                    # look again when the next running call becomes stuck
+                    stuck = self.next_stuck(now)
+                    if self.tasks and stuck is not None and \
+                       (timeout is None or stuck < timeout):
+                        timeout = stuck
+            finally:
+                self.lock.release()
+            for function, args, kwargs in due:
+                self.submit(function, *args, **kwargs)
+            due = None
+            self.wait(timeout)
+
+    def stats(self):
+        """ Returns the pool metrics.
+
+        @rtype: dict
+        """
+        self.lock.acquire()
+        try:
+            return {'size': self.size,
+                    'workers': self.workers,
+                    'idle': self.idle,
+                    'busy': len(self.running),
+                    'stuck': self.check_stuck(),
+                    'queued': len(self.tasks),
+                    'max_queued': self.max_queued,
+                    'scheduled': len(self.scheduled),
+                    'submitted': self.submitted,
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'threads_started': self.started}
+        finally:
+            self.lock.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """ Returns the thread pool used for asynchronous calls, creating it
+    on first use.
+
+    @rtype: ThreadPool
+    """
+    global _pool
+    if _pool is None:
+        _pool_lock.acquire()
+        try:
+            if _pool is None:
+                try:
+                    size = int(config.get_parameter('brisa',
+                                                    'threadpool_size'))
+                except ValueError:
+                    size = 16
+                _pool = ThreadPool(size)
+        finally:
+            _pool_lock.release()
+    return _pool
 
 
 def run_async_function(f, param_tuple=(), delay=0):
@@ -34,11 +324,10 @@ def run_async_function(f, param_tuple=(), delay=0):
 
     if delay > 0:
         # If delay is valid, schedule a timer for that call
-        t = threading.Timer(delay, f, args=list(param_tuple))
-        t.start()
+        get_pool().schedule(delay, f, *param_tuple)
     else:
         # Instant call
-        thread.start_new_thread(f, param_tuple)
+        get_pool().submit(f, *param_tuple)
 
 def run_async_call(function, success_callback=None, error_callback=None,
                    success_callback_cargo=None, error_callback_cargo=None,
@@ -80,9 +369,10 @@ def run_async_call(function, success_callback=None, error_callback=None,
     tcall.start()
     return tcall
 
-class ThreadedCall(threading.Thread):
+class ThreadedCall(object):
     """ This class runs a call asynchronously and forwards the result/error
-    to specified callbacks.
+    to specified callbacks. The call is run by the thread pool when start()
+    is called.
 
     One can instantiate this class directly or use the run_async_call function
     located at package brisa.core.threaded_call.
@@ -106,14 +396,12 @@ class ThreadedCall(threading.Thread):
                  delay=None, *args, **kwargs):
         self.__class__.counter += 1
         self.instance = self.__class__.counter
-        log.debug('++ %s ++ function: %s' % (self.instance, function))
-        log.debug('++ %s ++ success_callback: %s' % (self.instance, success_callback))
-        log.debug('++ %s ++ success_callback_cargo: %s' % (self.instance, success_callback_cargo))
-        log.debug('++ %s ++ error_callback: %s' % (self.instance, error_callback))
-        log.debug('++ %s ++ args: %s' % (self.instance, str(args)))
-        log.debug('++ %s ++ kwargs: %s' % (self.instance, str(kwargs)))
-        threading.Thread.__init__(self)
-        self.setDaemon(True)
+        log.debug('++ %s ++ function: %s', self.instance, function)
+        log.debug('++ %s ++ success_callback: %s', self.instance, success_callback)
+        log.debug('++ %s ++ success_callback_cargo: %s', self.instance, success_callback_cargo)
+        log.debug('++ %s ++ error_callback: %s', self.instance, error_callback)
+        log.debug('++ %s ++ args: %s', self.instance, args)
+        log.debug('++ %s ++ kwargs: %s', self.instance, kwargs)
         self.function = function
         self.args = args
         self.kwargs = kwargs
@@ -139,43 +427,48 @@ class ThreadedCall(threading.Thread):
     def is_cancelled(self):
         return self.cancelled
 
-    def run(self):
-        """ Implementation of the call procedure.
+    def start(self):
+        """ Queues the call on the thread pool, to run after delay.
         """
         if self.delay:
-            # This runs in a thread. We can sleep here instead using time
-            safe_sleep(self.delay)
-            log.debug('sleeping for %d' % self.delay)
+            log.debug('++ %s ++ delaying for %s', self.instance, self.delay)
+            get_pool().schedule(self.delay, self.run)
+        else:
+            get_pool().submit(self.run)
 
+    def run(self):
+        """ Implementation of the call procedure.
+        """
         if self.is_cancelled():
             self.cleanup()
             return
 
         try:
-            log.debug('++ %s ++ calling function: %s' % (self.instance, str(self.function)))
+            log.debug('++ %s ++ calling function: %s', self.instance, self.function)
             # Performing the call
             self.result = self.function(*self.args, **self.kwargs)
-            log.debug('++ %s ++ got result %s' % (self.instance, self.result))
+            log.debug('++ %s ++ got result %s', self.instance, self.result)
             if self.success_callback:
-                log.debug('++ %s ++ forwarding to success_callback' % self.instance)
+                log.debug('++ %s ++ forwarding to success_callback', self.instance)
                 self.success_callback(self.result, self.success_callback_cargo)
 
-            log.debug('++ %s ++ setting completed' % self.instance)
+            log.debug('++ %s ++ setting completed', self.instance)
             self.set_completed()
 
         except Exception, e:
-            log.debug('++ %s ++ async call exception: %s' % (self.instance, str(e)))
-            log.debug('++ %s ++ async call exception detail: %s' % (self.instance, str(sys.exc_info())))
-            log.debug('++ %s ++ async call exception traceback: %s' % (self.instance, str(traceback.format_exc())))
+            log.debug('++ %s ++ async call exception: %s', self.instance, e)
+            log.debug('++ %s ++ async call exception detail: %s', self.instance, sys.exc_info())
+            if log.is_enabled():
+                log.debug('++ %s ++ async call exception traceback: %s', self.instance, traceback.format_exc())
            
-            log.debug('++ %s ++ function: %s' % (self.instance, str(self.function)))
-            log.debug('++ %s ++ args: %s' % (self.instance, str(self.args)))
-            log.debug('++ %s ++ kwargs: %s' % (self.instance, str(self.kwargs)))
-            log.debug('++ %s ++ result: %s' % (self.instance, str(self.result)))
-            log.debug('++ %s ++ type result: %s' % (self.instance, type(self.result)))
+            log.debug('++ %s ++ function: %s', self.instance, self.function)
+            log.debug('++ %s ++ args: %s', self.instance, self.args)
+            log.debug('++ %s ++ kwargs: %s', self.instance, self.kwargs)
+            log.debug('++ %s ++ result: %s', self.instance, self.result)
+            log.debug('++ %s ++ type result: %s', self.instance, type(self.result))
             
-            log.debug('exception happened (%s), forwarding...'
-                      % e)
+            log.debug('exception happened (%s), forwarding...',
+                      e)
 #                      % e.message)
             # Storing exception for handling
             self.result = e
@@ -35,9 +35,13 @@ import StringIO
 
 import gzip
 import cStringIO
+import threading
+import hashlib
+
+from collections import OrderedDict
 
 from brisa import __enable_webserver_logging__, __enable_offline_mode__
-from brisa.core import log, config, threaded_call
+from brisa.core import log, config
 from brisa.core.network import parse_url, get_active_ifaces, get_ip_address
 
 
@@ -225,7 +229,7 @@ class Response(object):
             raise ValueError('Status code not set for a HTTP response.')
         status_msg = '%d %s' % (self.status, http_codes[self.status])
 
-        log.debug("_respond headers: \n%s", str(self.headers))
+        log.debug("_respond headers: \n%s", self.headers)
 
         if not 'Content-type' in self.headers:
             self.headers['Content-type'] = 'text/html; charset="utf-8"'
@@ -248,14 +252,14 @@ def get_byte_ranges(r, clen):
     @param clen: content length
     """
     # Byte unit supported by us (HTTP1.1) is "bytes". Get the ranges string.
-    log.debug('Range: %s, %d' % (r, clen))
+    log.debug('Range: %s, %d', r, clen)
 
     if not r:
         return None
 
     bunit, branges = r.split('=', 1)
 
-    log.debug('Bunit, branges: %s %s' % (bunit, branges))
+    log.debug('Bunit, branges: %s %s', bunit, branges)
 
     if bunit != 'bytes':
         # Ignore any other kind of units
@@ -267,7 +271,7 @@ def get_byte_ranges(r, clen):
 
     for br in branges.split(','):
         start, stop = [b.strip() for b in br.split('-', 1)]
-        log.debug('%s %s' % (start, stop))
+        log.debug('%s %s', start, stop)
 
         if not start:
             # If the first number is missing, should return the last n bytes
@@ -277,7 +281,7 @@ def get_byte_ranges(r, clen):
                 return None
             # Last n bytes
             ranges.append((clen - int(stop), clen))
-            log.debug('Ranges: %s' % ranges)
+            log.debug('Ranges: %s', ranges)
         else:
             # Start is present
             if not stop:
@@ -290,10 +294,10 @@ def get_byte_ranges(r, clen):
             if int(stop) < int(start):
                 return None
             ranges.append((int(start), int(stop) + 1))
-            log.debug('Ranges: %s' % ranges)
+            log.debug('Ranges: %s', ranges)
 
 
-    log.debug('Ranges: %s' % ranges)
+    log.debug('Ranges: %s', ranges)
     return ranges
 
 
@@ -301,8 +305,8 @@ def chunk_generator(f, chunk_size, max_chunked):
     """ Generates chunks of a file. Stops when reaches the max_chunked value
     of generated chunks.
     """
-    log.debug('Chunk generator of %s, chunks size %d and max chunked data %d' %
-              (f, chunk_size, max_chunked))
+    log.debug('Chunk generator of %s, chunks size %d and max chunked data %d',
+              f, chunk_size, max_chunked)
 
     while max_chunked > 0:
         chunk = f.read(min(chunk_size, max_chunked))
@@ -380,7 +384,7 @@ class StaticFile(object):
         @note: path supplied must exist and point to a file
         """
 
-        log.info('name: %s   path: %s' % (name, path))
+        log.info('name: %s   path: %s', name, path)
         
         if not os.path.exists(path):
             warnings.warn(invalid_path_exists)
@@ -398,7 +402,7 @@ class StaticFile(object):
         if not self._content_type:
             self._guess_content_type()
 
-        log.debug('name: %s   path: %s   _content_type: %s   _disposition: %s' % (name, path, self._content_type, self._disposition))
+        log.debug('name: %s   path: %s   _content_type: %s   _disposition: %s', name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self):
@@ -409,7 +413,7 @@ class StaticFile(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      self.path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (self.path, self._content_type))
+        log.debug('File %s type %s', self.path, self._content_type)
 
     def application(self, environ, start_response, response=None):
         """ Application wsgi callback that processes a request. Must not be
@@ -421,8 +425,8 @@ class StaticFile(object):
                          start_response must be passed accordingly.
         """
 
-        log.debug('StaticFile application environ %s' % environ)
-        log.debug('StaticFile application response %s' % response)
+        log.debug('StaticFile application environ %s', environ)
+        log.debug('StaticFile application response %s', response)
 
 #        if 'REQUEST_METHOD' in environ:
 #            if environ['REQUEST_METHOD'] == 'GET':
@@ -438,7 +442,7 @@ class StaticFile(object):
             r = Response(200, start_response)
 
         if not os.path.exists(self.path):
-            log.warning('Received request on missing file: %s' % self.path)
+            log.warning('Received request on missing file: %s', self.path)
             return simple_response(500, r.start_response, 'File not available.')
 
         try:
@@ -495,7 +499,7 @@ class StaticFile(object):
             # Lower protocols do not support ranges, whole body
             h['Content-length'] = str(content_length)
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -515,6 +519,170 @@ class StaticFile(object):
 
 
 
+class CoverCache(object):
+    """ Byte bounded memory and disk cache of cover art extracted from music
+    files, so that repeated requests for an embedded cover do not reread and
+    decode the music file.
+
+    Entries are keyed on the cover spec (music file path and art offsets)
+    and the music file mtime, so a retagged file gets a new entry.
+    """
+
+    def __init__(self, max_memory=20*1024*1024, max_disk=0, cachedir=None):
+        """ Constructor for the CoverCache class.
+
+        @param max_memory: bytes of cover data to hold in memory
+        @param max_disk: bytes of cover data to hold in cachedir
+        @param cachedir: directory for the disk cache (no disk cache if None)
+        """
+        self._lock = threading.Lock()
+        self.configure(max_memory, max_disk, cachedir)
+
+    def configure(self, max_memory, max_disk, cachedir):
+        """ (Re)sets the cache limits, emptying the memory cache and loading
+        the index of any existing disk cache.
+        """
+        self._lock.acquire()
+        try:
+            self.max_memory = max_memory
+            self.max_disk = max_disk
+            self.cachedir = cachedir
+            self._memory = OrderedDict()
+            self._memory_bytes = 0
+            self._disk = OrderedDict()
+            self._disk_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            if self.cachedir and self.max_disk > 0:
+                try:
+                    if not os.path.isdir(self.cachedir):
+                        os.makedirs(self.cachedir)
+                    files = []
+                    for f in os.listdir(self.cachedir):
+                        st = os.stat(os.path.join(self.cachedir, f))
+                        files.append((st.st_mtime, f, st.st_size))
+                    for mtime, f, size in sorted(files):
+                        self._disk[f] = size
+                        self._disk_bytes += size
+                    self._trim_disk()
+                except (IOError, OSError), e:
+                    log.warning('Cover cache directory %s not usable: %s', self.cachedir, e)
+                    self.cachedir = None
+            else:
+                self.cachedir = None
+        finally:
+            self._lock.release()
+
+    def get(self, cover, mtime, extract):
+        """ Returns (image, etag) for the cover, calling extract() to read
+        the image from the music file if it is not cached.
+        """
+        key = hashlib.md5('%s|%s' % (cover.encode('utf-8') if isinstance(cover, unicode) else cover, mtime)).hexdigest()
+
+        self._lock.acquire()
+        try:
+            image = self._memory.pop(key, None)
+            if image is not None:
+                self._memory[key] = image
+            elif key in self._disk:
+                try:
+                    f = open(os.path.join(self.cachedir, key), 'rb')
+                    image = f.read()
+                    f.close()
+                    self._disk[key] = self._disk.pop(key)
+                    self._add_memory(key, image)
+                except (IOError, OSError), e:
+                    log.debug('Cover cache read failed: %s', e)
+                    self._disk_bytes -= self._disk.pop(key)
+            if image is not None:
+                self.hits += 1
+                log.debug('Cover cache hit: %s hits, %s misses', self.hits, self.misses)
+                return image, key
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        image = extract()
+
+        self._lock.acquire()
+        try:
+            self._add_memory(key, image)
+            self._add_disk(key, image)
+            log.debug('Cover cache miss: %s hits, %s misses, memory %s bytes, disk %s bytes', self.hits, self.misses, self._memory_bytes, self._disk_bytes)
+        finally:
+            self._lock.release()
+        return image, key
+
+    def _add_memory(self, key, image):
+        if key in self._memory or len(image) > self.max_memory:
+            return
+        self._memory[key] = image
+        self._memory_bytes += len(image)
+        while self._memory_bytes > self.max_memory:
+            oldkey, oldimage = self._memory.popitem(last=False)
+            self._memory_bytes -= len(oldimage)
+
+    def _add_disk(self, key, image):
+        if not self.cachedir or key in self._disk or len(image) > self.max_disk:
+            return
+        try:
+            f = open(os.path.join(self.cachedir, key), 'wb')
+            f.write(image)
+            f.close()
+        except (IOError, OSError), e:
+            log.debug('Cover cache write failed: %s', e)
+            return
+        self._disk[key] = len(image)
+        self._disk_bytes += len(image)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        while self._disk_bytes > self.max_disk and self._disk:
+            oldkey, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(os.path.join(self.cachedir, oldkey))
+            except OSError:
+                pass
+
+
+cover_cache = CoverCache()
+
+
+def extract_embedded_cover(path, coveroffsets):
+    """ Reads embedded cover art from a music file, given the list of
+    offset, length pairs (optionally followed by an encoding type) stored
+    for it at scan time.
+    """
+    coveroffsets = list(coveroffsets)
+    image = ''
+    enctype = ''
+    if len(coveroffsets) % 2:
+        enctype = coveroffsets.pop()
+    fileoffset = open(path, 'rb')
+    for i in xrange(0, len(coveroffsets), 2):
+        offset = int(coveroffsets[i])
+        length = int(coveroffsets[i+1])
+        fileoffset.seek(offset)
+        image += fileoffset.read(length)
+    fileoffset.close()
+    if enctype == 'base64flac':
+        try:
+            data = base64.b64decode(image)
+        except TypeError, e:
+            data = None
+            log.debug(e)
+        if data:
+            temp = StringIO.StringIO(data)
+            itype, length = struct.unpack('>2I', temp.read(8))
+            mime = temp.read(length).decode('UTF-8', 'replace')
+            length, = struct.unpack('>I', temp.read(4))
+            desc = temp.read(length).decode('UTF-8', 'replace')
+            (width, height, depth, colors, length) = struct.unpack('>5I', temp.read(20))
+            image = temp.read(length)
+    return image
+
+
 class StaticFileSonos(object):
     """ Object that matches with a file and makes it available on the server.
     """
@@ -546,11 +714,11 @@ class StaticFileSonos(object):
         self._disposition = disposition
 
         if not self._content_type:
-            log.debug('_content_type before: %s' % self._content_type)
+            log.debug('_content_type before: %s', self._content_type)
             self._guess_content_type()
-            log.debug('_content_type after : %s' % self._content_type)
+            log.debug('_content_type after : %s', self._content_type)
 
-        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s' % (dummyname, name, path, self._content_type, self._disposition))
+        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s', dummyname, name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self, path=None):
@@ -563,7 +731,7 @@ class StaticFileSonos(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (path, self._content_type))
+        log.debug('File %s type %s', path, self._content_type)
 
 
     def application(self, environ, start_response, response=None):
@@ -579,9 +747,9 @@ class StaticFileSonos(object):
 #        import traceback        
 #        traceback.print_stack()
 
-        log.debug('StaticFileSonos application environ %s' % environ)
-        log.debug('StaticFileSonos application start_response %s' % start_response)
-        log.debug('StaticFileSonos application response %s' % response)
+        log.debug('StaticFileSonos application environ %s', environ)
+        log.debug('StaticFileSonos application start_response %s', start_response)
+        log.debug('StaticFileSonos application response %s', response)
 
         req = Request(environ)
 
@@ -597,12 +765,12 @@ class StaticFileSonos(object):
         coveroffsets = None
 
         log.debug('=========================================')
-        log.debug('qs: %s' % environ['QUERY_STRING'])
-        log.debug('dn: %s' % self.dummyname)
-        log.debug('name: %s' % self.name)
-        log.debug('path: %s' % self.path)
-        log.debug('cover: %s' % self.cover)
-        log.debug('_content_type: %s' % self._content_type)
+        log.debug('qs: %s', environ['QUERY_STRING'])
+        log.debug('dn: %s', self.dummyname)
+        log.debug('name: %s', self.name)
+        log.debug('path: %s', self.path)
+        log.debug('cover: %s', self.cover)
+        log.debug('_content_type: %s', self._content_type)
         log.debug('=========================================')
 
         # Sonos queries for the album art either via a query string, or directly to the art specified
@@ -612,7 +780,7 @@ class StaticFileSonos(object):
                 # art is embedded for this file
                 coverparts = self.cover.split('_')
                 coveroffsets = coverparts[1].split(',')
-                log.debug('coveroffsets: %s' % coveroffsets)
+                log.debug('coveroffsets: %s', coveroffsets)
             else:
                 path = self.cover
                 if not path or path == '':
@@ -621,7 +789,7 @@ class StaticFileSonos(object):
                 self._guess_content_type(path)
 
         if not os.path.exists(path):
-            log.warning('Received request on missing file: %s' % path)
+            log.warning('Received request on missing file: %s', path)
             return simple_response(500, r.start_response, 'File not available.')
 
         try:
@@ -629,46 +797,31 @@ class StaticFileSonos(object):
         except OSError:
             return simple_response(404, r.start_response)
 
-        fileoffset = open(path, 'rb')
+        etag = None
         if coveroffsets:
-            # extract art from music file
-            image = ''
-            coverlength = 0
-            enctype = ''
-            if len(coveroffsets) % 2:
-                enctype = coveroffsets.pop()
-            for i in xrange(0, len(coveroffsets), 2):
-                offset = int(coveroffsets[i])
-                length = int(coveroffsets[i+1])
-                coverlength += length
-                fileoffset.seek(offset)
-                image += fileoffset.read(length)
-            fileoffset.close()
-            if enctype == 'base64flac':
-                try:
-                    data = base64.b64decode(image)
-                except TypeError, e:
-                    data = None
-                    log.debug(e)
-                if data:
-                    temp = StringIO.StringIO(data)
-                    itype, length = struct.unpack('>2I', temp.read(8))
-                    mime = temp.read(length).decode('UTF-8', 'replace')
-                    length, = struct.unpack('>I', temp.read(4))
-                    desc = temp.read(length).decode('UTF-8', 'replace')
-                    (width, height, depth, colors, length) = struct.unpack('>5I', temp.read(20))
-                    image = temp.read(length)
-                    coverlength = length
-            content_length = coverlength
+            # extract art from music file (or get it from the cache)
+            image, etag = cover_cache.get(self.cover, st.st_mtime, lambda: extract_embedded_cover(path, coveroffsets))
+            content_length = len(image)
             r.body = image
         else:
             content_length = st.st_size
-            r.body = fileoffset
+            r.body = open(path, 'rb')
 
         h = r.headers
         h['Last-modified'] = rfc822.formatdate(st.st_mtime)
         h['Content-type'] = self._content_type
 
+        if etag:
+            h['ETag'] = '"%s"' % etag
+            if req.headers.get('if-none-match', None) == h['ETag'] or \
+               req.headers.get('if-modified-since', None) == h['Last-modified']:
+                # controller already has this cover
+                r.status = 304
+                r.body = ['']
+                if not response:
+                    r._respond()
+                return r.body
+
         if self._disposition:
             h['Content-disposition'] = '%s; filename="%s"' % \
                                        (self._disposition, self.name)
@@ -716,9 +869,9 @@ class StaticFileSonos(object):
                     h['Content-length'] = str(s)
 
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
         if response:
-            log.debug("headers: %s", str(response.headers))
+            log.debug("headers: %s", response.headers)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -777,7 +930,7 @@ class TranscodedFileSonos(object):
         if not self._content_type:
             self._guess_content_type()
 
-        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s' % (dummyname, name, path, self._content_type, self._disposition))
+        log.debug('dummyname: %s   name: %s   path: %s   _content_type: %s   _disposition: %s', dummyname, name, path, self._content_type, self._disposition)
 
 
     def _guess_content_type(self, path=None):
@@ -790,7 +943,7 @@ class TranscodedFileSonos(object):
         self._content_type = mimetypes.types_map.get('.%s' %
                                                      path.split('.')[-1],
                                                      'text/plain')
-        log.debug('File %s type %s' % (path, self._content_type))
+        log.debug('File %s type %s', path, self._content_type)
 
 
     def application(self, environ, start_response, response=None):
@@ -806,9 +959,9 @@ class TranscodedFileSonos(object):
 #        import traceback        
 #        traceback.print_stack()
 
-        log.debug('TranscodedFileSonos application environ %s' % environ)
-        log.debug('TranscodedFileSonos application start_response %s' % start_response)
-        log.debug('TranscodedFileSonos application response %s' % response)
+        log.debug('TranscodedFileSonos application environ %s', environ)
+        log.debug('TranscodedFileSonos application start_response %s', start_response)
+        log.debug('TranscodedFileSonos application response %s', response)
 
         req = Request(environ)
 
@@ -832,7 +985,7 @@ class TranscodedFileSonos(object):
 
         if not self.stream:
             if not os.path.exists(path):
-                log.warning('Received request on missing file: %s' % path)
+                log.warning('Received request on missing file: %s', path)
                 return simple_response(500, r.start_response, 'File not available.')
 
             try:
@@ -840,12 +993,26 @@ class TranscodedFileSonos(object):
             except OSError:
                 return simple_response(404, r.start_response)
 
+        cached = None
+        if not albumart and not self.stream:
+            cached = transcode.transcode_cache.lookup(path, st.st_mtime, self.transcodetype)
+
         if albumart:
             r.body = open(path, 'rb')
             content_length = st.st_size
+        elif cached:
+            # serve the earlier transcode output as a static file
+            r.body = open(cached, 'rb')
+            content_length = os.path.getsize(cached)
         else:
-            r.body = transcode.transcode(path, self.transcodetype)
+            try:
+                r.body = transcode.transcode(path, self.transcodetype)
+            except transcode.TranscodeBusy, e:
+                return simple_response(503, r.start_response, str(e))
             content_length = 0
+            if not self.stream and 'range' not in req.headers:
+                # fill the cache as the output is sent
+                r.body = transcode.transcode_cache.tee(path, st.st_mtime, self.transcodetype, r.body)
 
         h = r.headers
         if not self.stream:
@@ -899,9 +1066,9 @@ class TranscodedFileSonos(object):
                     h['Content-length'] = str(s)
 
 
-        log.debug("headers: %s", str(h))
+        log.debug("headers: %s", h)
         if response:
-            log.debug("headers: %s", str(response.headers))
+            log.debug("headers: %s", response.headers)
 
         if not response:
             # Normal request, not redirected. When redirected, who respond()s is
@@ -987,7 +1154,7 @@ class Resource(object):
         """ WSGI application callback. May not be called directly by the
         user.
         """
-        log.debug('Resource application environ %s' % environ)
+        log.debug('Resource application environ %s', environ)
         
 #        if 'REQUEST_METHOD' in environ:
 #            if environ['REQUEST_METHOD'] == 'GET':
@@ -1039,22 +1206,22 @@ class Resource(object):
             render = self.get_render(req.uri, req.params)
 
             if not render:
-                log.error('Could not find resource at %s' % req.uri)
+                log.error('Could not find resource at %s', req.uri)
                 return simple_response(404, start_response)
 
             if render != self:
 
-                log.debug('environ %s' % environ)
-                log.debug('oldenviron %s' % oldenviron)
-                log.debug('req.uri %s' % req.uri)
-                log.debug('req.params %s' % req.params)
-                log.debug('req %s' % req)
-                log.debug('resp %s' % resp)
+                log.debug('environ %s', environ)
+                log.debug('oldenviron %s', oldenviron)
+                log.debug('req.uri %s', req.uri)
+                log.debug('req.params %s', req.params)
+                log.debug('req %s', req)
+                log.debug('resp %s', resp)
 
                 proxybody = render.render(oldenviron, start_response)
 
-                log.debug('resp headers %s' % resp.headers)
-                log.debug('resp status %s' % resp.status)
+                log.debug('resp headers %s', resp.headers)
+                log.debug('resp status %s', resp.status)
 
                 if not proxybody and not req.headers:
                         log.error('Body and headers were empty.')
@@ -1088,11 +1255,11 @@ class Resource(object):
                         except zlib.error, e:
                             log.debug(e)
                     '''
-                    log.debug('environ: %s' % environ)
-                    log.debug('req.headers: %s' % req.headers)
+                    log.debug('environ: %s', environ)
+                    log.debug('req.headers: %s', req.headers)
 
                     canzip = req.headers.get('accept-encoding', None)
-                    log.debug('canzip: %s' % canzip)
+                    log.debug('canzip: %s', canzip)
 
                     if canzip != None:
 
@@ -1143,15 +1310,56 @@ class CustomResource(Resource):
 class SonosResource(Resource):
     """
     """
-    def __init__(self, name, proxy):
+    def __init__(self, name, proxy, max_files=10000):
         """ Constructor for the Resource class.
 
         @param name: resource name visible on the webserver
         @type name: string
+        @param max_files: number of static/transcoded file entries to keep,
+                          least recently used entries are dropped beyond
+                          this (and rebuilt by proxy.get_Track on request)
+        @type max_files: integer
         """
         self.name = name
         self.proxy = proxy
         self._tree = {}
+        self._files = OrderedDict()
+        self._files_lock = threading.Lock()
+        self.max_files = max_files
+        self.evictions = 0
+
+    def add_file(self, file):
+        """ Adds a file entry to the LRU file registry, evicting the least
+        recently used entries if the registry is full.
+        """
+        self._files_lock.acquire()
+        try:
+            self._files.pop(file.dummyname, None)
+            self._files[file.dummyname] = file
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+                self.evictions += 1
+        finally:
+            self._files_lock.release()
+
+    def get_file(self, name):
+        """ Returns the file entry for name (marking it as most recently
+        used), or None if it is not registered.
+        """
+        self._files_lock.acquire()
+        try:
+            file = self._files.pop(name, None)
+            if file is not None:
+                self._files[name] = file
+            return file
+        finally:
+            self._files_lock.release()
+
+    def registry_stats(self):
+        """ Returns the number of registered file entries and the number
+        evicted so far.
+        """
+        return len(self._files), self.evictions
 
     def add_static_file(self, file):
         """ Adds a static file to the resource.
@@ -1162,14 +1370,14 @@ class SonosResource(Resource):
         @note: if the file name is already present on the tree, it will get
                overriden
         """
-        log.debug("SonosResource add_static_file file: %s" % file)
-        log.debug("SonosResource add_static_file name: %s" % file.name)
+        log.debug("SonosResource add_static_file file: %s", file)
+        log.debug("SonosResource add_static_file name: %s", file.name)
         
         if not isinstance(file, StaticFileSonos):
             raise ValueError('file must be a StaticFileSonos instance.')
 #        if file.dummyname in self._tree:
 #            warnings.warn('name override: %s' % file.dummyname)
-        self._tree[file.dummyname] = file
+        self.add_file(file)
 
     def add_transcoded_file(self, file):
         """ Adds a static file to the resource.
@@ -1180,15 +1388,15 @@ class SonosResource(Resource):
         @note: if the file name is already present on the tree, it will get
                overriden
         """
-        log.debug("SonosResource add_transcoded_file file: %s" % file)
-        log.debug("SonosResource add_transcoded_file name: %s" % file.name)
-        log.debug("SonosResource add_transcoded_file dummyname: %s" % file.dummyname)
+        log.debug("SonosResource add_transcoded_file file: %s", file)
+        log.debug("SonosResource add_transcoded_file name: %s", file.name)
+        log.debug("SonosResource add_transcoded_file dummyname: %s", file.dummyname)
         
         if not isinstance(file, TranscodedFileSonos):
             raise ValueError('file must be a TranscodedFileSonos instance.')
 #        if file.dummyname in self._tree:
 #            warnings.warn('name override: %s' % file.dummyname)
-        self._tree[file.dummyname] = file
+        self.add_file(file)
 
     def add_resource(self, resource):
         """ Adds a resource to the resource.
@@ -1209,7 +1417,7 @@ class SonosResource(Resource):
         """ WSGI application callback. May not be called directly by the
         user.
         """
-        log.debug('SonosResource application environ %s' % environ)
+        log.debug('SonosResource application environ %s', environ)
         
         if environ['SCRIPT_NAME'] == '/':
             # HACK - work out why circuits is doing this
@@ -1218,20 +1426,23 @@ class SonosResource(Resource):
             
         path = wsgiref.util.shift_path_info(environ)
 
-        log.debug('SonosResource application path %s' % path)
-        log.debug('SonosResource application tree %s' % self._tree)
+        log.debug('SonosResource application path %s', path)
+        log.debug('SonosResource application files %s, evicted %s', *self.registry_stats())
 
         if path in self._tree:
             # Path directly available
             return self._tree[path].application(environ, start_response)
-        else:
-            # Path not found - may have been called from queue when file has not been browsed
+        file = self.get_file(path)
+        if file is None:
+            # Path not found - may have been called from queue when file has not been browsed,
+            # or the entry may have been evicted from the registry
             self.proxy.get_Track(path)
-            log.debug('SonosResource application tree now %s' % self._tree)
-            if path in self._tree:
-                return self._tree[path].application(environ, start_response)
+            file = self.get_file(path)
+            log.debug('SonosResource application files now %s, evicted %s', *self.registry_stats())
+        if file is not None:
+            return file.application(environ, start_response)
 
-        log.error('Could not find resource %s' % path)
+        log.error('Could not find resource %s', path)
         return simple_response(404, start_response)
 
     def get_render(self, uri, params):
@@ -1405,8 +1616,8 @@ def check_port(host, port, timeout=1.0):
 
     Copyright (c) 2002-2008, CherryPy Team (team@cherrypy.org)
     """
-    log.debug('host: %s' % host)
-    log.debug('port: %s' % port)
+    log.debug('host: %s', host)
+    log.debug('port: %s', port)
     if not host:
         raise ValueError("Host values of '' or None are not allowed.")
     host = client_host(host)
@@ -1548,7 +1759,11 @@ class WebServer(Resource):
         if not self.is_running():
             if not self.adapter:
                 raise RuntimeError('Adapter not set.')
-            threaded_call.run_async_function(self.adapter.start)
+            # serves until stopped, so gets its own thread rather than
+            # holding a thread pool worker
+            t = threading.Thread(target=self.adapter.start)
+            t.setDaemon(True)
+            t.start()
             self.running = True
         else:
             log.warning(self.msg_already_started)
@@ -72,6 +72,7 @@ class BaseDevice(object):
         self.serial_number = serial_number
         self.upc = upc
         self.presentation_url = presentation_url
+        self.software_version = ''
         self.services = {}
         self.devices = {}
         self.icons = []
@@ -34,6 +34,23 @@ class BaseServiceBuilder(object):
         self._build_service()
         return True
 
+    def build_from_description(self, description):
+        """ Builds a service from the actions and state variables returned by
+        description() for an identical SCPD, without parsing it again.
+
+        @return: True if service build succeeded, otherwise False.
+        @rtype: bool
+        """
+        self._actions, self._variables = description
+        self._build_service()
+        return True
+
+    def description(self):
+        """ Returns the actions and state variables parsed from the SCPD XML,
+        for use with build_from_description().
+        """
+        return self._actions, self._variables
+
     def _parse_description(self, fd):
         """ Parses the actions and state variables of a service given a file
         descriptor containing the SCPD XML. File descriptor must be open.
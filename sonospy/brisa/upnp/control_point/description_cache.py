@@ -0,0 +1,128 @@
+# Licensed under the MIT license
+# http://opensource.org/licenses/mit-license.php or see LICENSE file.
+# Copyright 2007-2008 Brisa Team <brisa-develop@garage.maemo.org>
+
+""" Cache of service descriptions (SCPDs) for the control point.
+
+Devices of the same model running the same firmware serve identical SCPDs,
+so the parsed actions and state variables of each SCPD are kept in memory
+and under the BRisa home folder, keyed by manufacturer, model, firmware
+version and SCPD path. Devices that don't report a firmware version
+(softwareVersion in their description) are not cached.
+
+Callers fall back to fetching the SCPD from the device if a cached
+description doesn't build, and should remove() it so it is replaced.
+
+The cache can be turned off with:
+
+    brisa-conf -s brisa -p description_cache off
+"""
+
+import os
+import hashlib
+import threading
+import urlparse
+import cPickle
+
+from brisa.core import log, config
+
+_cache = {}
+_lock = threading.Lock()
+_enabled = None
+
+cache_dir = os.path.join(config.brisa_home, 'description_cache')
+
+
+def is_enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = config.get_parameter('brisa', 'description_cache') != 'off'
+    return _enabled
+
+
+def get_key(device, scpd_url):
+    """ Returns the cache key for a service of a device, or None if its
+    description should not be cached.
+    """
+    version = getattr(device, 'software_version', '')
+    if not is_enabled() or not version or not scpd_url:
+        return None
+    return (device.manufacturer, device.model_name, device.model_number,
+            version, urlparse.urlparse(scpd_url)[2])
+
+
+def _filename(key):
+    return os.path.join(cache_dir, '%s.scpd' % hashlib.md5(repr(key)).hexdigest())
+
+
+def get(key):
+    """ Returns the cached description for key, or None.
+    """
+    _lock.acquire()
+    try:
+        if key in _cache:
+            return _cache[key]
+    finally:
+        _lock.release()
+
+    description = None
+    try:
+        f = open(_filename(key), 'rb')
+        try:
+            filekey, description = cPickle.load(f)
+        finally:
+            f.close()
+        if filekey != key:
+            description = None
+    except IOError:
+        pass
+    except Exception, e:
+        log.debug('Could not read cached description %s: %s', key, e)
+
+    if description is not None:
+        _lock.acquire()
+        try:
+            _cache[key] = description
+        finally:
+            _lock.release()
+    return description
+
+
+def put(key, description):
+    """ Stores a description in memory and on disk.
+    """
+    _lock.acquire()
+    try:
+        _cache[key] = description
+    finally:
+        _lock.release()
+
+    filename = _filename(key)
+    tmpname = '%s.%s.%s' % (filename, os.getpid(), threading.currentThread().ident)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        f = open(tmpname, 'wb')
+        try:
+            cPickle.dump((key, description), f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if os.name != 'posix' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmpname, filename)
+    except (IOError, OSError), e:
+        log.debug('Could not write cached description %s: %s', key, e)
+
+
+def remove(key):
+    """ Drops a description that turned out to be stale or corrupt.
+    """
+    _lock.acquire()
+    try:
+        _cache.pop(key, None)
+    finally:
+        _lock.release()
+    try:
+        os.remove(_filename(key))
+    except OSError:
+        pass
@@ -36,6 +36,7 @@ from brisa.upnp.base_service import BaseService, BaseStateVariable,\
                                     format_rel_url
 from brisa.upnp.control_point.action import Action, Argument
 from brisa.upnp.base_service_builder import BaseServiceBuilder
+from brisa.upnp.control_point import description_cache
 
 
 class StateVariable(BaseStateVariable):
@@ -56,6 +57,12 @@ class ServiceBuilder(BaseServiceBuilder):
         except:
             return False
 
+    def build_from_description(self, description):
+        try:
+            return BaseServiceBuilder.build_from_description(self, description)
+        except:
+            return False
+
     def _create_argument(self, arg_name, arg_direction, arg_state_var):
         return Argument(arg_name, arg_direction, arg_state_var.name)
 
@@ -101,6 +108,9 @@ class Service(BaseService):
         self.presentation_url = presentation_url
         self._auto_renew_subs = None
         self._soap_service = None
+        # set by the device builder if the SCPD can be shared with other
+        # devices of the same model and firmware
+        self.description_key = None
 
         if not brisa.__skip_soap_service__:
             if is_file(self.scpd_url):
@@ -123,6 +133,8 @@ class Service(BaseService):
         """
 #        print "_build_sync scpd_url: " + str(self.scpd_url)
 #        print "_build_sync url_base: " + str(self.url_base)
+        if self._build_from_cache():
+            return
         if is_file(self.scpd_url):
             fd = open(self.scpd_url[8:], 'r')
         else:
@@ -135,7 +147,7 @@ class Service(BaseService):
         if not fd:
             log.debug('Could not fetch SCPD URL %s' % self.scpd_url)
             raise RuntimeError('Could not build Service %s', self)
-        ServiceBuilder(self, fd).build()
+        self._build_from_fd(fd)
 
     def _build_async(self, cb):
         """ Builds the service asynchronously. Forwards True to the specified
@@ -145,6 +157,10 @@ class Service(BaseService):
 #        print "_build_async: " + str(self.scpd_url)
 #        print "_build_async url_base: " + str(self.url_base)
         
+        if self._build_from_cache():
+            cb(True)
+            return
+
         # TODO: test file processing below!
         if is_file(self.scpd_url):
 #            fd = open(self.scpd_url[8:], 'r')
@@ -173,11 +189,40 @@ class Service(BaseService):
 #        print '_fetch_scpd_async_done fd: ' + str(fd)
 #        print '_fetch_scpd_async_done cb: ' + str(cb)
         if fd:
-            parsed_ok = ServiceBuilder(self, fd).build()
+            parsed_ok = self._build_from_fd(fd)
 #            print '_fetch_scpd_async_done parsed_ok: ' + str(parsed_ok)
             if cb:
                 cb(parsed_ok)
 
+    def _build_from_cache(self):
+        """ Builds the service from the description cached for another device
+        of the same model and firmware. Returns False if there isn't one, or
+        if it doesn't build, in which case it is dropped from the cache.
+        """
+        if not self.description_key:
+            return False
+        description = description_cache.get(self.description_key)
+        if description is None:
+            return False
+        if ServiceBuilder(self, None).build_from_description(description):
+            log.debug('Built service %s from cached description', self.id)
+            return True
+        log.debug('Cached description for service %s did not build', self.id)
+        description_cache.remove(self.description_key)
+        self._actions = {}
+        self._state_variables = {}
+        return False
+
+    def _build_from_fd(self, fd):
+        """ Builds the service from the SCPD XML in fd, caching the parsed
+        description if the service can share it.
+        """
+        builder = ServiceBuilder(self, fd)
+        parsed_ok = builder.build()
+        if parsed_ok and self.description_key:
+            description_cache.put(self.description_key, builder.description())
+        return parsed_ok
+
     def _fetch_scpd_async_error(self, cb=None, error=None):
         """ Called when the SCPD XML wasn't successfully fetched.
         """
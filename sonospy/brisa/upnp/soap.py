@@ -160,8 +160,7 @@ def build_soap_call(method, arguments, encoding=SOAP_ENCODING,
     log.debug(method)
     
     if method in ws_methods:
-        log.debug(unescape(result))
-        return unescape(result)
+        result = unescape(result)
     log.debug(result)
     return result
 
@@ -561,10 +560,10 @@ class SOAPProxy(object):
 
         log.debug('#### SOAPProxy #########################################')
         log.debug('#### SOAP BEFORE START #################################')
-        log.debug('#### SOAP self.url     : %s' % str(self.url))
-        log.debug('#### SOAP payload      : %s' % str(payload))
-        log.debug('#### SOAP ns           : %s' % str(ns))
-        log.debug('#### SOAP soapaction   : %s' % str(soapaction))
+        log.debug('#### SOAP self.url     : %s', self.url)
+        log.debug('#### SOAP payload      : %s', payload)
+        log.debug('#### SOAP ns           : %s', ns)
+        log.debug('#### SOAP soapaction   : %s', soapaction)
         log.debug('#### SOAP BEFORE HTTP CALL ###################################')
 
         result = HTTPTransport().call(self.url, payload, ns,
@@ -616,10 +615,10 @@ class SOAPProxyFile(object):
 
         log.debug('#### SOAPProxyFile #####################################')
         log.debug('#### SOAP BEFORE START #################################')
-        log.debug('#### SOAP self.url     : %s' % str(self.url))
-        log.debug('#### SOAP payload      : %s' % str(payload))
-        log.debug('#### SOAP ns           : %s' % str(ns))
-        log.debug('#### SOAP soapaction   : %s' % str(soapaction))
+        log.debug('#### SOAP self.url     : %s', self.url)
+        log.debug('#### SOAP payload      : %s', payload)
+        log.debug('#### SOAP ns           : %s', ns)
+        log.debug('#### SOAP soapaction   : %s', soapaction)
         log.debug('#### SOAP BEFORE HTTP CALL ###################################')
 
         result = HTTPTransportFile().call(self.url, payload, ns,
@@ -660,11 +659,11 @@ class HTTPTransport(object):
         @rtype: string
         """
 
-        log.debug('#### HTTPTransport call - addr : %s' % str(addr))
-        log.debug('#### HTTPTransport call - data : %s' % str(data))
-        log.debug('#### HTTPTransport call - namespace : %s' % str(namespace))
-        log.debug('#### HTTPTransport call - soapaction : %s' % str(soapaction))
-        log.debug('#### HTTPTransport call - encoding : %s' % str(encoding))
+        log.debug('#### HTTPTransport call - addr : %s', addr)
+        log.debug('#### HTTPTransport call - data : %s', data)
+        log.debug('#### HTTPTransport call - namespace : %s', namespace)
+        log.debug('#### HTTPTransport call - soapaction : %s', soapaction)
+        log.debug('#### HTTPTransport call - encoding : %s', encoding)
 
         # Build a request
         addr = parse_url(addr)
@@ -730,10 +729,10 @@ class HTTPTransport(object):
         else:
             r = httplib.HTTPConnection(real_addr)
 
-        log.debug('#### HTTPTransport call - real_addr : %s' % real_addr)
-        log.debug('#### HTTPTransport call - real_path : %s' % real_path)
-        log.debug('#### HTTPTransport call - addr.scheme : %s' % addr.scheme)
-        log.debug('#### HTTPTransport call - addr.hostname : %s' % addr.hostname)
+        log.debug('#### HTTPTransport call - real_addr : %s', real_addr)
+        log.debug('#### HTTPTransport call - real_path : %s', real_path)
+        log.debug('#### HTTPTransport call - addr.scheme : %s', addr.scheme)
+        log.debug('#### HTTPTransport call - addr.hostname : %s', addr.hostname)
 
         r.putrequest("POST", real_path, skip_host=1, skip_accept_encoding=1)
 #        r.putheader("ACCEPT-ENCODING", 'gzip')
@@ -778,9 +777,9 @@ class HTTPTransport(object):
         headers = response.msg
 
         log.debug('#### HTTP AFTER START #################################')
-        log.debug('#### HTTP code        : %s' % str(code))
-        log.debug('#### HTTP msg         : %s' % str(msg))
-        log.debug('#### HTTP headers     : %s' % str(headers))
+        log.debug('#### HTTP code        : %s', code)
+        log.debug('#### HTTP msg         : %s', msg)
+        log.debug('#### HTTP headers     : %s', headers)
         log.debug('#### HTTP AFTER END ###################################')
 
         content_type = headers.get("content-type", "text/xml")
@@ -814,7 +813,7 @@ class HTTPTransport(object):
             print "UnicodeDecodeError"
             return data
             
-        log.debug('#### HTTP data        : %s' % d)
+        log.debug('#### HTTP data        : %s', d)
             
         return d
 
@@ -842,11 +841,11 @@ class HTTPTransportFile(object):
         @rtype: string
         """
 
-        log.debug('#### HTTPTransport call - addr : %s' % str(addr))
-        log.debug('#### HTTPTransport call - data : %s' % str(data))
-        log.debug('#### HTTPTransport call - namespace : %s' % str(namespace))
-        log.debug('#### HTTPTransport call - soapaction : %s' % str(soapaction))
-        log.debug('#### HTTPTransport call - encoding : %s' % str(encoding))
+        log.debug('#### HTTPTransport call - addr : %s', addr)
+        log.debug('#### HTTPTransport call - data : %s', data)
+        log.debug('#### HTTPTransport call - namespace : %s', namespace)
+        log.debug('#### HTTPTransport call - soapaction : %s', soapaction)
+        log.debug('#### HTTPTransport call - encoding : %s', encoding)
 
         # Build a request
         
@@ -881,10 +880,10 @@ class HTTPTransportFile(object):
         else:
             r = httplib.HTTPConnection(real_addr)
 
-        log.debug('#### HTTPTransport call - real_addr : %s' % real_addr)
-        log.debug('#### HTTPTransport call - real_path : %s' % real_path)
-        log.debug('#### HTTPTransport call - addr.scheme : %s' % addr.scheme)
-        log.debug('#### HTTPTransport call - addr.hostname : %s' % addr.hostname)
+        log.debug('#### HTTPTransport call - real_addr : %s', real_addr)
+        log.debug('#### HTTPTransport call - real_path : %s', real_path)
+        log.debug('#### HTTPTransport call - addr.scheme : %s', addr.scheme)
+        log.debug('#### HTTPTransport call - addr.hostname : %s', addr.hostname)
 
         r.putrequest("POST", real_path, skip_host=1, skip_accept_encoding=1)
         
@@ -931,9 +930,9 @@ class HTTPTransportFile(object):
         headers = response.msg
 
         log.debug('#### HTTP AFTER START #################################')
-        log.debug('#### HTTP code        : %s' % str(code))
-        log.debug('#### HTTP msg         : %s' % str(msg))
-        log.debug('#### HTTP headers     : %s' % str(headers))
+        log.debug('#### HTTP code        : %s', code)
+        log.debug('#### HTTP msg         : %s', msg)
+        log.debug('#### HTTP headers     : %s', headers)
         log.debug('#### HTTP AFTER END ###################################')
 
         content_type = headers.get("content-type", "text/xml")
@@ -974,7 +973,7 @@ class HTTPTransportFile(object):
             print "UnicodeDecodeError"
             return data
             
-        log.debug('#### HTTP data        : %s' % d)
+        log.debug('#### HTTP data        : %s', d)
             
         return d
 
@@ -999,7 +998,7 @@ class HTTPProxy(object):
         @rtype: string
         """
 
-        log.debug('#### HTTPProxy call - addr : %s' % str(addr))
+        log.debug('#### HTTPProxy call - addr : %s', addr)
 
         # Build a request
         addr = parse_url(addr)
@@ -1014,10 +1013,10 @@ class HTTPProxy(object):
         else:
             r = httplib.HTTPConnection(real_addr)
 
-        log.debug('#### HTTPProxy call - real_addr : %s' % real_addr)
-        log.debug('#### HTTPProxy call - real_path : %s' % real_path)
-        log.debug('#### HTTPProxy call - addr.scheme : %s' % addr.scheme)
-        log.debug('#### HTTPProxy call - addr.hostname : %s' % addr.hostname)
+        log.debug('#### HTTPProxy call - real_addr : %s', real_addr)
+        log.debug('#### HTTPProxy call - real_path : %s', real_path)
+        log.debug('#### HTTPProxy call - addr.scheme : %s', addr.scheme)
+        log.debug('#### HTTPProxy call - addr.hostname : %s', addr.hostname)
 
         headers = {}
         for key, value in environ.items():
@@ -1029,7 +1028,7 @@ class HTTPProxy(object):
 
         headers['host'] = real_addr
 
-        log.debug('#### HTTPProxy headers: %s' % str(headers))
+        log.debug('#### HTTPProxy headers: %s', headers)
 
         if 'range' in headers:
             # second request, return everything
@@ -1073,11 +1072,11 @@ class HTTPProxy(object):
 
         headers_out = parse_headers(res.msg)
 
-        log.debug('#### HTTPProxy headers_out: %s' % str(headers_out))
+        log.debug('#### HTTPProxy headers_out: %s', headers_out)
 
         status = '%s %s' % (res.status, res.reason)
 
-        log.debug('#### HTTPProxy status: %s' % str(status))
+        log.debug('#### HTTPProxy status: %s', status)
 
         start_response(status, headers_out)     # this is for the original GET from the ZP
 
@@ -1110,18 +1109,18 @@ class HTTPRedirect(object):
 
     def call(self, addr, environ, start_response):
 
-        log.debug('#### HTTPRedirect call - addr : %s' % str(addr))
+        log.debug('#### HTTPRedirect call - addr : %s', addr)
 
         status = '%s %s' % ('307', 'Temporary Redirect')
 
-        log.debug('#### HTTPRedirect status: %s' % str(status))
+        log.debug('#### HTTPRedirect status: %s', status)
 
         url = addr + environ['PATH_INFO']
 
         headers_out = []        
         headers_out.append(('Location', url))   
 
-        log.debug('#### HTTPRedirect headers_out: %s' % str(headers_out))
+        log.debug('#### HTTPRedirect headers_out: %s', headers_out)
 
         start_response(status, headers_out)
 
@@ -0,0 +1,239 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+from brisa.core import log
+
+class BrowseStore(object):
+    '''
+        Bounded store for the browse results pycpoint serves to the web UI.
+
+        Each browsed entry is held once, keyed by the full
+        'ref::type::menu::title' key the UI sends back, with its object id
+        and type and its res and xml if it is a track. As refs are reused
+        each time a container is browsed, entries from an earlier browse
+        of the same container (e.g. for a different search) stay valid
+        while their titles differ. Result sets (the lines returned for each
+        page of a browse) and the last index used for the refs under each
+        parent ref are held separately.
+
+        Entries, parent ids, sets and indices are dropped least recently
+        used first once there are more than max_entries/max_sets of them,
+        and when they haven't been used for max_age seconds. An entry that
+        has been dropped is not found, as if it had never been browsed, and
+        the UI has to browse to it again.
+
+        The store is shared rather than held per session: every request
+        comes through the web2py application, from one address, and the
+        data protocol carries no session id to partition it by. Expiry by
+        age stands in for session expiry.
+    '''
+
+    def __init__(self, max_entries=10000, max_sets=100, max_age=3600):
+        self.max_entries = max_entries
+        self.max_sets = max_sets
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            # key -> (id, type, res, xml, size, used)
+            self.entries = OrderedDict()
+            # id -> (parentid, used)
+            self.parents = OrderedDict()
+            # setkey -> (lines, size, used)
+            self.sets = OrderedDict()
+            # parent ref -> (last index, used)
+            self.indices = OrderedDict()
+            self.entry_bytes = 0
+            self.set_bytes = 0
+            self.evicted = 0
+        finally:
+            self.lock.release()
+
+    ###############
+    # entries
+    ###############
+
+    def add(self, key, id, type, res=None, xml=None, parentid=None):
+        size = sys.getsizeof(key) + sys.getsizeof(id) + sys.getsizeof(type)
+        if res != None:
+            size += sys.getsizeof(res) + sys.getsizeof(xml)
+        now = time.time()
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(key, None)
+            if old:
+                self.entry_bytes -= old[4]
+            self.entries[key] = (id, type, res, xml, size, now)
+            self.entry_bytes += size
+            if parentid != None:
+                self.parents.pop(id, None)
+                self.parents[id] = (parentid, now)
+            self._expire(now)
+        finally:
+            self.lock.release()
+
+    def _get(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop(key, None)
+            if entry == None:
+                return None
+            entry = entry[:5] + (time.time(), )
+            self.entries[key] = entry
+            return entry
+        finally:
+            self.lock.release()
+
+    def lookup(self, key):
+        # return (id, type) for an entry key, or None
+        entry = self._get(key)
+        if entry == None:
+            return None
+        return entry[0], entry[1]
+
+    def track(self, key):
+        # return (res, xml) for a track entry key, or None
+        entry = self._get(key)
+        if entry == None or entry[2] == None:
+            return None
+        return entry[2], entry[3]
+
+    def parent(self, id):
+        self.lock.acquire()
+        try:
+            parent = self.parents.pop(id, None)
+            if parent == None:
+                return None
+            self.parents[id] = (parent[0], time.time())
+            return parent[0]
+        finally:
+            self.lock.release()
+
+    ###############
+    # ref indices
+    ###############
+
+    def reset_index(self, setparent):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self.indices.pop(setparent, None)
+            self.indices[setparent] = (0, now)
+            self._expire(now)
+        finally:
+            self.lock.release()
+
+    def next_index(self, setparent):
+        # return the next index for a ref under setparent (starting again
+        # from 1 if the parent has been dropped)
+        self.lock.acquire()
+        try:
+            index = self.indices.pop(setparent, (0, None))[0] + 1
+            self.indices[setparent] = (index, time.time())
+            return index
+        finally:
+            self.lock.release()
+
+    ###############
+    # result sets
+    ###############
+
+    def new_set(self, setkey):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            old = self.sets.pop(setkey, None)
+            if old:
+                self.set_bytes -= old[1]
+            self.sets[setkey] = ([], 0, now)
+            self._expire(now)
+        finally:
+            self.lock.release()
+
+    def add_to_set(self, setkey, line):
+        self.lock.acquire()
+        try:
+            if setkey not in self.sets:
+                # set was dropped while it was being filled
+                return
+            lines, size, used = self.sets[setkey]
+            lines.append(line)
+            size += sys.getsizeof(line)
+            self.set_bytes += sys.getsizeof(line)
+            self.sets[setkey] = (lines, size, used)
+        finally:
+            self.lock.release()
+
+    def get_set(self, setkey):
+        # return the lines of a set, or None
+        self.lock.acquire()
+        try:
+            dataset = self.sets.pop(setkey, None)
+            if dataset == None:
+                return None
+            self.sets[setkey] = (dataset[0], dataset[1], time.time())
+            return dataset[0]
+        finally:
+            self.lock.release()
+
+    ###############
+    # eviction
+    ###############
+
+    def _expire(self, now):
+        # called with lock held
+        evicted = 0
+        oldest = now - self.max_age
+        while self.entries:
+            key = next(iter(self.entries))
+            entry = self.entries[key]
+            if len(self.entries) <= self.max_entries and entry[5] >= oldest:
+                break
+            del self.entries[key]
+            self.entry_bytes -= entry[4]
+            evicted += 1
+        while self.parents:
+            id = next(iter(self.parents))
+            if len(self.parents) <= self.max_entries and self.parents[id][1] >= oldest:
+                break
+            del self.parents[id]
+            evicted += 1
+        while self.sets:
+            setkey = next(iter(self.sets))
+            dataset = self.sets[setkey]
+            if len(self.sets) <= self.max_sets and dataset[2] >= oldest:
+                break
+            del self.sets[setkey]
+            self.set_bytes -= dataset[1]
+            evicted += 1
+        while self.indices:
+            setparent = next(iter(self.indices))
+            if len(self.indices) <= self.max_sets and self.indices[setparent][1] >= oldest:
+                break
+            del self.indices[setparent]
+            evicted += 1
+        if evicted:
+            self.evicted += evicted
+            log.debug('browse store dropped %s items: %s', evicted, self._stats())
+
+    def _stats(self):
+        return {'entries': len(self.entries),
+                'parents': len(self.parents),
+                'sets': len(self.sets),
+                'indices': len(self.indices),
+                'entry_bytes': self.entry_bytes,
+                'set_bytes': self.set_bytes,
+                'evicted': self.evicted}
+
+    def stats(self):
+        # counts and approximate memory used (in bytes) by the store
+        self.lock.acquire()
+        try:
+            return self._stats()
+        finally:
+            self.lock.release()
@@ -19,6 +19,7 @@ from xml.etree.ElementTree import tostring
 from brisa.core.network import url_fetch, parse_url
 from brisa.core.threaded_call import run_async_call
 from brisa.upnp.control_point.service import Service
+from brisa.upnp.control_point import description_cache
 from brisa.upnp.upnp_defaults import UPnPDefaults
 from brisa.upnp.control_point import ControlPointAV
 
@@ -301,6 +302,11 @@ class DeviceBuilder(object):
         self.device.upc = self.tree.findtext('.//{%s}UPC' % self.ns)
         self.device.presentation_url = self.tree.\
                                  findtext('.//{%s}presentationURL' % self.ns)
+        # embedded devices take the firmware version of their root device
+        software_version = self.tree.\
+                                 findtext('.//{%s}softwareVersion' % self.ns)
+        if software_version:
+            self.device.software_version = software_version
 
         self.device.location = self.location
         addr = parse_url(self.location)
@@ -336,6 +342,8 @@ class DeviceBuilder(object):
             service = Service(service_id, service_type, self.location,
                               scpd_url, control_url, event_sub_url,
                               presentation_url)
+            service.description_key = \
+                    description_cache.get_key(self.device, scpd_url)
             self.device.add_service(service)
 
     def _parse_icons(self):
@@ -358,6 +366,7 @@ class DeviceBuilder(object):
 
             for xml_device_element in embedded_device_tag:
                 d = self.device.__class__()
+                d.software_version = self.device.software_version
                 DeviceBuilder(d, self.location,
                               xml_device_element).cleanup()
                 self.device.add_device(d)
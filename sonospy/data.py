@@ -1,4 +1,7 @@
 import os
+import time
+import select
+import threading
 from brisa.core import webserver
 from brisa.core import log
 from xml.sax.saxutils import unescape
@@ -77,8 +80,12 @@ class PlayController(webserver.CustomResource):
         query = unescape(request.query, unescape_entities)
         ret = self.setter(query)
         response.status = 200
-#        response.body = make_utf8(ret)
-        response.body = ''
+        # the setter only returns data when the play can't be done
+        # (e.g. NOTFOUND for an entry the UI needs to browse again)
+        if isinstance(ret, list):
+            response.body = make_utf8(ret)
+        else:
+            response.body = ''
         return response.body
 
 class GetDeviceController(webserver.CustomResource):
@@ -167,6 +174,139 @@ class PollQueueController(webserver.CustomResource):
         response.status = 200
         return response.body
 
+class ChangeNotifier(object):
+    '''
+        Lets long-poll requests wait for the control point data to change.
+        changed() is called whenever renderer, queue or browse data is
+        updated; waiters note the sequence before reading the data and
+        wait for it to move on, so a change made in between isn't missed.
+        A timed Condition.wait polls in python 2, so each waiter blocks on
+        a pipe of its own (an Event where there are no pipes to select on)
+        that changed() writes to.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # wake pipe write fd (or Event) -> None, for each waiter
+        self.waiters = {}
+
+    def changed(self):
+        self.lock.acquire()
+        try:
+            self.sequence += 1
+            for waiter in self.waiters:
+                self.wake(waiter)
+        finally:
+            self.lock.release()
+
+    def wake(self, waiter):
+        # called with the lock held
+        if isinstance(waiter, int):
+            try:
+                os.write(waiter, 'x')
+            except OSError:
+                pass
+        else:
+            waiter.set()
+
+    def wait(self, sequence, timeout, max_waiters):
+        '''
+            Waits up to timeout seconds for the sequence to move on from
+            sequence. Returns False without waiting if max_waiters
+            requests are already waiting.
+        '''
+        wake_r = None
+        self.lock.acquire()
+        try:
+            if self.sequence != sequence:
+                return True
+            if len(self.waiters) >= max_waiters:
+                return False
+            if os.name == 'posix':
+                wake_r, waiter = os.pipe()
+            else:
+                waiter = threading.Event()
+            self.waiters[waiter] = None
+        finally:
+            self.lock.release()
+        try:
+            if wake_r is not None:
+                try:
+                    select.select([wake_r], [], [], timeout)
+                except (select.error, OSError):
+                    pass
+            else:
+                waiter.wait(timeout)
+        finally:
+            self.lock.acquire()
+            try:
+                del self.waiters[waiter]
+            finally:
+                self.lock.release()
+            if wake_r is not None:
+                os.close(wake_r)
+                os.close(waiter)
+        return True
+
+class LongPollController(webserver.CustomResource):
+    '''
+        Long-poll version of a poll controller. Takes the same query as
+        the poll it wraps, but rather than returning the idle reply
+        (NOCHANGE/NOTREADY) straight away it holds the request until the
+        data changes or timeout seconds pass, so a client can keep one
+        request outstanding instead of polling in a loop. If interval
+        returns a number of seconds the data is also re-read that often
+        while waiting (for data such as the play position that changes
+        without a notification). Only max_waiters requests are held at
+        once so that long polls can't use up the webserver threads; any
+        more get the busy reply (if there is one) rather than the idle
+        one, so that the client knows to back off instead of asking again
+        straight away.
+    '''
+
+    def __init__(self, data, name, getter, notifier, idle, timeout=25, max_waiters=4, interval=None, busy=None):
+        self.data = data
+        self.getter = getter
+        self.notifier = notifier
+        self.idle = idle
+        self.busy = busy
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.interval = interval
+        # the getters return lists that are updated in place, so each
+        # request reads and copies them in turn
+        self.lock = threading.Lock()
+        webserver.CustomResource.__init__(self, name)
+
+    def get(self, query):
+        self.lock.acquire()
+        try:
+            return list(self.getter(query))
+        finally:
+            self.lock.release()
+
+    def render(self, uri, request, response):
+        query = unescape(request.query, unescape_entities)
+        deadline = time.time() + self.timeout
+        while True:
+            sequence = self.notifier.sequence
+            data = self.get(query)
+            remaining = deadline - time.time()
+            if data != self.idle or remaining <= 0:
+                break
+            if self.interval:
+                interval = self.interval()
+                if interval:
+                    remaining = min(remaining, interval)
+            if not self.notifier.wait(sequence, remaining, self.max_waiters):
+                if self.busy != None:
+                    data = self.busy
+                break
+        response.body = make_utf8(data)
+        response.status = 200
+        return response.body
+
 def make_utf8(list):
     dt = []
     for e in list:
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+
+from brisa.core import log
+
+class ConnectionPool(object):
+    '''
+        Pool of read only connections to a database, shared by the
+        webserver threads. A connection is checked out with connect()
+        and returned to the pool by calling close() on it. Up to size
+        idle connections are kept open; if more threads than that are
+        querying at once extra connections are opened and are closed
+        again when they are returned.
+    '''
+
+    def __init__(self, dbspec, size=4, cache_size=2000, mmap_size=0):
+        self.dbspec = dbspec
+        self.size = size
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.checkouts = 0
+
+    def open(self):
+        # check_same_thread is off as a connection can be returned
+        # by a different thread from the one that last used it
+        db = sqlite3.connect(self.dbspec, check_same_thread = False)
+        # readers never write; a scan writing the database in WAL mode
+        # (see set_scan_pragmas) doesn't block them
+        try:
+            db.execute("PRAGMA query_only = ON;")
+        except sqlite3.Error:
+            pass
+        if self.cache_size:
+            db.execute("PRAGMA cache_size = %s;" % self.cache_size)
+        if self.mmap_size:
+            try:
+                db.execute("PRAGMA mmap_size = %s;" % self.mmap_size)
+            except sqlite3.Error:
+                pass
+        self.opened += 1
+        log.debug('dbpool opened connection %s', self.opened)
+        return db
+
+    def connect(self):
+        db = None
+        self.lock.acquire()
+        try:
+            self.checkouts += 1
+            if self.idle:
+                db = self.idle.pop()
+        finally:
+            self.lock.release()
+        if db == None:
+            db = self.open()
+        return PooledConnection(self, db)
+
+    def release(self, db):
+        # reset state a caller may have left on the connection
+        db.row_factory = None
+        try:
+            db.rollback()
+        except sqlite3.Error:
+            db.close()
+            return
+        self.lock.acquire()
+        try:
+            if len(self.idle) < self.size:
+                self.idle.append(db)
+                db = None
+        finally:
+            self.lock.release()
+        if db != None:
+            db.close()
+
+    def closeall(self):
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.lock.release()
+        for db in idle:
+            db.close()
+
+    def stats(self):
+        return len(self.idle), self.opened, self.checkouts
+
+class PooledConnection(object):
+    '''
+        Connection checked out of a ConnectionPool. Behaves as the
+        underlying sqlite3 connection except that close() returns it
+        to the pool. A connection that is dropped without being closed
+        is returned when it is garbage collected.
+    '''
+
+    def __init__(self, pool, db):
+        self.__dict__['_pool'] = pool
+        self.__dict__['_db'] = db
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._db, name, value)
+
+    def close(self):
+        db = self._db
+        if db != None:
+            self.__dict__['_db'] = None
+            self._pool.release(db)
+
+    def __del__(self):
+        self.close()
@@ -32,7 +32,8 @@ import zlib
 import sqlite3
 import optparse
 import ConfigParser
-from collections import defaultdict
+from collections import defaultdict, deque
+import multiprocessing
 import itertools
 from operator import itemgetter
 
@@ -41,6 +42,7 @@ from mutagen import File
 from mutagen.asf import ASFUnicodeAttribute     # seems to be an issue with multiple tag entries in wma files
 
 from scanfuncs import adjust_tracknumber, truncate_number
+from scanfuncs import set_scan_pragmas, BatchWriter, nocase_key
 import filelog
 
 from movetags import empty_database
@@ -167,6 +169,28 @@ else:
     work_virtual_extensions = {work_file_extension: 'work', virtual_file_extension: 'virtual'}
 
 tags_file_extension = '.tags'
+
+# write batching
+write_batch_size = 1000
+try:        
+    write_batch_size = config.getint('gettags', 'write_batch_size')
+except ConfigParser.NoSectionError:
+    pass
+except ConfigParser.NoOptionError:
+    pass
+
+# database pragmas
+db_pragmas = {'db_journal_mode': 'WAL',
+              'db_synchronous': 'NORMAL',
+              'db_cache_size': '10000',
+              'db_temp_store': 'MEMORY'}
+for pragma in db_pragmas.keys():
+    try:        
+        db_pragmas[pragma] = config.get('gettags', pragma)
+    except ConfigParser.NoSectionError:
+        pass
+    except ConfigParser.NoOptionError:
+        pass
     
 # symlinks
 follow_symlinks = False
@@ -256,6 +280,8 @@ def process_dir(scanpath, options, database):
     global db, c, db2, c2
 
     db = sqlite3.connect(database, check_same_thread = False)
+    set_scan_pragmas(db, db_pragmas['db_journal_mode'], db_pragmas['db_synchronous'],
+                     db_pragmas['db_cache_size'], db_pragmas['db_temp_store'])
     c = db.cursor()
 
     db2 = sqlite3.connect(database, check_same_thread = False)
@@ -270,11 +296,36 @@ def process_dir(scanpath, options, database):
     filelog.write_log(logstring)
 
     processing_count = 1
+    unchanged_count = 0
+
+    # tags and tags_update rows are written in batches
+    writer = BatchWriter(db, write_batch_size)
+    # tracks inserted or updated in the pending tags batch:
+    #   (path, filename) -> duplicate key of the new tags
+    #   duplicate key -> (path, filename, mime)
+    # where the duplicate key is (title, album, artist, track) with the
+    # strings folded as NOCASE folds them, so that the duplicate and
+    # existence checks only flush the batch when the rows they would
+    # read from tags are pending
+    pending_files = writer.index('tags', 'files')
+    pending_dups = writer.index('tags', 'dups')
 
     # process tags first
+    # - with multiple workers, tags are read ahead on a process pool
+    #   and written here in the same order as a serial scan
+
+    walk = os.walk(scanpath, followlinks=follow_symlinks)
+    pool = None
+    # stat indexes loaded ahead by walk_prefetch, by path
+    statindexes = {}
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers)
+        walk = walk_prefetch(walk, pool, db.cursor(), options.workers * 2, statindexes)
+    else:
+        walk = ((filepath, dirs, files, ([], None, {})) for filepath, dirs, files in walk)
 
     visitedpaths = []
-    for filepath, dirs, files in os.walk(scanpath, followlinks=follow_symlinks):
+    for filepath, dirs, files, prefetch in walk:
 
         filepath = os.path.abspath(os.path.realpath(filepath))
         if follow_symlinks:
@@ -543,6 +594,18 @@ def process_dir(scanpath, options, database):
         # add tagfile track entries to files list
         files += tagfiles
 
+        # load the stat index for the existing tracks in this directory
+        # (unless it was loaded when the directory was read ahead)
+        statindex = statindexes.pop(filepath, None)
+        if statindex is None:
+            statindex = load_stat_index(c, filepath)
+
+        # collect any tags (and file stats) read ahead by the worker pool
+        readfiles, result, filestats = prefetch
+        prefetched_tags = {}
+        if result:
+            prefetched_tags = dict(zip(readfiles, result.get()))
+
 #        print 'files: %s' % files
 
         for entry in files:
@@ -562,17 +625,12 @@ def process_dir(scanpath, options, database):
             else:
                 fn = entry
                 ff, ex = os.path.splitext(fn)
-                if fn.lower() in file_name_exclusions: continue
-                if ex.lower() in playlist_extensions: continue
-                if ex.lower() in work_virtual_extensions: continue
-                if ex.lower() in artextns: continue
-                if ex.lower() in file_extn_exclusions: continue
-                # new two will be processed via tuple entry above
-                if ex.lower() in tagsextns: continue    
-                if ex.lower() == tags_file_extension: continue
+                if not is_track_file(fn): continue
                 ffn = os.path.join(filepath, fn)
                 
-            if not os.access(ffn, os.R_OK): continue
+            # files stat'ed ahead were readable
+            filestat = filestats.pop(ffn, None)
+            if filestat is None and not os.access(ffn, os.R_OK): continue
 
             try:
                 if options.verbose:
@@ -581,7 +639,9 @@ def process_dir(scanpath, options, database):
                     sys.stderr.flush()
                     processing_count += 1
 
-                success, created, lastmodified, fsize, filler = getfilestat(ffn)
+                if filestat is None:
+                    filestat = getfilestat(ffn)
+                success, created, lastmodified, fsize, filler = filestat
                 
                 get_tags = True
                 
@@ -589,17 +649,9 @@ def process_dir(scanpath, options, database):
                 
                 # don't process file if it hasn't changed, unless art has been added/changed
                 if type(entry) is not tuple:
-                    try:
-                        c.execute("""select created, lastmodified, folderart from tags where path=? and filename=?""",
-                                    (filepath, fn))
-                        row = c.fetchone()
-                        if row:
-                            create, lastmod, art = row
-                            if create == created and lastmod == lastmodified and art == folderart:
-                                get_tags = False
-                    except sqlite3.Error, e:
-                        errorstring = "Error checking file created: %s" % e.args[0]
-                        filelog.write_error(errorstring)
+                    if track_unchanged(statindex, fn, created, lastmodified, folderart):
+                        get_tags = False
+                        unchanged_count += 1
 
 #                print "get_tags: %s, %s" % (get_tags, fn)
 
@@ -644,104 +696,16 @@ def process_dir(scanpath, options, database):
                                 
                     else:
                 
-                        try:
-                            kind = File(ffn, easy=True)
-                        except Exception:
-                            # note - Mutagen raises exceptions as various types, including Exception
-                            #        but we shouldn't really use Exception as the lowest common denominator here
-                            etype, value, tb = sys.exc_info()
-                            error = traceback.format_exception_only(etype, value)[0].strip()
-                            errorstring = "Error processing file: %s : %s" % (ffn, error)
+                        if ffn in prefetched_tags:
+                            success, tags, trackart, errorstring = prefetched_tags.pop(ffn)
+                        else:
+                            success, tags, trackart, errorstring = read_file_tags(ffn)
+                        if not success:
                             filelog.write_error(errorstring)
                             continue
-                            
-                        if isinstance(kind, mutagen.flac.FLAC):
-                            if len(kind.pictures) > 0:
-                                trackart_offset, trackart_length = kind.find_picture_offset()
-                                trackart = 'EMBEDDED_%s,%s' % (trackart_offset, trackart_length)
-                            if kind.tags:
-                                tags.update(kind.tags)
-                            # assume these attributes exist (note these will overwrite kind.tags)
-                            tags['type'] = 'FLAC'
-                            tags['length'] = kind.info.length               # seconds
-                            tags['sample_rate'] = kind.info.sample_rate     # Hz
-                            tags['bits_per_sample'] = kind.info.bits_per_sample     # bps
-                            tags['channels'] = kind.info.channels
-                            tags['mime'] = kind.mime[0]
-
-                        elif isinstance(kind, mutagen.mp3.EasyMP3):
-                            if kind.tags:
-                                picture, trackart_offset, trackart_length = kind.ID3.getpicture(kind.tags)
-                                if picture:
-                                    trackart = 'EMBEDDED_%s,%s' % (trackart_offset, trackart_length)
-                                tags.update(kind.tags)
-                                if 'performer' in tags:
-                                    tags['albumartist'] = tags['performer']
-
-                            # assume these attributes exist (note these will overwrite kind.tags)
-                            tags['type'] = 'MPEG %s layer %d' % (kind.info.version, kind.info.layer)
-                            tags['length'] = kind.info.length               # seconds
-                            tags['sample_rate'] = kind.info.sample_rate     # Hz
-                            tags['bitrate'] = kind.info.bitrate             # bps
-                            tags['mime'] = kind.mime[0]
-
-                        elif isinstance(kind, mutagen.easymp4.EasyMP4):
-                            if kind.tags:
-                                tags.update(kind.tags)
-                            # assume these attributes exist (note these will overwrite kind.tags)
-                            tags['type'] = 'MPEG-4 audio'
-                            tags['length'] = kind.info.length               # seconds
-                            tags['sample_rate'] = kind.info.sample_rate     # Hz
-                            tags['bits_per_sample'] = kind.info.bits_per_sample     # bps
-                            tags['channels'] = kind.info.channels
-                            tags['bitrate'] = kind.info.bitrate             # bps
-                            tags['mime'] = kind.mime[0]
-
-                        elif isinstance(kind, mutagen.asf.ASF):
-                            picture, trackart_offset, trackart_length = kind.get_picture()
-                            if picture:
-                                trackart = 'EMBEDDED_%s,%s' % (trackart_offset, trackart_length)
-                            # WMA
-                            if kind.tags:
-                                if u'WM/AlbumTitle' in kind.tags: tags['album'] = [v.__str__() for v in kind.tags[u'WM/AlbumTitle']]
-                                if u'WM/AlbumArtist' in kind.tags: tags['albumartist'] = [v.__str__() for v in kind.tags[u'WM/AlbumArtist']]
-                                if 'Author' in kind.tags: tags['artist'] = [v for v in encodeunicode(kind.tags['Author'])]
-                                if 'Title' in kind.tags: tags['title'] = [v for v in encodeunicode(kind.tags['Title'])]
-                                if u'WM/Genre' in kind.tags: tags['genre'] = [v.__str__() for v in kind.tags[u'WM/Genre']]
-                                if u'WM/TrackNumber' in kind.tags: tags['tracknumber'] = [v.__str__() for v in kind.tags[u'WM/TrackNumber']]
-                                if u'WM/Year' in kind.tags: tags['date'] = [v.__str__() for v in kind.tags[u'WM/Year']]
-                                
-                                if u'WM/TitleSortOrder' in kind.tags: tags['titlesort'] = [v.__str__() for v in kind.tags[u'WM/TitleSortOrder']]
-                                if u'WM/AlbumSortOrder' in kind.tags: tags['albumsort'] = [v.__str__() for v in kind.tags[u'WM/AlbumSortOrder']]
-                                if u'WM/ArtistSortOrder' in kind.tags: tags['artistsort'] = [v.__str__() for v in kind.tags[u'WM/ArtistSortOrder']]
-                                
-                            # assume these attributes exist (note these will overwrite kind.tags)
-                            tags['type'] = 'Windows Media Audio'
-                            tags['length'] = kind.info.length               # seconds
-                            tags['sample_rate'] = kind.info.sample_rate     # Hz
-                            tags['channels'] = kind.info.channels
-                            tags['bitrate'] = kind.info.bitrate             # bps
-                            tags['mime'] = kind.mime[0]
-
-                        elif isinstance(kind, mutagen.oggvorbis.OggVorbis):
-                            if kind.tags.sections:
-                                sections = ','.join(str(s) for s in kind.tags.sections)
-                                sections += ',base64flac'
-                                trackart = 'EMBEDDED_%s' % sections
-                                kind.tags['metadata_block_picture'] = 'removed'     # remove from tags as not needed
-                            if kind.tags:
-                                tags.update(kind.tags)
-                            # assume these attributes exist (note these will overwrite kind.tags)
-                            tags['type'] = 'Ogg Vorbis'
-                            tags['length'] = kind.info.length               # seconds
-                            tags['sample_rate'] = kind.info.sample_rate     # Hz
-                            tags['bitrate'] = kind.info.bitrate             # bps
-                            tags['mime'] = kind.mime[0]
-
-                        else:
-                            if not ex.lower() in tagsextns and not ex.lower() == tags_file_extension:
-                                logstring = "Filetype not catered for: %s" % ffn
-                                filelog.write_verbose_log(logstring)
+                        if not tags:
+                            logstring = "Filetype not catered for: %s" % ffn
+                            filelog.write_verbose_log(logstring)
                         
                     if any(tags):
                         logstring = tags
@@ -803,10 +767,23 @@ def process_dir(scanpath, options, database):
                     try:
                         # check if there is an existing record for these tags if appropriate
                         if ignore_duplicate_tracks == 'y':
-#                            c.execute("""select path, filename, mime from tags where title=? and album=? and artist=? and track=?""",
-                            c.execute("""select path, filename, mime from tags where title=? collate NOCASE and album=? collate NOCASE and artist=? collate NOCASE and track=?""",
-                                        (title, album, artist, str(track)))
-                            crow = c.fetchone()
+                            dupkey = nocase_key((title, album, artist)) + (str(track),)
+                            crow = pending_dups.get(dupkey)
+                            if crow and pending_files.get(crow[:2]) != dupkey:
+                                # that track has been updated again since
+                                crow = None
+                            if not crow:
+#                                c.execute("""select path, filename, mime from tags where title=? and album=? and artist=? and track=?""",
+                                c.execute("""select path, filename, mime from tags where title=? collate NOCASE and album=? collate NOCASE and artist=? collate NOCASE and track=?""",
+                                            (title, album, artist, str(track)))
+                                crow = c.fetchone()
+                                if crow and crow[:2] in pending_files and pending_files[crow[:2]] != dupkey:
+                                    # the tags of the track found are being changed
+                                    # in the pending batch, write it and look again
+                                    writer.flush('tags')
+                                    c.execute("""select path, filename, mime from tags where title=? collate NOCASE and album=? collate NOCASE and artist=? collate NOCASE and track=?""",
+                                                (title, album, artist, str(track)))
+                                    crow = c.fetchone()
                             if crow:
                                 duppath, dupfilename, dupmime = crow
                                 # check that we haven't just found the track we're processing
@@ -867,6 +844,7 @@ def process_dir(scanpath, options, database):
                                                     o_albumartistsort, o_composersort)
                                             # check whether the duplicate we are deleting was created on this scan
                                             dupauditdelete = True
+                                            writer.flush()
                                             c.execute("""select updatetype from tags_update where id=? and scannumber=?""", (o_id, scannumber))
                                             crow = c.fetchone()
                                             if crow:
@@ -891,6 +869,11 @@ def process_dir(scanpath, options, database):
                                             logstring = "DELETE: " + str(tags)
                                             filelog.write_verbose_log(logstring)
                                             c.execute("""delete from tags where id=?""", (o_id,))
+                                            if o_path == filepath:
+                                                statindex.pop(o_filename, None)
+                                            elif o_path in statindexes:
+                                                # directory has been read ahead
+                                                statindexes[o_path].pop(o_filename, None)
 
                                         except sqlite3.Error, e:
                                             errorstring = "Error processing duplicate deletion: %s" % e.args[0]
@@ -912,7 +895,7 @@ def process_dir(scanpath, options, database):
                                 filepath, fn)
                         logstring = "UPDATE SCAN DETAILS TRACK: " + str(tags)
                         filelog.write_verbose_log(logstring)
-                        c.execute("""update tags set
+                        writer.add('tags', """update tags set
                                      scannumber=?, lastscanned=? 
                                      where path=? and filename=?""", 
                                      tags)
@@ -933,6 +916,9 @@ def process_dir(scanpath, options, database):
                         try:
 
                             # get the existing record for this unique path/filename if it exists
+                            # (writing any pending insert/update for it first)
+                            if (path, filename) in pending_files:
+                                writer.flush('tags')
                             c.execute("""select * from tags where path=? and filename=?""", (path, filename))
                             crow = c.fetchone()
                             if not crow:
@@ -968,15 +954,18 @@ def process_dir(scanpath, options, database):
                                 filelog.write_log(logstring)
                                 logstring = "INSERT: " + str(tags)
                                 filelog.write_verbose_log(logstring)
-                                c.execute("""insert into tags values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
+                                writer.add('tags', """insert into tags values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
+                                dupkey = nocase_key((title, album, artist)) + (str(track),)
+                                pending_files[(path, filename)] = dupkey
+                                pending_dups[dupkey] = (path, filename, mime)
                                 # create audit records
                                 # pre
                                 itags = cleartags(tags)
                                 itags += (0, 'I')
-                                c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", itags)
+                                writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", itags)
                                 # post
                                 tags += (1, 'I')
-                                c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
+                                writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
                             else:
                                 # track exists, get data
                                 o_id, o_id2, o_title, o_artist, o_album, \
@@ -1013,7 +1002,7 @@ def process_dir(scanpath, options, database):
                                         o_titlesort, o_albumsort, o_artistsort, 
                                         o_albumartistsort, o_composersort)
                                 tags += (0, 'U')
-                                c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
+                                writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
                                 # create new id2 in case attribs have changed
                                 tagspec = title + album + artist + track
                                 tagspec = tagspec.encode(enc, 'replace')
@@ -1037,7 +1026,7 @@ def process_dir(scanpath, options, database):
                                         titlesort, albumsort, artistsort, 
                                         albumartistsort, composersort)
                                 tags += (1, 'U')
-                                c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
+                                writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", tags)
                                 # now update the existing record
                                 tags = (tid, title, artist, album,
                                         genre, str(track), year,
@@ -1058,7 +1047,7 @@ def process_dir(scanpath, options, database):
                                 filelog.write_log(logstring)
                                 logstring = "UPDATE: " + str(tags)
                                 filelog.write_verbose_log(logstring)
-                                c.execute("""update tags set
+                                writer.add('tags', """update tags set
                                              id2=?, title=?, artist=?, album=?,
                                              genre=?, track=?, year=?,
                                              albumartist=?, composer=?, codec=?,
@@ -1075,6 +1064,9 @@ def process_dir(scanpath, options, database):
                                              albumartistsort=?, composersort=?
                                              where path=? and filename=?""", 
                                              tags)
+                                dupkey = nocase_key((title, album, artist)) + (str(track),)
+                                pending_files[(path, filename)] = dupkey
+                                pending_dups[dupkey] = (path, filename, mime)
                         except sqlite3.Error, e:
                             errorstring = "Error inserting/updating file tags: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1082,9 +1074,19 @@ def process_dir(scanpath, options, database):
             except KeyboardInterrupt: 
                 raise
 
+    writer.flush()
     db.commit()
 
+    if pool:
+        pool.close()
+        pool.join()
+
+    logstring = "Unchanged files skipped: %d" % unchanged_count
+    filelog.write_log(logstring)
+
     # now look for tag entries for this path that we didn't encounter - they must have been deleted or moved so flag for deletion
+    # (don't commit while c2 is reading)
+    writer.autocommit = False
     try:
         scanpathlike = "%s%s" % (scanpath, '%')
         c2.execute("""select * from tags where scannumber != ? and path like ?""",
@@ -1129,22 +1131,23 @@ def process_dir(scanpath, options, database):
                     o_albumartistsort, o_composersort)
             # pre
             dtags = tags + (0, 'D')
-            c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", dtags)
+            writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", dtags)
             # post
             dtags = cleartags(tags, lastscanned=lastscanned)
             dtags += (1, 'D')
-            c.execute("""insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", dtags)
+            writer.add('tags_update', """insert into tags_update values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", dtags)
             # delete record from tags
             logstring = "Existing file not found: %s, %s" % (o_filename, o_path)
             filelog.write_log(logstring)
             logstring = "DELETE: " + str(tags)
             filelog.write_verbose_log(logstring)
-            c.execute("""delete from tags where id=?""", (o_id,))
+            writer.add('tags', """delete from tags where id=?""", (o_id,))
 
     except sqlite3.Error, e:
         errorstring = "Error processing track deletions: %s" % e.args[0]
         filelog.write_error(errorstring)
 
+    writer.flush()
     db.commit()
 
     # at this point we have completed tag processing
@@ -2278,6 +2281,190 @@ def get_folderart(files):
         elif 'front' in flist.keys():
             return flist['front']
 
+def read_file_tags(ffn):
+    '''
+        read tags and stream info from a music file, returning
+        (success, tags, trackart, errorstring)
+        - can be run in a worker process, so must not write to the logs
+    '''
+    tags = {}
+    trackart = None
+    try:
+        # scan mode skips embedded picture data, we only need its offset
+        kind = File(ffn, easy=True, scan=True)
+    except Exception:
+        # note - Mutagen raises exceptions as various types, including Exception
+        #        but we shouldn't really use Exception as the lowest common denominator here
+        etype, value, tb = sys.exc_info()
+        error = traceback.format_exception_only(etype, value)[0].strip()
+        errorstring = "Error processing file: %s : %s" % (ffn, error)
+        return False, tags, trackart, errorstring
+
+    if isinstance(kind, mutagen.flac.FLAC):
+        if kind.picture_offsets:
+            trackart = 'EMBEDDED_%s,%s' % kind.picture_offsets[0]
+        if kind.tags:
+            tags.update(kind.tags)
+        # assume these attributes exist (note these will overwrite kind.tags)
+        tags['type'] = 'FLAC'
+        tags['length'] = kind.info.length               # seconds
+        tags['sample_rate'] = kind.info.sample_rate     # Hz
+        tags['bits_per_sample'] = kind.info.bits_per_sample     # bps
+        tags['channels'] = kind.info.channels
+        tags['mime'] = kind.mime[0]
+
+    elif isinstance(kind, mutagen.mp3.EasyMP3):
+        if kind.tags:
+            if kind.picture_offsets:
+                trackart = 'EMBEDDED_%s,%s' % kind.picture_offsets[0]
+            tags.update(kind.tags)
+            if 'performer' in tags:
+                tags['albumartist'] = tags['performer']
+
+        # assume these attributes exist (note these will overwrite kind.tags)
+        tags['type'] = 'MPEG %s layer %d' % (kind.info.version, kind.info.layer)
+        tags['length'] = kind.info.length               # seconds
+        tags['sample_rate'] = kind.info.sample_rate     # Hz
+        tags['bitrate'] = kind.info.bitrate             # bps
+        tags['mime'] = kind.mime[0]
+
+    elif isinstance(kind, mutagen.easymp4.EasyMP4):
+        if kind.tags:
+            tags.update(kind.tags)
+        # assume these attributes exist (note these will overwrite kind.tags)
+        tags['type'] = 'MPEG-4 audio'
+        tags['length'] = kind.info.length               # seconds
+        tags['sample_rate'] = kind.info.sample_rate     # Hz
+        tags['bits_per_sample'] = kind.info.bits_per_sample     # bps
+        tags['channels'] = kind.info.channels
+        tags['bitrate'] = kind.info.bitrate             # bps
+        tags['mime'] = kind.mime[0]
+
+    elif isinstance(kind, mutagen.asf.ASF):
+        if kind.picture_offsets:
+            trackart = 'EMBEDDED_%s,%s' % kind.picture_offsets[0]
+        # WMA
+        if kind.tags:
+            if u'WM/AlbumTitle' in kind.tags: tags['album'] = [v.__str__() for v in kind.tags[u'WM/AlbumTitle']]
+            if u'WM/AlbumArtist' in kind.tags: tags['albumartist'] = [v.__str__() for v in kind.tags[u'WM/AlbumArtist']]
+            if 'Author' in kind.tags: tags['artist'] = [v for v in encodeunicode(kind.tags['Author'])]
+            if 'Title' in kind.tags: tags['title'] = [v for v in encodeunicode(kind.tags['Title'])]
+            if u'WM/Genre' in kind.tags: tags['genre'] = [v.__str__() for v in kind.tags[u'WM/Genre']]
+            if u'WM/TrackNumber' in kind.tags: tags['tracknumber'] = [v.__str__() for v in kind.tags[u'WM/TrackNumber']]
+            if u'WM/Year' in kind.tags: tags['date'] = [v.__str__() for v in kind.tags[u'WM/Year']]
+
+            if u'WM/TitleSortOrder' in kind.tags: tags['titlesort'] = [v.__str__() for v in kind.tags[u'WM/TitleSortOrder']]
+            if u'WM/AlbumSortOrder' in kind.tags: tags['albumsort'] = [v.__str__() for v in kind.tags[u'WM/AlbumSortOrder']]
+            if u'WM/ArtistSortOrder' in kind.tags: tags['artistsort'] = [v.__str__() for v in kind.tags[u'WM/ArtistSortOrder']]
+
+        # assume these attributes exist (note these will overwrite kind.tags)
+        tags['type'] = 'Windows Media Audio'
+        tags['length'] = kind.info.length               # seconds
+        tags['sample_rate'] = kind.info.sample_rate     # Hz
+        tags['channels'] = kind.info.channels
+        tags['bitrate'] = kind.info.bitrate             # bps
+        tags['mime'] = kind.mime[0]
+
+    elif isinstance(kind, mutagen.oggvorbis.OggVorbis):
+        if kind.tags.sections:
+            sections = ','.join(str(s) for s in kind.tags.sections)
+            sections += ',base64flac'
+            trackart = 'EMBEDDED_%s' % sections
+            kind.tags['metadata_block_picture'] = 'removed'     # remove from tags as not needed
+        if kind.tags:
+            tags.update(kind.tags)
+        # assume these attributes exist (note these will overwrite kind.tags)
+        tags['type'] = 'Ogg Vorbis'
+        tags['length'] = kind.info.length               # seconds
+        tags['sample_rate'] = kind.info.sample_rate     # Hz
+        tags['bitrate'] = kind.info.bitrate             # bps
+        tags['mime'] = kind.mime[0]
+
+    return True, tags, trackart, None
+
+def is_track_file(fn):
+    '''
+        check whether a filename found in a directory should be
+        scanned for track tags
+    '''
+    ff, ex = os.path.splitext(fn)
+    if fn.lower() in file_name_exclusions: return False
+    if ex.lower() in playlist_extensions: return False
+    if ex.lower() in work_virtual_extensions: return False
+    if ex.lower() in artextns: return False
+    if ex.lower() in file_extn_exclusions: return False
+    # these two are processed via tagsfile entries
+    if ex.lower() in tagsextns: return False
+    if ex.lower() == tags_file_extension: return False
+    return True
+
+def load_stat_index(c, filepath):
+    '''
+        load the (created, lastmodified, folderart) details of the
+        existing tags records for a directory, keyed on filename
+        - one query per directory rather than one per file
+    '''
+    statindex = {}
+    try:
+        c.execute("""select filename, created, lastmodified, folderart from tags where path=?""",
+                    (filepath, ))
+        for filename, created, lastmodified, folderart in c:
+            statindex[filename] = (created, lastmodified, folderart)
+    except sqlite3.Error, e:
+        errorstring = "Error checking file created: %s" % e.args[0]
+        filelog.write_error(errorstring)
+    return statindex
+
+def track_unchanged(statindex, fn, created, lastmodified, folderart):
+    '''
+        check whether a track file is unchanged since it was last
+        scanned (and its art has not been added/changed)
+    '''
+    return statindex.get(fn) == (created, lastmodified, folderart)
+
+def walk_prefetch(walk, pool, c, lookahead, statindexes):
+    '''
+        wrap an os.walk generator, returning (filepath, dirs, files,
+        (readfiles, result, filestats)) where result is an AsyncResult for
+        the tags of the changed track files in that directory (readfiles),
+        read on the worker pool, and filestats holds the getfilestat
+        result for each readable track file
+        - directories up to lookahead ahead of the one being processed are
+          submitted, so the workers read while the caller writes
+        - the stat index loaded for each directory is left in statindexes
+          for the caller, which must remove entries from it for records it
+          deletes before it gets to their directory
+        - files whose record changes after they are submitted are read
+          again by the caller, so the result is the same as a serial scan
+    '''
+    pending = deque()
+    for filepath, dirs, files in walk:
+        realpath = os.path.abspath(os.path.realpath(filepath))
+        folderart = get_folderart(files)
+        if folderart:
+            folderart = os.path.join(realpath, folderart)
+        statindex = load_stat_index(c, realpath)
+        statindexes[realpath] = statindex
+        readfiles = []
+        filestats = {}
+        for fn in sorted(files):
+            if not is_track_file(fn): continue
+            ffn = os.path.join(realpath, fn)
+            if not os.access(ffn, os.R_OK): continue
+            filestat = getfilestat(ffn)
+            filestats[ffn] = filestat
+            success, created, lastmodified, fsize, filler = filestat
+            if not track_unchanged(statindex, fn, created, lastmodified, folderart):
+                readfiles.append(ffn)
+        result = None
+        if readfiles:
+            result = pool.map_async(read_file_tags, readfiles)
+        pending.append((filepath, dirs, files, (readfiles, result, filestats)))
+        if len(pending) > lookahead:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
 def getfilestat(filespec):
     try:
         fstat = os.stat(filespec)
@@ -2891,6 +3078,9 @@ def process_command_line(argv):
     parser.add_option("-r", "--regenerate",
                       action="store_true", dest="regenerate", default=False,
                       help="regenerate update records")
+    parser.add_option("-n", "--workers", dest="workers", type="int",
+                      help="read tags using WORKERS processes", action="store",
+                      default=1, metavar="WORKERS")
     parser.add_option("-q", "--quiet",
                       action="store_true", dest="quiet", default=False,
                       help="don't print status messages to stdout")
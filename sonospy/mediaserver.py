@@ -30,7 +30,9 @@ import operator
 import datetime
 import string
 import copy
+import threading
 from operator import itemgetter
+from collections import OrderedDict
 
 from brisa.core import log
 from brisa.core import webserver
@@ -143,6 +145,17 @@ class MediaServer(object):
     track_class = 'object.item.audioItem.musicTrack'
     playlist_class = 'object.container.playlistContainer'
 
+    # DIDL templates
+    # (fields are escaped by the caller before being substituted)
+
+    didl_start = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+    didl_end = '</DIDL-Lite>'
+    container_didl_template = '<container id="%s" parentID="%s" restricted="true"><dc:title>%s</dc:title><upnp:class>%s</upnp:class>%s</container>'
+    album_didl_template = '<container id="%s" parentID="%s" restricted="true"><dc:title>%s</dc:title><upnp:artist role="AlbumArtist">%s</upnp:artist><upnp:artist role="Performer">%s</upnp:artist><upnp:class>%s</upnp:class><upnp:album>%s</upnp:album>%s</container>'
+    track_didl_template = '<item id="%s" parentID="%s" restricted="true"><dc:title>%s</dc:title><upnp:artist role="AlbumArtist">%s</upnp:artist><upnp:artist role="Performer">%s</upnp:artist><upnp:album>%s</upnp:album>%s<upnp:class>%s</upnp:class><res duration="%s" protocolInfo="%s">%s</res></item>'
+    albumart_didl_template = '<upnp:albumArtURI>%s</upnp:albumArtURI>'
+    tracknumber_didl_template = '<upnp:originalTrackNumber>%s</upnp:originalTrackNumber>'
+
     # default key settings for alternative indexes
 
     default_index_key_dict = {
@@ -183,8 +196,8 @@ class MediaServer(object):
 
     def __init__(self, proxy, dbspec, source, structure, proxyaddress, webserverurl, wmpurl, ininame):
 
-        log.debug('MediaServer.__init__ structure: %s' % structure)
-        log.debug('MediaServer.__init__ instance: %s' % self)
+        log.debug('MediaServer.__init__ structure: %s', structure)
+        log.debug('MediaServer.__init__ instance: %s', self)
 
         self.proxy = proxy
         self.dbspec = dbspec
@@ -198,13 +211,26 @@ class MediaServer(object):
 
         self.load_ini()
 
-        log.debug('MediaServer.__init__ structure now: %s' % self.structure)
+        log.debug('MediaServer.__init__ structure now: %s', self.structure)
 
         self.prime_cache()
 
         self.containerupdateid = 0
         self.playlistupdateid = 0
 
+        # last key returned for each (controller, query), used to seek
+        # to the next sequential page rather than skip an offset
+        self.keyset_pages = OrderedDict()
+
+        # total matches for each (count statement, params), reused for
+        # later pages of the same query until the container update id
+        # changes
+        self.query_totals = OrderedDict()
+
+        # whether the database has a full text search index (checked
+        # when first needed after each container update)
+        self.search_index = None
+
     ################
     # ini processing
     ################
@@ -250,7 +276,13 @@ class MediaServer(object):
 
         # get alternative indexing setting from ini
         self.load_ini_indexing()
-        log.debug('alternative_indexing: %s' % self.alternative_indexing)
+        log.debug('alternative_indexing: %s', self.alternative_indexing)
+
+        # get keyset paging settings from ini
+        self.load_ini_paging()
+
+        # get query cache settings from ini (this also empties the cache)
+        self.load_ini_query_cache()
 
         # get work and virtual albumtypes from database
         self.load_albumtypes()
@@ -290,6 +322,74 @@ class MediaServer(object):
             self.alternative_indexing = False
         log.debug(self.alternative_indexing)
 
+    def load_ini_paging(self):
+
+        # get keyset paging setting
+        self.keyset_paging = True
+        try:
+            ini_keyset_paging = self.proxy.config.get('database', 'keyset_paging')
+            if ini_keyset_paging.lower() == 'n':
+                self.keyset_paging = False
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # get number of (controller, query) positions to remember
+        self.keyset_paging_entries = 200
+        try:
+            ini_keyset_paging_entries = self.proxy.config.get('database', 'keyset_paging_entries')
+            try:
+                self.keyset_paging_entries = int(ini_keyset_paging_entries)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+    def load_ini_query_cache(self):
+
+        # get number of query results to cache
+        self.query_cache_entries = 500
+        try:
+            ini_query_cache_entries = self.proxy.config.get('database', 'query_cache_entries')
+            try:
+                self.query_cache_entries = int(ini_query_cache_entries)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # get number of seconds a cached result can be used for
+        # (results for date ranges such as 'last 7 days' change
+        # without a rescan)
+        self.query_cache_timeout = 600
+        try:
+            ini_query_cache_timeout = self.proxy.config.get('database', 'query_cache_timeout')
+            try:
+                self.query_cache_timeout = int(ini_query_cache_timeout)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # held for every access to the query cache and the other stores
+        # emptied with it (keyset_pages, query_totals, scroll_indices),
+        # as queries are served from several threads
+        self.query_cache_lock = threading.Lock()
+        self.query_cache = OrderedDict()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self.query_cache_local = threading.local()
+
+        # scroll indices built for each (controller, collection)
+        self.scroll_indices = {}
+
     def load_ini_display(self):
 
         # get path replacement strings
@@ -540,10 +640,7 @@ class MediaServer(object):
 
         # get albumtype values from wvlookup
 
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
         c = db.cursor()
         try:
             c.execute("""select * from wvlookup""")
@@ -555,8 +652,7 @@ class MediaServer(object):
             self.albumtypes['_album'] = 10
             print "Error reading albumtypes:", e.args[0]
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
         self.debugout('albumtypes', self.albumtypes)
 
@@ -569,7 +665,7 @@ class MediaServer(object):
             show_albums += [self.albumtypes['_default_work']]
         self.user_index_key_dict['show_albums'] = show_albums
 
-        log.debug('show_albums: %s' % self.user_index_key_dict['show_albums'])
+        log.debug('show_albums: %s', self.user_index_key_dict['show_albums'])
 
     def load_indexes(self, index_type):
 
@@ -712,7 +808,7 @@ class MediaServer(object):
                 self.searchitems += [(searchitemid, searchname)]
                 self.pmitems += [(searchtype, '', searchitemid, searchname)]
 
-        log.debug('@@@@@@@@@@@ %s' %index_type)
+        log.debug('@@@@@@@@@@@ %s', index_type)
         if index_type == 'DEFAULT':
             # create search entries for all root entries
             for (rootid, rootname) in self.displayrootitems:
@@ -766,7 +862,7 @@ class MediaServer(object):
         pm_xml += '</Presentation>\n'
 
         pm_xml_path = os.path.join(os.getcwd(), self.proxy.presentation_map_file)
-        log.debug("pm file: %s" % pm_xml_path)
+        log.debug("pm file: %s", pm_xml_path)
         try:
             with open(pm_xml_path, 'w+') as f:
                 f.write(str(pm_xml))
@@ -1101,7 +1197,7 @@ class MediaServer(object):
                         # convert entry and get index start
                         convindexentries = []
                         rootkey = self.get_root_entry(value)
-                        log.debug('value: %s  rootkey: %s' % (value, rootkey))
+                        log.debug('value: %s  rootkey: %s', value, rootkey)
                         if rootkey != None:
                             # get index start
                             indexentrystart = self.index_ids[rootkey][0]
@@ -1339,12 +1435,9 @@ class MediaServer(object):
     ##########
 
     def prime_cache(self):
-        log.debug("prime start: %.3f" % time.time())
+        log.debug("prime start: %.3f", time.time())
 
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
 #        log.debug(db)
         c = db.cursor()
         try:
@@ -1362,9 +1455,8 @@ class MediaServer(object):
         except sqlite3.Error, e:
             print "Error priming cache:", e.args[0]
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
-        log.debug("prime end: %.3f" % time.time())
+        db.close()
+        log.debug("prime end: %.3f", time.time())
 
     ###############
     # query service
@@ -1384,7 +1476,7 @@ class MediaServer(object):
         else:
             id = 'ID'
         queryID = kwargs.get(id, '')
-        log.debug("queryID: %s" % queryID)
+        log.debug("queryID: %s", queryID)
 
         # standardise ID field name
         kwargs['QueryID'] = queryID
@@ -1398,7 +1490,7 @@ class MediaServer(object):
             updateditems = []
             items, total, index, itemstype = ret
             for item in items:
-                log.debug('%s - %s' % (itemstype, item))
+                log.debug('%s - %s', itemstype, item)
 
                 #DEBUG	mediaserver :1369:  query() container - ('R8:1300000136:1400000001', u'Last month')
                 #DEBUG	mediaserver :1374:  query() container - ('R2:350000003', u'V1 - Test', u'http://192.168.1.67:50105/wmp/test.db.1.jpg')
@@ -1459,16 +1551,20 @@ class MediaServer(object):
 
     def hierarchicalQuery(self, **kwargs):
 
+        return self.cached_query(self.run_hierarchicalQuery, (), kwargs)
+
+    def run_hierarchicalQuery(self, **kwargs):
+
         log.debug("Mediaserver.hierarchicalQuery: %s", kwargs)
 
         queryID = kwargs.get('QueryID', '')
-        log.debug("QueryID: %s" % queryID)
+        log.debug("QueryID: %s", queryID)
         index = int(kwargs.get('StartingIndex', 0))
-        log.debug("StartingIndex: %s" % index)
+        log.debug("StartingIndex: %s", index)
         count = int(kwargs.get('RequestedCount', 100))
-        log.debug("RequestedCount: %s" % count)
+        log.debug("RequestedCount: %s", count)
         term = kwargs.get('term', None)
-        log.debug("term: %s" % term)
+        log.debug("term: %s", term)
 
         wassearch = False
 
@@ -1514,7 +1610,7 @@ class MediaServer(object):
 
             ids = queryID.split(':')
 
-        log.debug("items: %s" % items)
+        log.debug("items: %s", items)
         if items != None:
 
             # TODO: process count/index (i.e. take note of how many entries are requested)
@@ -1532,16 +1628,14 @@ class MediaServer(object):
 
             else:
 
-                ret  = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+                ret = [self.didl_start]
 
                 for (id, title) in items:
 
-                    ret += '<container id="%s" parentID="%s" restricted="true">' % (id, queryID)
-                    ret += '<dc:title>%s</dc:title>' % (title)
-                    ret += '<upnp:class>object.container</upnp:class>'
-                    ret += '</container>'
+                    ret.append(self.container_didl_template % (id, queryID, title, 'object.container', ''))
 
-                ret += '</DIDL-Lite>'
+                ret.append(self.didl_end)
+                ret = ''.join(ret)
                 count = len(items)
                 totalMatches = len(items)
 
@@ -1575,12 +1669,12 @@ class MediaServer(object):
         else:
 
             controllername = kwargs.get('Controller', '')
-            log.debug('Controller: %s' % controllername)
+            log.debug('Controller: %s', controllername)
             controlleraddress = kwargs.get('Address', '')
-            log.debug('Address: %s' % controlleraddress)
+            log.debug('Address: %s', controlleraddress)
 
             # have a list of queryIDs - are a hierarchy of containers
-            log.debug('ids: %s' % ids)
+            log.debug('ids: %s', ids)
 
             # convert keys to integers (except rootname)
             ids = [i if i.startswith('R') else int(i) for i in ids]
@@ -1588,8 +1682,8 @@ class MediaServer(object):
             # ID is always passed prepended with root name
             rootname, indexkeys = self.get_index_parts(ids)
 
-            log.debug('rootname: %s' % rootname)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('rootname: %s', rootname)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get position of last index in list in hierarchy 
             indexentryposition = len(indexkeys) - 1
@@ -1644,8 +1738,8 @@ class MediaServer(object):
                 indexkeys += [next_container]
                 indexentryposition += 1
 
-            log.debug('ids: %s' % ids)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('ids: %s', ids)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get type of last item in hierarchy
             if self.index_ids[rootname][indexentryposition] in self.tracktypes:
@@ -1653,7 +1747,7 @@ class MediaServer(object):
             else:
                 itemtype = 'container'
 
-            log.debug('itemtype: %s' % itemtype)
+            log.debug('itemtype: %s', itemtype)
 
             # check whether this call is supported by static or dynamic
             static = False
@@ -1694,7 +1788,7 @@ class MediaServer(object):
 #                            if index_range != ('', '', ''):
 #                                static = 'DYNAMIC'
 
-            log.debug('static: %s' % static)
+            log.debug('static: %s', static)
 
             # if recursive requested, replace last item in hierarchy
             # with track
@@ -1702,7 +1796,7 @@ class MediaServer(object):
             # that recursive will only be requested for hierarchies
             # that end in tracks)
             recursive = kwargs.get('recursive', False)
-            log.debug("recursive: %s" % recursive)
+            log.debug("recursive: %s", recursive)
             if recursive:
                 # if last entry has a user defined path index as a parent,
                 # append rather than replace as we need to take account
@@ -1711,7 +1805,7 @@ class MediaServer(object):
                 if len(ids) > 2:
                     indexname = self.hierarchies[rootname][len(ids) - 3]
                     path_name = '%s_%s' % (rootname, indexname)
-                    log.debug('path_name: %s' % path_name)
+                    log.debug('path_name: %s', path_name)
                     if path_name in self.path_index_entries.keys():
                         append = True
                 if append:
@@ -1720,8 +1814,8 @@ class MediaServer(object):
                 else:
                     ids[-1] = self.track_parentid
                     indexkeys[-1] = self.track_parentid
-                log.debug('ids: %s' % ids)
-                log.debug('indexkeys: %s' % indexkeys)
+                log.debug('ids: %s', ids)
+                log.debug('indexkeys: %s', indexkeys)
 
             # process ids
             idkeys = {}
@@ -1751,8 +1845,8 @@ class MediaServer(object):
                 id = int(indexentrykey)
                 idkeys[indexentryname] = (id, isid, indexentryid)
 
-            log.debug('hierarchy: %s' % hierarchy)
-            log.debug('idkeys: %s' % idkeys)
+            log.debug('hierarchy: %s', hierarchy)
+            log.debug('idkeys: %s', idkeys)
 
             # if we get this far we have a list of IDs and we need to query the database
 
@@ -1800,6 +1894,10 @@ class MediaServer(object):
 
     def staticQuery(self, *args, **kwargs):
 
+        return self.cached_query(self.run_staticQuery, args, kwargs)
+
+    def run_staticQuery(self, *args, **kwargs):
+
         log.debug("Mediaserver.staticQuery: %s", kwargs)
 
         '''
@@ -1807,17 +1905,17 @@ class MediaServer(object):
         '''
 
         action = kwargs.get('Action', None)
-        log.debug("action: %s" % action)
+        log.debug("action: %s", action)
 
         queryID = kwargs.get('QueryID', '')
-        log.debug("queryID: %s" % queryID)
+        log.debug("queryID: %s", queryID)
 
 # TODO
 # TODO: remember to decide what to do with titlesort and how to allow the user to select it (or other tags)
 # TODO
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         idhierarchy = SMAPI.split(':')
         log.debug(idhierarchy)
         idkeys = kwargs.get('idkeys', '')
@@ -1825,27 +1923,27 @@ class MediaServer(object):
 
         searchCriteria = kwargs.get('SearchCriteria', '')
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
+        log.debug('searchCriteria: %s', searchCriteria.encode(enc, 'replace'))
 
         items = []
         browsetype = SMAPI
 
-        log.debug("browsetype: %s" % browsetype)
+        log.debug("browsetype: %s", browsetype)
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         browseFlag = kwargs.get('BrowseFlag', None)
         searchCriteria = kwargs.get('SearchCriteria', '')
-        log.debug('BrowseFlag: %s' % browseFlag)
-        log.debug('SearchCriteria: %s' % searchCriteria)
+        log.debug('BrowseFlag: %s', browseFlag)
+        log.debug('SearchCriteria: %s', searchCriteria)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
-        log.debug('StartingIndex: %s' % startingIndex)
-        log.debug('RequestedCount: %s' % requestedCount)
+        log.debug('StartingIndex: %s', startingIndex)
+        log.debug('RequestedCount: %s', requestedCount)
 
         # create call data for metadata/mediametadata and call it
         return self.querymetadata(Controller=controllername,
@@ -1884,9 +1982,9 @@ class MediaServer(object):
         artisttype = 'albumartist'
 
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "albumartist like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('albumartist', searchstring)
 
         albumwhere = self.get_albumtype_where(albumtype)
 
@@ -1898,7 +1996,7 @@ class MediaServer(object):
         orderstatement = "select rowid, albumartist, lastplayed, playcount from AlbumartistAlbum %s group by albumartist order by %s limit ?, ?" % (where, orderby)
         alphastatement = self.smapialphastatement % ('albumartist', 'AlbumartistAlbum %s group by albumartist order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryArtist(self, searchcontainer, searchstring, sorttype, controllername):
 
@@ -1908,9 +2006,9 @@ class MediaServer(object):
         artisttype = 'artist'
 
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "artist like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('artist', searchstring)
 
         albumwhere = self.get_albumtype_where(albumtype)
 
@@ -1922,7 +2020,7 @@ class MediaServer(object):
         orderstatement = "select rowid, artist, lastplayed, playcount from ArtistAlbum %s group by artist order by %s limit ?, ?" % (where, orderby)
         alphastatement = self.smapialphastatement % ('artist', 'ArtistAlbum %s group by artist order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryGenreAlbumartist(self, searchcontainer, searchstring, sorttype, controllername):
 
@@ -1953,9 +2051,9 @@ class MediaServer(object):
     def getQueryGenre(self, searchcontainer, searchstring, sorttype, controllername):
 
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "genre like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('genre', searchstring)
 
         if self.use_albumartist:
 
@@ -1994,7 +2092,7 @@ class MediaServer(object):
                                order by %s limit ?, ?"""  % (where, orderby)
             alphastatement = self.smapialphastatement % ('genre', 'GenreArtistAlbum %s group by genre order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryComposer(self, searchcontainer, searchstring, sorttype, controllername):
 
@@ -2004,9 +2102,9 @@ class MediaServer(object):
         artisttype = 'composer'
 
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "composer like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('composer', searchstring)
 
         albumwhere = self.get_albumtype_where(albumtype)
 
@@ -2018,7 +2116,7 @@ class MediaServer(object):
         orderstatement = "select rowid, composer, lastplayed, playcount from ComposerAlbum %s group by composer order by %s limit ?, ?" % (where, orderby)
         alphastatement = self.smapialphastatement % ('composer', 'ComposerAlbum %s group by composer order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryAlbum(self, searchcontainer, searchstring, sorttype, controllername):
 
@@ -2026,9 +2124,9 @@ class MediaServer(object):
         rangetype, rangewhere = self.format_range(rangefield, indexrange)
 
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "album like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('aa.album', searchstring)
 
         albumwhere = self.get_albumtype_where(albumtype, table='aa')
 
@@ -2090,7 +2188,7 @@ class MediaServer(object):
                                  """ % (where, album_groupby, separate_albums, orderby)
                 alphastatement = self.smapialphastatement % ('album', 'ArtistAlbumsonly aa %s group by %s%s order by %%s' % (where, album_groupby, separate_albums))
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryPlaylist(self, searchcontainer, searchstring, sorttype, controllername):
 
@@ -2102,9 +2200,9 @@ class MediaServer(object):
         else:
             artisttype = 'artist'
         searchwhere = ''
+        searchparams = ()
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "playlist like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('playlist', searchstring)
 
         albumwhere = ''
         where = ' and '.join(filter(None,(rangewhere, searchwhere, albumwhere)))
@@ -2115,30 +2213,30 @@ class MediaServer(object):
         orderstatement = "select rowid,* from playlists %s group by plfile order by playlist limit ?, ?" % (where)
         alphastatement = self.smapialphastatement % ('playlist', 'playlists %s order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryTrack(self, searchcontainer, searchstring, sorttype, controllername):
 
-        log.debug('searchcontainer: %s' % searchcontainer)
-        log.debug('searchstring: %s' % searchstring)
-        log.debug('sorttype: %s' % sorttype)
-        log.debug('controllername: %s' % controllername)
+        log.debug('searchcontainer: %s', searchcontainer)
+        log.debug('searchstring: %s', searchstring)
+        log.debug('sorttype: %s', sorttype)
+        log.debug('controllername: %s', controllername)
 
         orderby, prefix, suffix, albumtype, rangefield, indexrange = self.get_orderby(sorttype, controllername, dynamic=False, orderby='title')
 #        orderby, prefix, suffix, albumtype, rangefield, indexrange = self.get_orderby(sorttype, controllername, dynamic=False, orderby='titleorder')
         rangetype, rangewhere = self.format_range(rangefield, indexrange)
 
-        log.debug('orderby: %s' % orderby)
-        log.debug('prefix: %s' % prefix)
-        log.debug('suffix: %s' % suffix)
-        log.debug('albumtype: %s' % albumtype)
+        log.debug('orderby: %s', orderby)
+        log.debug('prefix: %s', prefix)
+        log.debug('suffix: %s', suffix)
+        log.debug('albumtype: %s', albumtype)
 
         searchwhere = ''
+        searchparams = ()
         #TODO: check artisttype
         artisttype = 'track'
         if searchcontainer:
-            searchstring = escape_sql(searchstring)
-            searchwhere = "title like '%s%%'" % searchstring
+            searchwhere, searchparams = self.prefix_where('title', searchstring)
 
         albumwhere = ''
         where = ' and '.join(filter(None,(rangewhere, searchwhere, albumwhere)))
@@ -2150,7 +2248,7 @@ class MediaServer(object):
 #        orderstatement = "select * from tracks %s where titleorder >= ? and titleorder < ? order by %s" % (where, orderby)
         alphastatement = self.smapialphastatement % ('title', 'tracks %s order by %%s' % where)
 
-        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange
+        return countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams
 
     def getQueryAlbumTrack(self, searchcontainer, searchstring, sorttype, controllername, albumtype, separated):
 
@@ -2528,7 +2626,7 @@ class MediaServer(object):
     def processQueryArtist(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix):
 
         items = []
-        res = ''
+        res = []
         count = 0
         for row in c:
 #            log.debug("row: %s", row)
@@ -2554,14 +2652,14 @@ class MediaServer(object):
                 items += [(itemid, artist)]
             else:
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                res += self.artist_didl(itemid, containerstart, artist)
+                res.append(self.artist_didl(itemid, containerstart, artist))
 
-        return res, items, count
+        return ''.join(res), items, count
 
     def processQueryComposer(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix):
 
         items = []
-        res = ''
+        res = []
         count = 0
         for row in c:
 #            log.debug("row: %s", row)
@@ -2586,14 +2684,14 @@ class MediaServer(object):
                 items += [(itemid, composer)]
             else:
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                res += self.composer_didl(itemid, containerstart, composer)
+                res.append(self.composer_didl(itemid, containerstart, composer))
 
-        return res, items, count
+        return ''.join(res), items, count
 
     def processQueryGenre(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix):
 
         items = []
-        res = ''
+        res = []
         count = 0
         for row in c:
 #            log.debug("row: %s", row)
@@ -2619,14 +2717,14 @@ class MediaServer(object):
                 items += [(itemid, genre)]
             else:
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                res += self.genre_didl(itemid, containerstart, genre)
+                res.append(self.genre_didl(itemid, containerstart, genre))
 
-        return res, items, count
+        return ''.join(res), items, count
 
     def processQueryPlaylist(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix):
 
         items = []
-        res = ''
+        res = []
         count = 0
         for row in c:
 #            log.debug("row: %s", row)
@@ -2653,14 +2751,14 @@ class MediaServer(object):
                 items += [(itemid, playlist)]
             else:
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                res += self.playlist_didl(itemid, containerstart, playlist)
+                res.append(self.playlist_didl(itemid, containerstart, playlist))
 
-        return res, items, count
+        return ''.join(res), items, count
 
     def processQueryAlbum(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix):
 
         items = []
-        res = ''
+        res = []
         count = 0
         for row in c:
             log.debug("row: %s", row)
@@ -2740,14 +2838,14 @@ class MediaServer(object):
 #            log.debug("albumartist: %s", albumartist)
 
             fixdict = {'year':year, 'lastplayed':lastplayed, 'playcount':playcount, 'created':created, 'lastmodified':lastmodified, 'inserted':inserted, 'artist':artist, 'albumartist':albumartist, 'composer':composer}
-            log.debug('fixdict: %s' % fixdict)
+            log.debug('fixdict: %s', fixdict)
             if prefix:
                 a_prefix = self.static_makepresuffix(prefix, self.replace_pre, fixdict, 'P')
                 if a_prefix: album = '%s%s' % (a_prefix, album)
             if suffix:
                 a_suffix = self.static_makepresuffix(suffix, self.replace_suf, fixdict, 'S')
                 if a_suffix: album = '%s%s' % (album, a_suffix)
-                log.debug('a_suffix: %s' % a_suffix)
+                log.debug('a_suffix: %s', a_suffix)
 
             coverres = ''
             if cover.startswith('EMBEDDED_'):
@@ -2794,9 +2892,9 @@ class MediaServer(object):
                 items += [(itemid, album, coverres)]
             else:
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                res += self.album_didl(itemid, containerstart, albumartist, artist, album, coverres)
+                res.append(self.album_didl(itemid, containerstart, albumartist, artist, album, coverres))
 
-        return res, items, count
+        return ''.join(res), items, count
 
     def processQueryTrack(self, c, artisttype, prefix, suffix, idkeys, queryIDprefix, browsetype, \
                           passed_albumartist=None, passed_artist=None, passed_album=None, \
@@ -2804,7 +2902,7 @@ class MediaServer(object):
                           albumtype=None, container=None, tracktype=None):
 
         items = []
-        ret = ''
+        ret = []
         count = 0
         roottype = browsetype.split(':')[0]
 
@@ -2906,7 +3004,7 @@ class MediaServer(object):
                 dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
                 self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
             elif stream:
-                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wsfile, contenttype, newtype))
+                log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wsfile, contenttype, newtype)
                 dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wsfile, newtype, contenttype, cover=cover, stream=True)
                 self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
             else:
@@ -3094,24 +3192,22 @@ class MediaServer(object):
 
 
 #                itemid = ':'.join(filter(None,(queryIDprefix, str(itemid))))
-                ret += self.track_didl(full_id, self.track_parentid, title, albumartist, artist, album, tracknumber, duration, protocol, res)
+                ret.append(self.track_didl(full_id, self.track_parentid, title, albumartist, artist, album, tracknumber, duration, protocol, res))
 
-        return ret, items, count
+        return ''.join(ret), items, count
 
     #############################################
     # static query alpha processor for containers
     #############################################
 
-    def processAlphaQuery(self, c, orderby, alphastatement):
+    def processAlphaQuery(self, c, orderby, alphastatement, params=()):
 
         if ',' in orderby: orderby = orderby.split(',')[0]
         alphastatement = alphastatement % (orderby)
         log.debug(alphastatement)
-        c.execute(alphastatement)
+        c.execute(alphastatement, params)
         ret = c.fetchall()
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
         return ret 
 
     #############################
@@ -3312,61 +3408,32 @@ class MediaServer(object):
     #############################
 
     def artist_didl(self, id, parentid, artist):
-        res  = '<container id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        res += '<dc:title>%s</dc:title>' % (artist)
-        res += '<upnp:class>%s</upnp:class>' % (self.artist_class)
-        res += '</container>'
-        return res
+        return self.container_didl_template % (id, parentid, artist, self.artist_class, '')
 
     def genre_didl(self, id, parentid, genre):
-        res  = '<container id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        res += '<dc:title>%s</dc:title>' % (genre)
-        res += '<upnp:class>%s</upnp:class>' % (self.genre_class)
-        res += '</container>'
-        return res
+        return self.container_didl_template % (id, parentid, genre, self.genre_class, '')
 
     def composer_didl(self, id, parentid, composer):
-        res  = '<container id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        res += '<dc:title>%s</dc:title>' % (composer)
 ## test this!                res += '<upnp:artist role="AuthorComposer">%s</upnp:artist>' % (composer)
-        res += '<upnp:class>%s</upnp:class>' % (self.composer_class)
-        res += '</container>'
-        return res
+        return self.container_didl_template % (id, parentid, composer, self.composer_class, '')
 
     def playlist_didl(self, id, parentid, playlist):
-        res  = '<container id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        res += '<dc:title>%s</dc:title>' % (playlist)
-        res += '<upnp:class>%s</upnp:class>' % (self.playlist_class)
-        res += '</container>'
-        return res
+        return self.container_didl_template % (id, parentid, playlist, self.playlist_class, '')
 
     def album_didl(self, id, parentid, albumartist, artist, album, coverres):
-        res  = '<container id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        res += '<dc:title>%s</dc:title>' % (album)
-        res += '<upnp:artist role="AlbumArtist">%s</upnp:artist>' % (albumartist)
-        res += '<upnp:artist role="Performer">%s</upnp:artist>' % (artist)
-        res += '<upnp:class>%s</upnp:class>' % (self.album_class)
-        res += '<upnp:album>%s</upnp:album>' % (album)
+        albumart = ''
         if coverres != '':
-            res += '<upnp:albumArtURI>%s</upnp:albumArtURI>' % (coverres)
-        res += '</container>'
-        return res
+            albumart = self.albumart_didl_template % (coverres)
+        return self.album_didl_template % (id, parentid, album, albumartist, artist, self.album_class, album, albumart)
 
     def track_didl(self, id, parentid, title, albumartist, artist, album, tracknumber, duration, protocol, res):
-        ret  = '<item id="%s" parentID="%s" restricted="true">' % (id, parentid)
-        ret += '<dc:title>%s</dc:title>' % (title)
-        ret += '<upnp:artist role="AlbumArtist">%s</upnp:artist>' % (albumartist)
-        ret += '<upnp:artist role="Performer">%s</upnp:artist>' % (artist)
-        ret += '<upnp:album>%s</upnp:album>' % (album)
+        originaltracknumber = ''
         if tracknumber != 0:
-            ret += '<upnp:originalTrackNumber>%s</upnp:originalTrackNumber>' % (tracknumber)
-        ret += '<upnp:class>%s</upnp:class>' % (self.track_class)
-        ret += '<res duration="%s" protocolInfo="%s">%s</res>' % (duration, protocol, res)
+            originaltracknumber = self.tracknumber_didl_template % (tracknumber)
 #        ret += '<desc id="cdudn" nameSpace="urn:schemas-rinconnetworks-com:metadata-1-0/">%s</desc>' % (self.wmpudn)
 #        if cover != '' and not cover.startswith('EMBEDDED_'):
 #            ret += '<upnp:albumArtURI>%s</upnp:albumArtURI>' % (coverres)
-        ret += '</item>'
-        return ret
+        return self.track_didl_template % (id, parentid, title, albumartist, artist, album, originaltracknumber, self.track_class, duration, protocol, res)
 
     #############################
     # track id metadata processor
@@ -3403,28 +3470,28 @@ class MediaServer(object):
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         queryID = kwargs['QueryID']
-        log.debug('QueryID: %s' % str(queryID))
+        log.debug('QueryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         searchCriteria = kwargs.get('SearchCriteria', '')
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
+        log.debug('searchCriteria: %s', searchCriteria.encode(enc, 'replace'))
 
         browsetype = kwargs.get('browsetype', '')
-        log.debug('browsetype: %s' % browsetype)
+        log.debug('browsetype: %s', browsetype)
 
         idhierarchy = browsetype.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', '')
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         # check if search requested
         searchcontainer = None
@@ -3435,10 +3502,7 @@ class MediaServer(object):
             searchcontainer = searchtype
             # TODO: check this
 
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
         c = db.cursor()
 
         startingIndex = int(kwargs['StartingIndex'])
@@ -3488,8 +3552,8 @@ class MediaServer(object):
 
             # have a list of entries
             rootname, indexkeys = self.get_index_parts(ids)
-            log.debug('rootname: %s' % rootname)
-            log.debug('indexkeys: %s' % indexkeys)
+            log.debug('rootname: %s', rootname)
+            log.debug('indexkeys: %s', indexkeys)
 
             # get sorttype
 
@@ -3514,12 +3578,12 @@ class MediaServer(object):
                 sorttype = '%s_%s_%s' % (rootname, self.dynamic_lookup[int(indexkeys[0])], entry)
                 # remove dynamic facet of browsetype
                 browsetype = ':'.join(idhierarchy[1:])
-                log.debug("browsetype: %s" % browsetype)
+                log.debug("browsetype: %s", browsetype)
 
             else:
                 sorttype = self.get_index_key(ids, idhierarchy)
 
-            log.debug("sorttype: %s" % sorttype)
+            log.debug("sorttype: %s", sorttype)
 
             # remove the last entry from the query ID if it's a container id
             # so that we can subsequently append the key selected from that container
@@ -3534,7 +3598,7 @@ class MediaServer(object):
             else:
                 queryIDprefix = queryID
 
-            log.debug('queryIDprefix: %s' % queryIDprefix)
+            log.debug('queryIDprefix: %s', queryIDprefix)
 
         # note - there is a small amount of duplicated code per browsetype
         #        so that they are self-contained and easier to understand
@@ -3579,7 +3643,7 @@ class MediaServer(object):
              browsetype == 'album':
 
             log.debug('albums')
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryAlbum(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryAlbum(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
@@ -3588,9 +3652,7 @@ class MediaServer(object):
             log.debug("prefix: %s", prefix)
             log.debug("suffix: %s", suffix)
 
-            c.execute(countstatement)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3598,9 +3660,9 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAalbum':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                c.execute(orderstatement, searchparams + (startingIndex, requestedCount))
 
                 xml, items, count = self.processQueryAlbum(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
@@ -3608,15 +3670,13 @@ class MediaServer(object):
              browsetype == 'albumartist':
 
             log.debug('albumartist')
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryAlbumartist(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryAlbumartist(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3624,25 +3684,23 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAalbumartist':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                rows = self.execute_page(c, controllername, orderstatement, searchparams, startingIndex, requestedCount, seekfield=artisttype)
 
-                xml, items, count = self.processQueryArtist(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
+                xml, items, count = self.processQueryArtist(rows, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
         elif browsetype == '!ALPHAartist' or \
              browsetype == 'artist':
 
             log.debug('albumartist')
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryArtist(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryArtist(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3650,26 +3708,24 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAartist':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                rows = self.execute_page(c, controllername, orderstatement, searchparams, startingIndex, requestedCount, seekfield=artisttype)
 
-                xml, items, count = self.processQueryArtist(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
+                xml, items, count = self.processQueryArtist(rows, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
         elif browsetype == '!ALPHAcomposer' or \
              browsetype == 'composer':
 
             log.debug('composer')
 
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryComposer(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryComposer(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            totalMatches, = c.fetchone()
-            totalMatches = int(totalMatches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3677,26 +3733,24 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAcomposer':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                rows = self.execute_page(c, controllername, orderstatement, searchparams, startingIndex, requestedCount, seekfield='composer')
 
-                xml, items, count = self.processQueryComposer(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
+                xml, items, count = self.processQueryComposer(rows, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
         elif browsetype == '!ALPHAgenre' or \
              browsetype == 'genre':
 
             log.debug('genre')
 
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryGenre(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryGenre(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            totalMatches, = c.fetchone()
-            totalMatches = int(totalMatches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3704,9 +3758,9 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAgenre':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                c.execute(orderstatement, searchparams + (startingIndex, requestedCount))
 
                 xml, items, count = self.processQueryGenre(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
@@ -3715,15 +3769,13 @@ class MediaServer(object):
 
             log.debug('playlist')
 
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryPlaylist(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryPlaylist(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            totalMatches, = c.fetchone()
-            totalMatches = int(totalMatches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3731,9 +3783,9 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAplaylist':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
-                c.execute(orderstatement, (startingIndex, requestedCount))
+                c.execute(orderstatement, searchparams + (startingIndex, requestedCount))
 
                 xml, items, count = self.processQueryPlaylist(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
@@ -3742,15 +3794,13 @@ class MediaServer(object):
 
             log.debug('track')
 
-            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange = self.getQueryTrack(searchcontainer, searchstring, sorttype, controllername)
+            countstatement, orderstatement, alphastatement, orderby, prefix, suffix, artisttype, rangetype, indexrange, searchparams = self.getQueryTrack(searchcontainer, searchstring, sorttype, controllername)
 
             log.debug("countstatement: %s", countstatement)
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement)
-            totalMatches, = c.fetchone()
-            totalMatches = int(totalMatches)
+            totalMatches = self.count_matches(c, countstatement, searchparams)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3758,10 +3808,10 @@ class MediaServer(object):
             if totalMatches != 0:
 
                 if browsetype == '!ALPHAtrack':
-                    return self.processAlphaQuery(c, orderby, alphastatement)
+                    return self.processAlphaQuery(c, orderby, alphastatement, searchparams)
 
 #                c.execute(orderstatement, (startingIndex, requestedCount))
-                c.execute(orderstatement, (startingIndex, startingIndex + requestedCount))
+                c.execute(orderstatement, searchparams + (startingIndex, startingIndex + requestedCount))
 
                 xml, items, count = self.processQueryTrack(c, artisttype, prefix, suffix, idkeys, queryIDprefix, browsetype)
 
@@ -3798,9 +3848,7 @@ class MediaServer(object):
 
             log.debug("paramtuple: %s", paramtuple)
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             log.debug("totalMatches: %s", totalMatches)
 
@@ -3830,9 +3878,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (playlistid, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (playlistid, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3856,9 +3902,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (albumartist, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (albumartist, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3882,9 +3926,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (artist, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (artist, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3908,9 +3950,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (composer, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (composer, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -3935,18 +3975,16 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
 
             if totalMatches != 0:
 
-                c.execute(orderstatement, (genre, startingIndex, requestedCount))
+                rows = self.execute_page(c, controllername, orderstatement, (genre, ), startingIndex, requestedCount, seekfield=artisttype)
 
-                xml, items, count = self.processQueryArtist(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
+                xml, items, count = self.processQueryArtist(rows, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
         elif browsetype == 'genre:artist':
 
@@ -3962,18 +4000,16 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
 
             if totalMatches != 0:
 
-                c.execute(orderstatement, (genre, startingIndex, requestedCount))
+                rows = self.execute_page(c, controllername, orderstatement, (genre, ), startingIndex, requestedCount, seekfield=artisttype)
 
-                xml, items, count = self.processQueryArtist(c, artisttype, prefix, suffix, idkeys, queryIDprefix)
+                xml, items, count = self.processQueryArtist(rows, artisttype, prefix, suffix, idkeys, queryIDprefix)
 
         #################
         # level 3 queries
@@ -3993,9 +4029,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, albumartist))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, albumartist))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4020,9 +4054,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, artist))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, artist))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4050,9 +4082,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (albumartist, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (albumartist, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4076,9 +4106,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (artist, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (artist, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4102,9 +4130,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (artist, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (artist, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4128,9 +4154,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, ))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, ))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4155,9 +4179,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, albumartist))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, albumartist))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4182,9 +4204,7 @@ class MediaServer(object):
             log.debug("orderstatement: %s", orderstatement)
             log.debug("alphastatement: %s", alphastatement)
 
-            c.execute(countstatement, (genre, artist))
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, (genre, artist))
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4218,9 +4238,7 @@ class MediaServer(object):
             if albumtype != 10:
                 paramtuple += (albumtype, )
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4251,9 +4269,7 @@ class MediaServer(object):
             if albumtype != 10:
                 paramtuple += (albumtype, )
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4284,9 +4300,7 @@ class MediaServer(object):
             if albumtype != 10:
                 paramtuple += (albumtype, )
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4318,9 +4332,7 @@ class MediaServer(object):
             if albumtype != 10:
                 paramtuple += (albumtype, )
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4352,9 +4364,7 @@ class MediaServer(object):
             if albumtype != 10:
                 paramtuple += (albumtype, )
 
-            c.execute(countstatement, paramtuple)
-            matches, = c.fetchone()
-            totalMatches = int(matches)
+            totalMatches = self.count_matches(c, countstatement, paramtuple)
 
             if rangetype == 'count':
                 totalMatches, orderstatement, alphastatement = self.adjust_for_range(indexrange, totalMatches, orderstatement, alphastatement)
@@ -4367,17 +4377,14 @@ class MediaServer(object):
                 xml, items, count = self.processQueryTrack(c, artisttype, prefix, suffix, idkeys, queryIDprefix, browsetype, passed_artist=artist, passed_album=album, albumalbumtype=albumtype)
 
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
             return items, totalMatches, startingIndex, 'container'
         elif self.source == 'UPNP':
-            res  = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
-            res += xml        
-            res += '</DIDL-Lite>'
+            res = ''.join((self.didl_start, xml, self.didl_end))
             log.debug("SEARCH res: %s", res)
             return res, count, totalMatches
 
@@ -4387,39 +4394,43 @@ class MediaServer(object):
 
     def dynamicQuery(self, *args, **kwargs):
 
+        return self.cached_query(self.run_dynamicQuery, args, kwargs)
+
+    def run_dynamicQuery(self, *args, **kwargs):
+
         # TODO: fix error conditions (return zero)
         log.debug("Mediaserver.dynamicQuery: %s", kwargs)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         # process params
         ################
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         queryID = kwargs.get('QueryID','')
-        log.debug('queryID: %s' % str(queryID))
+        log.debug('queryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         searchCriteria = kwargs['SearchCriteria']
         searchCriteria = self.fixcriteria(searchCriteria)
-        log.debug('searchCriteria: %s' % searchCriteria)
+        log.debug('searchCriteria: %s', searchCriteria)
         #log.debug('searchCriteria: %s' % searchCriteria.encode(enc, 'replace'))
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         if SMAPI.startswith('!ALPHA'):
             idhierarchy = [SMAPI[6:]]
         else:
             idhierarchy = SMAPI.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', [])
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
@@ -4473,10 +4484,7 @@ class MediaServer(object):
             log.debug(searchcontainer)
 
         # set up cursor (note we want to refer to fields by name)
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
         db.row_factory = sqlite3.Row
         c = db.cursor()
 
@@ -4497,8 +4505,7 @@ class MediaServer(object):
             ret = c.fetchall()
             c.close()
             db.row_factory = None
-            if not self.proxy.db_persist_connection:
-                db.close()
+            db.close()
             return ret
 
         # process hierarchy
@@ -4510,8 +4517,8 @@ class MediaServer(object):
         # ID is always passed prepended with root name
         rootname, indexkeys = self.get_index_parts(ids)
 
-        log.debug('rootname: %s' % rootname)
-        log.debug('indexkeys: %s' % indexkeys)
+        log.debug('rootname: %s', rootname)
+        log.debug('indexkeys: %s', indexkeys)
 
         # walk through items in hierarchy, getting SQL keys when id passed
         itemidprefix = rootname
@@ -4537,10 +4544,10 @@ class MediaServer(object):
                 continue
 
             field = self.convert_field_name(entry)
-            log.debug('field: %s' % field)
+            log.debug('field: %s', field)
 
             path_name = '%s_%s' % (rootname, field)
-            log.debug('path_name: %s' % path_name)
+            log.debug('path_name: %s', path_name)
 
             # process for id's only (not containers and usersearch)
             if searchcontainer != 'usersearch' and browsebyid:
@@ -4588,7 +4595,7 @@ class MediaServer(object):
             field = self.convert_field_name(entry)
             log.debug(field)
             path_name = '%s_%s' % (rootname, field)
-            log.debug('path_name: %s' % path_name)
+            log.debug('path_name: %s', path_name)
 
             if searchcontainer:
 
@@ -4683,11 +4690,11 @@ class MediaServer(object):
 
                     ids += [self.index_ids[rootname][len(idhierarchy) - 1]]
 
-                    log.debug("ids: %s" % ids)
+                    log.debug("ids: %s", ids)
 
 #                    sorttype = '%s_%s%s' % (idhierarchy[0], idhierarchy[-1], indexsuffix)
                     sorttype = self.get_index_key(ids, idhierarchy)
-                    log.debug("sorttype: %s" % sorttype)
+                    log.debug("sorttype: %s", sorttype)
 
                 log.debug(sorttype)
 
@@ -4751,7 +4758,7 @@ class MediaServer(object):
                     items += [(itemid, escape(title))]
                     rowid += 1
 
-                log.debug("items: %s" % items)
+                log.debug("items: %s", items)
 
             else:
 
@@ -4771,7 +4778,7 @@ class MediaServer(object):
                             if where.startswith('where'):
                                 where = 'and %s' % where[5:]
                             where = 'where %s %s' % (rangewhere, where)
-                            log.debug('where: %s' % where)
+                            log.debug('where: %s', where)
 
                 if searchcontainer and len(searchlist) > 1:
 
@@ -4925,9 +4932,9 @@ class MediaServer(object):
 
 #            sorttype = '%s_%s%s' % (idhierarchy[0], idhierarchy[-1], indexsuffix)
             ids += [self.index_ids[rootname][len(idhierarchy) - 1]]
-            log.debug("ids: %s" % ids)
+            log.debug("ids: %s", ids)
             sorttype = self.get_index_key(ids, idhierarchy)
-            log.debug("sorttype: %s" % sorttype)
+            log.debug("sorttype: %s", sorttype)
 
             # get sort data
             rangefield, indexrange, sortorder, entryprefix, entrysuffix, albumtype = self.get_orderby(sorttype, controllername, dynamic=True)
@@ -4967,7 +4974,7 @@ class MediaServer(object):
                         if where.startswith('where'):
                             where = 'and %s' % where[5:]
                         where = 'where %s %s' % (rangewhere, where)
-                        log.debug('where: %s' % where)
+                        log.debug('where: %s', where)
 
 
             selectfield = 'id, title, artist, album, genre, tracknumber, albumartist, composer, codec, length, path, filename, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, folderartid, trackartid'
@@ -4991,9 +4998,8 @@ class MediaServer(object):
 
         if not user_index:
 
-            c.execute(countstatement)
-            totalMatches, = c.fetchone()
-            log.debug('totalMatches: %s' % totalMatches)
+            totalMatches = self.count_matches(c, countstatement)
+            log.debug('totalMatches: %s', totalMatches)
 
             # check if we need to apply a count to the query
             if rangetype == 'count':
@@ -5012,7 +5018,7 @@ class MediaServer(object):
                 originalMatches = totalMatches
                 if totalMatches > rangecount:
                     totalMatches = rangecount
-                    log.debug('range adjusted count: %s' % totalMatches)
+                    log.debug('range adjusted count: %s', totalMatches)
 
                 # for the select, we need to add a bounding limit to the initial
                 # query before applying the existing requested count/startindex
@@ -5029,7 +5035,7 @@ class MediaServer(object):
                 # insert outer select limit before call limit
                 statement = statement.replace(' limit ', ' %s limit ' % limitclause)
 
-                log.debug('range adjusted statement: %s' % statement)
+                log.debug('range adjusted statement: %s', statement)
 
             if totalMatches > 0:
 
@@ -5051,7 +5057,7 @@ class MediaServer(object):
                         else:
                             title = row[2]
 
-                        log.debug("recordtype, rowid, title: %s, %s, %s" % (recordtype, rowid, title))
+                        log.debug("recordtype, rowid, title: %s, %s, %s", recordtype, rowid, title)
 
                         if searchcontainer:
                             searchfieldtype = recordtype
@@ -5107,7 +5113,7 @@ class MediaServer(object):
                         folderartid = None if not 'folderartid' in row.keys() else row['folderartid']
                         trackartid = None if not 'trackartid' in row.keys() else row['trackartid']
 
-                        log.debug('%s, %s, %s, %s' % (folderart, trackart, folderartid, trackartid))
+                        log.debug('%s, %s, %s, %s', folderart, trackart, folderartid, trackartid)
 
                         if folderart or trackart:
                             cover, artid = self.choosecover(folderart, trackart, folderartid, trackartid)
@@ -5149,7 +5155,7 @@ class MediaServer(object):
 
                         if searchtype == 'lower':
 
-                            log.debug('itemidprefixes: %s' % itemidprefixes)
+                            log.debug('itemidprefixes: %s', itemidprefixes)
                             # TODO - fix this search on lower levels
                             rowitemidprefix = itemidprefixes[recordtype]
 
@@ -5285,11 +5291,11 @@ class MediaServer(object):
                             dummyfile = self.dbname + '.' + id + '.' + filetype
                         res = self.proxyaddress + '/WMPNSSv3/' + dummyfile
                         if transcode:
-                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wspath, contenttype, newtype))
+                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wspath, contenttype, newtype)
                             dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
                             self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
                         else:
-                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (dummyfile, wsfile, wspath, contenttype))
+                            log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s', dummyfile, wsfile, wspath, contenttype)
                             dummystaticfile = webserver.StaticFileSonos(dummyfile, wsfile, wspath, contenttype, cover=cover)
                             self.proxy.wmpcontroller.add_static_file(dummystaticfile)
 
@@ -5374,10 +5380,9 @@ class MediaServer(object):
 
         c.close()
         db.row_factory = None
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
 
@@ -5391,7 +5396,7 @@ class MediaServer(object):
 
         else:
 
-            ret  = '<DIDL-Lite xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/" xmlns:r="urn:schemas-rinconnetworks-com:metadata-1-0/" xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+            ret = [self.didl_start]
 
             log.debug(items)
 
@@ -5406,8 +5411,6 @@ class MediaServer(object):
                         cover = entry[2]
                     else:
                         cover = ''
-                    ret += '<container id="%s" parentID="%s" restricted="true">' % (id, queryID)
-                    ret += '<dc:title>%s</dc:title>' % (title)
 
                     # recordtype will contain type of last entry - assume all entries are the same type
                     if recordtype == 'artist':
@@ -5424,31 +5427,20 @@ class MediaServer(object):
                         classtype = 'object.container.playlistContainer'
                     else:
                         classtype = 'object.container'
-                    ret += '<upnp:class>%s</upnp:class>' % (classtype)
 
+                    albumart = ''
                     if cover != '' and not cover.startswith('EMBEDDED_'):
-                        ret += '<upnp:albumArtURI>%s</upnp:albumArtURI>' % (cover)
-                    ret += '</container>'
+                        albumart = self.albumart_didl_template % (cover)
+                    ret.append(self.container_didl_template % (id, queryID, title, classtype, albumart))
                 else:
                     id, title, mime, res, upnpclass, metadatatype, metadata = entry
                     d1, artist, d2, d3, d4, album, coverres, d5, albumartist, d6, d7, iduration = metadata
 
-                    ret += '<item id="%s" parentID="%s" restricted="true">' % (id, self.track_parentid)
-                    ret += '<dc:title>%s</dc:title>' % (title)
-                    ret += '<upnp:artist role="AlbumArtist">%s</upnp:artist>' % (albumartist)
-                    ret += '<upnp:artist role="Performer">%s</upnp:artist>' % (artist)
-                    ret += '<upnp:album>%s</upnp:album>' % (album)
                     # TODO: add tracknumber
-#                    if tracknumber != 0:
-#                        ret += '<upnp:originalTrackNumber>%s</upnp:originalTrackNumber>' % (tracknumber)
-                    ret += '<upnp:class>%s</upnp:class>' % (self.track_class)
-                    ret += '<res duration="%s" protocolInfo="%s">%s</res>' % (iduration, getProtocol(mime), res)
-    ####                ret += '<desc id="cdudn" nameSpace="urn:schemas-rinconnetworks-com:metadata-1-0/">%s</desc>' % (self.wmpudn)
-    #                if cover != '' and not cover.startswith('EMBEDDED_'):
-    #                    ret += '<upnp:albumArtURI>%s</upnp:albumArtURI>' % (coverres)
-                    ret += '</item>'
-
-            ret += '</DIDL-Lite>'
+                    ret.append(self.track_didl_template % (id, self.track_parentid, title, albumartist, artist, album, '', self.track_class, iduration, getProtocol(mime), res))
+
+            ret.append(self.didl_end)
+            ret = ''.join(ret)
             count = len(items)
 
             if count == 0: ret = ''
@@ -5471,37 +5463,37 @@ class MediaServer(object):
         # TODO: fix error conditions (return zero)
         log.debug("Mediaserver.keywordQuery: %s", kwargs)
 
-        log.debug("start: %.3f" % time.time())
+        log.debug("start: %.3f", time.time())
 
         # process params
         ################
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         queryID = kwargs.get('QueryID','')
-        log.debug('queryID: %s' % str(queryID))
+        log.debug('queryID: %s', queryID)
 
         ids = queryID.split(':')
-        log.debug('ids: %s' % ids)
+        log.debug('ids: %s', ids)
 
         term = kwargs.get('term', None)
-        log.debug("term: %s" % term)
+        log.debug("term: %s", term)
 
         searchfields = kwargs.get('searchfields', None)
-        log.debug("searchfields: %s" % searchfields)
+        log.debug("searchfields: %s", searchfields)
 
         SMAPI = kwargs.get('SMAPI', '')
-        log.debug('SMAPI: %s' % SMAPI)
+        log.debug('SMAPI: %s', SMAPI)
         if SMAPI.startswith('!ALPHA'):
             idhierarchy = [SMAPI[6:]]
         else:
             idhierarchy = SMAPI.split(':')
-        log.debug('idhierarchy: %s' % idhierarchy)
+        log.debug('idhierarchy: %s', idhierarchy)
         idkeys = kwargs.get('idkeys', [])
-        log.debug('idkeys: %s' % idkeys)
+        log.debug('idkeys: %s', idkeys)
 
         startingIndex = int(kwargs['StartingIndex'])
         requestedCount = int(kwargs['RequestedCount'])
@@ -5516,10 +5508,7 @@ class MediaServer(object):
         extras = []
 
         # set up cursor (note we want to refer to fields by name)
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
         db.row_factory = sqlite3.Row
         c = db.cursor()
 
@@ -5532,8 +5521,8 @@ class MediaServer(object):
         # ID is always passed prepended with root name
         rootname, indexkeys = self.get_index_parts(ids)
 
-        log.debug('rootname: %s' % rootname)
-        log.debug('indexkeys: %s' % indexkeys)
+        log.debug('rootname: %s', rootname)
+        log.debug('indexkeys: %s', indexkeys)
 
         itemidprefix = rootname
 
@@ -5555,17 +5544,26 @@ class MediaServer(object):
             if subterm.startswith('track='):
                 track = subterm[6:]
                 orderby = ','.join(filter(None,(orderby, 'title')))
-        log.debug('orderby: %s' % orderby)
+        log.debug('orderby: %s', orderby)
 
         if not albumartist and not album and not track:
             return items, -2, -2, 'container'
 
-        log.debug('albumartist=%s, album=%s, track=%s' % (albumartist, album, track))
-        albumartistwhere = '' if not albumartist else "albumartist like '%%%s%%'" % (albumartist)
-        albumwhere = '' if not album else "album like '%%%s%%'" % (album)
-        trackwhere = '' if not track else "title like '%%%s%%'" % (track)
-        where = ' and '.join(filter(None,(albumartistwhere, albumwhere, trackwhere)))
-        log.debug('where: %s' % where)
+        log.debug('albumartist=%s, album=%s, track=%s', albumartist, album, track)
+        searchterms = [(field, value) for field, value in (('albumartist', albumartist), ('album', album), ('title', track)) if value]
+        match = ''
+        if self.has_search_index(c):
+            match = self.search_match(searchterms)
+        if match:
+            # find tracks containing words starting with the terms
+            where = "rowid in (select docid from tracksearch where tracksearch match ?)"
+            params = (match, )
+        else:
+            # no index, scan for the terms anywhere in the fields
+            where = ' and '.join(["%s like ? escape '\\'" % field for field, value in searchterms])
+            params = tuple(['%%%s%%' % escape_like(value) for field, value in searchterms])
+        log.debug('where: %s', where)
+        log.debug('params: %s', params)
 
 #        countstatement = "select count(title) from tracks where %s" % (where)
 #        statement = "select 'track' as recordtype, rowid, id, title, artist, album, genre, tracknumber, albumartist, composer, codec, length, path, filename, folderart, trackart, bitrate, samplerate, bitspersample, channels, mime, folderartid, trackartid from tracks where %s order by %s limit ?, ?" % (where, orderby)
@@ -5588,9 +5586,8 @@ class MediaServer(object):
         log.debug("countstatement: %s", countstatement)
         log.debug("statement: %s", statement)
 
-        c.execute(countstatement)
-        totalMatches, = c.fetchone()
-        log.debug('totalMatches: %s' % totalMatches)
+        totalMatches = self.count_matches(c, countstatement, params * 3)
+        log.debug('totalMatches: %s', totalMatches)
 
 #        foundalbumartists = []
 #        foundalbumartistalbums = []            
@@ -5602,7 +5599,7 @@ class MediaServer(object):
 
         if totalMatches > 0:
 
-            c.execute(statement, (startingIndex, requestedCount))
+            c.execute(statement, params * 3 + (startingIndex, requestedCount))
 
             for row in c:
 
@@ -5666,11 +5663,11 @@ class MediaServer(object):
                         dummyfile = self.dbname + '.' + id + '.' + filetype
                     res = self.proxyaddress + '/WMPNSSv3/' + dummyfile
                     if transcode:
-                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (dummyfile, wsfile, wspath, contenttype, newtype))
+                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', dummyfile, wsfile, wspath, contenttype, newtype)
                         dummystaticfile = webserver.TranscodedFileSonos(dummyfile, wsfile, wspath, newtype, contenttype, cover=cover)
                         self.proxy.wmpcontroller.add_transcoded_file(dummystaticfile)
                     else:
-                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (dummyfile, wsfile, wspath, contenttype))
+                        log.debug('\ndummyfile: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s', dummyfile, wsfile, wspath, contenttype)
                         dummystaticfile = webserver.StaticFileSonos(dummyfile, wsfile, wspath, contenttype, cover=cover)
                         self.proxy.wmpcontroller.add_static_file(dummystaticfile)
 
@@ -5790,10 +5787,9 @@ class MediaServer(object):
 
         c.close()
         db.row_factory = None
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
-        log.debug("end: %.3f" % time.time())
+        log.debug("end: %.3f", time.time())
 
         if self.source == 'SMAPI':
 
@@ -5823,9 +5819,9 @@ class MediaServer(object):
     def format_range(self, rangefield, indexrange):
 
         rangestart, rangeend, units = indexrange
-        log.debug('rangestart: %s' % rangestart)
-        log.debug('rangeend: %s' % rangeend)
-        log.debug('units: %s' % units)
+        log.debug('rangestart: %s', rangestart)
+        log.debug('rangeend: %s', rangeend)
+        log.debug('units: %s', units)
 
         # ignore empty range
         if rangestart == '' and rangeend == '':
@@ -5883,8 +5879,8 @@ class MediaServer(object):
                 elif units == 'years':
                     rangestartdate = now+datedelta(years=rangeend)
                     rangeenddate = now+datedelta(years=rangestart)
-            log.debug('rangestartdate: %s' % rangestartdate)
-            log.debug('rangeenddate: %s' % rangeenddate)
+            log.debug('rangestartdate: %s', rangestartdate)
+            log.debug('rangeenddate: %s', rangeenddate)
 
         # now convert the input so the database understands it
 
@@ -5903,7 +5899,7 @@ class MediaServer(object):
             rangeendstring = escape_sql(rangeendstring)
             rangewhere = "%s between '%s' and '%s'" % (rangefield, rangestartstring, rangeendstring)
 
-        log.debug('rangewhere: %s' % rangewhere)
+        log.debug('rangewhere: %s', rangewhere)
 
         return 'where', rangewhere
 
@@ -5925,7 +5921,7 @@ class MediaServer(object):
         originalMatches = totalMatches
         if totalMatches > rangecount:
             totalMatches = rangecount
-            log.debug('range adjusted count: %s' % totalMatches)
+            log.debug('range adjusted count: %s', totalMatches)
 
         # for the statements we need to add additional limits
         # work out bounding limit clause
@@ -5942,16 +5938,156 @@ class MediaServer(object):
             orderstatement = 'SELECT * from (%s' % orderstatement
             # insert outer select limit before call limit
             orderstatement = orderstatement.replace(' limit ', ' %s limit ' % limitclause)
-            log.debug('range adjusted orderstatement: %s' % orderstatement)
+            log.debug('range adjusted orderstatement: %s', orderstatement)
 
         # alphastatement
         if alphastatement != '':
             # we need to add a bounding limit to the inner query
             alphastatement = alphastatement.replace('order by %%s)', 'order by %%s limit %s)' % limitclause)
-            log.debug('range adjusted alphastatement: %s' % alphastatement)
+            log.debug('range adjusted alphastatement: %s', alphastatement)
 
         return totalMatches, orderstatement, alphastatement
 
+    ###################
+    # keyset pagination
+    ###################
+
+    def keyset_statement(self, orderstatement, seekfield):
+
+        # convert a statement of the form
+        #     select ... where ... group by FIELD order by FIELD limit ?, ?
+        # into one that seeks past the last FIELD returned
+        #     select ... where (...) and FIELD > ? group by FIELD order by FIELD limit ?
+        # FIELD is unique in the result (it is the group) so the seek
+        # returns exactly the rows the offset would have.
+        # Anything else (user defined sorts, range adjusted statements)
+        # is not converted and is paged by offset
+        tail = ' group by %s order by %s limit ?, ?' % (seekfield, seekfield)
+        if not orderstatement.endswith(tail):
+            return None
+        head = orderstatement[:-len(tail)]
+        wheres = re.split(r'\swhere\s', head, flags=re.IGNORECASE)
+        if len(wheres) == 1:
+            head = '%s where %s > ?' % (head.rstrip(), seekfield)
+        elif len(wheres) == 2:
+            head = '%s where (%s) and %s > ?' % (wheres[0], wheres[1].strip(), seekfield)
+        else:
+            return None
+        return '%s group by %s order by %s limit ?' % (head, seekfield, seekfield)
+
+    def count_matches(self, c, countstatement, params=()):
+
+        # run a count statement, returning the total
+        # paging through a container runs the same count for every
+        # page, so the total is kept until the next container update
+        if self.query_cache_entries <= 0:
+            c.execute(countstatement, params)
+            total, = c.fetchone()
+            return int(total)
+
+        totalkey = (self.containerupdateid, countstatement, tuple(params))
+        now = time.time()
+        self.query_cache_lock.acquire()
+        try:
+            cached = self.query_totals.pop(totalkey, None)
+            if cached and now - cached[0] < self.query_cache_timeout:
+                self.query_totals[totalkey] = cached
+            else:
+                cached = None
+        finally:
+            self.query_cache_lock.release()
+        if cached:
+            log.debug("cached totalMatches: %s", cached[1])
+            return cached[1]
+
+        c.execute(countstatement, params)
+        total, = c.fetchone()
+        total = int(total)
+        self.query_cache_lock.acquire()
+        try:
+            self.query_totals[totalkey] = (now, total)
+            while len(self.query_totals) > self.query_cache_entries:
+                self.query_totals.popitem(last=False)
+        finally:
+            self.query_cache_lock.release()
+        return total
+
+    def execute_page(self, c, controllername, orderstatement, params, startingIndex, requestedCount, seekfield=None, keycol=1):
+
+        # run a paged statement, returning its rows
+        # if the request follows on from the last page returned for this
+        # controller and statement, seek past the last key instead of
+        # making SQLite skip startingIndex rows
+        seekstatement = None
+        if self.keyset_paging and seekfield:
+            seekstatement = self.keyset_statement(orderstatement, seekfield)
+
+        pagekey = (controllername, orderstatement, params)
+        lastpage = None
+        if seekstatement:
+            self.query_cache_lock.acquire()
+            try:
+                lastpage = self.keyset_pages.pop(pagekey, None)
+            finally:
+                self.query_cache_lock.release()
+
+        if lastpage and lastpage[0] == self.containerupdateid and lastpage[1] == startingIndex:
+            log.debug("keyset statement: %s", seekstatement)
+            c.execute(seekstatement, params + (lastpage[2], requestedCount))
+        else:
+            c.execute(orderstatement, params + (startingIndex, requestedCount))
+        rows = c.fetchall()
+
+        if seekstatement and rows and rows[-1][keycol] != None:
+            self.query_cache_lock.acquire()
+            try:
+                self.keyset_pages[pagekey] = (self.containerupdateid, startingIndex + len(rows), rows[-1][keycol])
+                while len(self.keyset_pages) > self.keyset_paging_entries:
+                    self.keyset_pages.popitem(last=False)
+            finally:
+                self.query_cache_lock.release()
+
+        return rows
+
+    ################
+    # search helpers
+    ################
+
+    def has_search_index(self, c):
+
+        # databases created by older versions of movetags have no
+        # full text search index
+        if self.search_index == None:
+            c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="tracksearch"')
+            n, = c.fetchone()
+            self.search_index = n != 0
+            log.debug('search index: %s', self.search_index)
+        return self.search_index
+
+    def prefix_where(self, field, searchstring):
+
+        # return a where clause (and its parameters) matching entries
+        # in field that start with searchstring
+        # a bound like can't use the index on field, a range can
+        # (the fields are COLLATE NOCASE so the range ignores case)
+        if not isinstance(searchstring, unicode):
+            searchstring = searchstring.decode('utf-8', 'replace')
+        searchwhere = "(%s >= ? and %s < ?)" % (field, field)
+        return searchwhere, (searchstring, searchstring + u'\U0010ffff')
+
+    def search_match(self, searchterms):
+
+        # convert a list of (field, searchstring) to an FTS match
+        # expression, each word in searchstring being a prefix of
+        # a word in field
+        matches = []
+        for field, searchstring in searchterms:
+            if not isinstance(searchstring, unicode):
+                searchstring = searchstring.decode('utf-8', 'replace')
+            for word in re.findall(r'\w+', searchstring, re.UNICODE):
+                matches += ['%s:%s*' % (field, word)]
+        return ' '.join(matches)
+
     #################    
     # display helpers
     #################    
@@ -6047,7 +6183,7 @@ class MediaServer(object):
                 for key in self.proxy_simple_keys:
                     if line.startswith(key):
                         value = line[len(key):].strip()
-                        log.debug("%s - %s" % (key, value))
+                        log.debug("%s - %s", key, value)
                         simple_keys[key[:-1]] = value
         if processing_index:
             if simple_keys != self.proxy_simple_key_dict:
@@ -6212,16 +6348,81 @@ class MediaServer(object):
         else:
             return '%salbumtype in (%s)' % (table, ','.join(str(t) for t in albumtypes))
 
+    ####################
+    # query result cache
+    ####################
+
+    def cached_query(self, query, args, kwargs):
+
+        # return the result of query(*args, **kwargs), reusing the result
+        # of an identical earlier query if there has been no container
+        # update since it was run.
+        # Only the outermost query is cached - hierarchicalQuery calls
+        # staticQuery/dynamicQuery, and there is no point caching both
+        if self.query_cache_entries <= 0 or getattr(self.query_cache_local, 'active', False):
+            return query(*args, **kwargs)
+
+        # the controller address is only logged, so leave it out of the key
+        querykwargs = tuple(sorted((k, repr(v)) for k, v in kwargs.iteritems() if k != 'Address'))
+        querykey = (query.__name__, self.containerupdateid, repr(args), querykwargs)
+
+        now = time.time()
+        self.query_cache_lock.acquire()
+        try:
+            cached = self.query_cache.pop(querykey, None)
+            if cached and now - cached[0] < self.query_cache_timeout:
+                self.query_cache_hits += 1
+                self.query_cache[querykey] = cached
+            else:
+                cached = None
+                self.query_cache_misses += 1
+        finally:
+            self.query_cache_lock.release()
+
+        if cached:
+            ret = cached[1]
+        else:
+            # run the query without the lock held
+            self.query_cache_local.active = True
+            try:
+                ret = query(*args, **kwargs)
+            finally:
+                self.query_cache_local.active = False
+            self.query_cache_lock.acquire()
+            try:
+                self.query_cache[querykey] = (now, ret)
+                while len(self.query_cache) > self.query_cache_entries:
+                    self.query_cache.popitem(last=False)
+            finally:
+                self.query_cache_lock.release()
+
+        log.debug("query cache: %s hits, %s misses, %s entries", self.query_cache_hits, self.query_cache_misses, len(self.query_cache))
+
+        # callers get their own copy of any lists in the result
+        if isinstance(ret, tuple):
+            ret = tuple(list(r) if isinstance(r, list) else r for r in ret)
+        return ret
+
+    def clear_query_cache(self):
+
+        self.query_cache_lock.acquire()
+        try:
+            self.query_cache.clear()
+            self.keyset_pages.clear()
+            self.query_totals.clear()
+            self.scroll_indices.clear()
+            self.search_index = None
+        finally:
+            self.query_cache_lock.release()
+        log.debug("query cache cleared: %s hits, %s misses", self.query_cache_hits, self.query_cache_misses)
+
     #####################
     # updateid processors
     #####################
 
     def get_containerupdateid(self):
         # get containerupdateid from db
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        db = self.proxy.db_pool.connect()
 #        log.debug(db)
         c = db.cursor()
         statement = "select lastscanid from params where key = '1'"
@@ -6233,18 +6434,16 @@ class MediaServer(object):
         if new_updateid != self.containerupdateid:
             updated = True
             self.containerupdateid = new_updateid
+            self.clear_query_cache()
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
         return updated, self.containerupdateid
 
     def set_containerupdateid(self):
         # set containerupdateid
-        if self.proxy.db_persist_connection:
-            db = self.proxy.db
-        else:
-            db = sqlite3.connect(self.dbspec)
+        # (pooled connections are read only, so use a connection of our own)
+        db = sqlite3.connect(self.dbspec)
 #        log.debug(db)
         c = db.cursor()
 
@@ -6262,9 +6461,9 @@ class MediaServer(object):
         if new_updateid != self.containerupdateid:
             updated = True
             self.containerupdateid = new_updateid
+            self.clear_query_cache()
         c.close()
-        if not self.proxy.db_persist_connection:
-            db.close()
+        db.close()
 
         return updated, self.containerupdateid
 
@@ -6275,7 +6474,7 @@ class MediaServer(object):
         updateid1 = '10,%s' % (self.systemupdateid)
         self._state_variables['ContainerUpdateIDs'].update(updateid1)
         self._state_variables['SystemUpdateID'].update(self.systemupdateid)
-        log.debug("ContainerUpdateIDs value: %s" % self._state_variables['ContainerUpdateIDs'].get_value())
+        log.debug("ContainerUpdateIDs value: %s", self._state_variables['ContainerUpdateIDs'].get_value())
         self.systemupdateid += 1
         updateid2 = '11,%s' % (self.systemupdateid)
         self.systemupdateid += 1
@@ -6286,7 +6485,7 @@ class MediaServer(object):
         self.playlistupdateid = self.systemupdateid
         self._state_variables['ContainerUpdateIDs'].update(updateid)
         self._state_variables['SystemUpdateID'].update(self.systemupdateid)
-        log.debug("ContainerUpdateIDs value: %s" % self._state_variables['ContainerUpdateIDs'].get_value())
+        log.debug("ContainerUpdateIDs value: %s", self._state_variables['ContainerUpdateIDs'].get_value())
 
 
     #########
@@ -6340,9 +6539,9 @@ class MediaServer(object):
 
     def get_icon(self, indexkey):
         # TODO: support different per controller?
-        log.debug('get_icon indexkey: %s' % indexkey)
+        log.debug('get_icon indexkey: %s', indexkey)
         icon_entry = self.icon_entries.get(indexkey, None)
-        log.debug('get_icon icon_entry: %s' % icon_entry)
+        log.debug('get_icon icon_entry: %s', icon_entry)
         icon = ''
         if icon_entry:
             icon = self.proxy.index_icons.get(icon_entry, '')
@@ -6352,8 +6551,8 @@ class MediaServer(object):
 
     def get_orderby(self, sorttype, controller, dynamic=True, orderby=None):
 
-        log.debug('get_orderby sorttype: %s' % sorttype)
-        log.debug('get_orderby orderby: %s' % orderby)
+        log.debug('get_orderby sorttype: %s', sorttype)
+        log.debug('get_orderby orderby: %s', orderby)
         albumtypes = self.user_index_key_dict['show_albums']
 
         # static = sort_order, entry_prefix, entry_suffix, albumtypes
@@ -6400,7 +6599,7 @@ class MediaServer(object):
                     elif values[namekey].lower() == 'all' and values['controller'].lower() == 'all' and \
                          not bothfound and not proxyfound and not controllerfound and not foundvalues:
                         foundvalues = values
-            log.debug('foundvalues: %s' % foundvalues)
+            log.debug('foundvalues: %s', foundvalues)
             if not foundvalues:
                 if dynamic: 
                     return default_dynamic_orderby
@@ -6422,9 +6621,9 @@ class MediaServer(object):
         if fix and fix != '':
 
             fixes, entries, entrystring = self.get_code_snippets(fix)
-            log.debug('fixes: %s' % fixes)
-            log.debug('entries: %s' % entries)
-            log.debug('entrystring: %s' % entrystring)
+            log.debug('fixes: %s', fixes)
+            log.debug('entries: %s', entries)
+            log.debug('entrystring: %s', entrystring)
 #            fix = fix.replace(' ', '')
 #            fixes = fix.lower().split(',')
 
@@ -6467,17 +6666,17 @@ class MediaServer(object):
                             data = self.metadata_empty
                         else:
                             if snippet:
-                                log.debug('data before: %s' % data)
-                                log.debug('%s=%s' % (fix, data))
-                                log.debug('data=%s' % snippet)
+                                log.debug('data before: %s', data)
+                                log.debug('%s=%s', fix, data)
+                                log.debug('data=%s', snippet)
                                 exec('%s=%s' % (fix, data))
                                 exec('data=%s' % snippet)
-                                log.debug('data after: %s' % data)
+                                log.debug('data after: %s', data)
                         outfix += replace % data
         return outfix
 
     def dynamic_makepresuffix(self, snippetlist, replace, fixdata, ps):
-        log.debug('snippetlist: %s' % snippetlist)
+        log.debug('snippetlist: %s', snippetlist)
 #        log.debug(replace)
 #        log.debug(fixdata)
 
@@ -6523,12 +6722,12 @@ class MediaServer(object):
                         data = self.metadata_empty
                     else:
                         if snippet:
-                            log.debug('data before: %s' % data)
-                            log.debug('%s=%s' % (fix, data))
-                            log.debug('data=%s' % snippet)
+                            log.debug('data before: %s', data)
+                            log.debug('%s=%s', fix, data)
+                            log.debug('data=%s', snippet)
                             exec('%s=%s' % (fix, data))
                             exec('data=%s' % snippet)
-                            log.debug('data after: %s' % data)
+                            log.debug('data after: %s', data)
                     outfix += replace % data
                 fixcount += 1
         return outfix
@@ -6818,18 +7017,20 @@ class MediaServer(object):
         # note that when logging with debugout, the callers details will be
         # logger rather than debugout's details (hacked in brisa/log.py)
 
+        if not log.is_enabled():
+            return
         if isinstance(data, dict):
             dbo = ''
             for k,v in data.iteritems():
                 dbo += '\n\t\t\t\t\t\t\t\t\t\t\t\t%s: %s' % (k, v)
-            log.debug('%s:%s' % (label, dbo))
+            log.debug('%s:%s', label, dbo)
         elif isinstance(data, (list, tuple, set, frozenset)):
             dbo = ''
             for v in data:
                 dbo += '\n\t\t\t\t\t\t\t\t\t\t\t\t%s' % (repr(v))
-            log.debug('%s:%s' % (label, dbo))
+            log.debug('%s:%s', label, dbo)
         else:
-            log.debug('%s: %s' % (label, data))
+            log.debug('%s: %s', label, data)
 
 
 #################
@@ -6916,6 +7117,12 @@ def escape_sql(sql):
         sql = sql.replace("'", "''")
     return sql
 
+def escape_like(sql):
+    # escape like wildcards (for use with escape '\')
+    if isinstance(sql, basestring):
+        sql = sql.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return sql
+
 escape_entities = {'"' : '&quot;', "'" : '&apos;', " " : '%20'}
 escape_entities_quotepos = {'"' : '&quot;', "'" : '&apos;'}
 unescape_entities = {'&quot;' : '"', '&apos;' : "'", '%20' : " ", '&amp;' : "&"}
@@ -31,12 +31,33 @@ import datetime
 from collections import defaultdict
 from dateutil.parser import parse as parsedate
 from scanfuncs import adjust_tracknumber, truncate_number
+from scanfuncs import LookupCache
 import filelog
 
 import errors
 errors.catch_errors()
 
 MULTI_SEPARATOR = '\n'
+
+# track tables whose secondary indexes are dropped during a bulk load
+bulk_load_tables = ['tracks', 'albums', 'albumsonly',
+                    'Artist', 'Albumartist', 'Composer', 'Genre',
+                    'GenreArtist', 'GenreAlbumartist', 'GenreArtistAlbum', 'GenreAlbumartistAlbum',
+                    'ArtistAlbum', 'AlbumartistAlbum', 'ComposerAlbum',
+                    'ArtistAlbumsonly', 'AlbumartistAlbumsonly',
+                    'GenreArtistAlbumTrack', 'GenreAlbumartistAlbumTrack',
+                    'ArtistAlbumTrack', 'AlbumartistAlbumTrack', 'ComposerAlbumTrack',
+                    'TrackNumbers']
+# secondary indexes that movetags looks rows up through, or that the
+# proxy needs while a load runs (cover art), which are kept
+bulk_load_keep_indexes = ['inxTrackPathFilename', 'inxTrackAlbumDups',
+                          'inxTrackFolderartids', 'inxTrackTrackartids',
+                          'inxAlbumTracknumbers2', 'inxAlbumsonlyshort',
+                          'inxGenreArtistAlbumGenreArtist', 'inxGenreAlbumartistAlbumGenreAlbumartist',
+                          'inxArtistAlbumsonlyAlbumType', 'inxAlbumartistAlbumsonlyAlbumType',
+                          'inxGenreArtistAlbumTrackGenreArtistAlbumIdDup', 'inxGenreAlbumartistAlbumTrackGenreAlbumArtistAlbumIdDup',
+                          'inxArtistAlbumTrackArtistAlbumIdDup', 'inxAlbumArtistAlbumTrackAlbumArtistAlbumIdDup',
+                          'inxComposerAlbumTrackComposerAlbumIdDup']
 enc = sys.getfilesystemencoding()
 DEFAULTYEAR = 1
 DEFAULTMONTH = 1
@@ -64,16 +85,14 @@ def process_tags(args, options, tagdatabase, trackdatabase):
     db2.execute("PRAGMA synchronous = 0;")
     cs2 = db2.cursor()
 
-    if tagdatabase == trackdatabase:
-        db1 = sqlite3.connect(tagdatabase)
-        cs1 = db1.cursor()
-        cs1.execute("attach '' as tempdb")
-        cs1.execute("""create table tempdb.tags_update as select * from tags_update""")
-        cs1.execute("""create table tempdb.tags as select * from tags""")
-        cs1.execute("""create table tempdb.workvirtuals_update as select * from workvirtuals_update""")
-    else:
-        db1 = sqlite3.connect(tagdatabase)
-        cs1 = db1.cursor()
+    # recreate indexes left dropped by an interrupted bulk load
+    restored = restore_bulk_indexes(db2)
+    if restored:
+        logstring = "Recreated %d indexes from interrupted bulk load" % restored
+        filelog.write_log(logstring)
+
+    db1 = sqlite3.connect(tagdatabase)
+    cs1 = db1.cursor()
 
 #    artist_parentid = 100000000
 #    album_parentid = 300000000
@@ -238,6 +257,53 @@ def process_tags(args, options, tagdatabase, trackdatabase):
         errorstring = "Error writing workvirtual numbers: %s" % e.args[0]
         filelog.write_error(errorstring)
 
+    # lookup caching
+    # command line overrides ini
+    cache_lookups = options.cache_lookups
+    if not cache_lookups:
+        try:        
+            ini_cache_lookups = config.get('movetags', 'cache_lookups')
+            if ini_cache_lookups.lower() == 'y': cache_lookups = True
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+    lookup_cache_entries = 0
+    if cache_lookups:
+        lookup_cache_entries = 1000000
+        try:        
+            lookup_cache_entries = config.getint('movetags', 'lookup_cache_entries')
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        logstring = "Lookup cache entries: %d" % lookup_cache_entries
+        filelog.write_verbose_log(logstring)
+    lookups = LookupCache(lookup_cache_entries)
+
+    # bulk load
+    # if the number of tracks to update is at least bulk_load_fraction
+    # of the tracks in the database (and at least bulk_load_minimum)
+    # secondary indexes are dropped before and recreated after the load
+    bulk_load_fraction = 0.5
+    try:        
+        bulk_load_fraction = config.getfloat('movetags', 'bulk_load_fraction')
+    except ConfigParser.NoSectionError:
+        pass
+    except ConfigParser.NoOptionError:
+        pass
+    except ValueError:
+        pass
+    bulk_load_minimum = 5000
+    try:        
+        bulk_load_minimum = config.getint('movetags', 'bulk_load_minimum')
+    except ConfigParser.NoSectionError:
+        pass
+    except ConfigParser.NoOptionError:
+        pass
+    except ValueError:
+        pass
+
     # get outstanding scan details
     db3 = sqlite3.connect(tagdatabase)
     cs3 = db3.cursor()
@@ -260,6 +326,69 @@ def process_tags(args, options, tagdatabase, trackdatabase):
     if options.scancount != None:
         logstring = "Scan count: %d" % options.scancount
         filelog.write_verbose_log(logstring)
+        scan_details = scan_details[:options.scancount]
+
+    # if the tag and track tables are in the same database, the tag tables
+    # are read while the track tables are written through another connection
+    # - in WAL mode the reads see a snapshot so can use the tag tables directly
+    # - otherwise copy the update records for the scans to be processed (and
+    #   the tags they join to) so that the copy is proportional to the number
+    #   of changed tracks rather than the size of the library
+    select_tu = 'tags_update'
+    select_wv = 'workvirtuals_update'
+    select_t  = 'tags'
+    if tagdatabase == trackdatabase and scan_details:
+        last_scan_id = scan_details[-1][0]
+        try:
+            cs1.execute("PRAGMA journal_mode;")
+            journal_mode, = cs1.fetchone()
+            if journal_mode.lower() == 'wal':
+                logstring = "Reading tag updates from source tables"
+                filelog.write_verbose_log(logstring)
+            else:
+                logstring = "Copying tag updates for scans up to: %d" % last_scan_id
+                filelog.write_verbose_log(logstring)
+                cs1.execute("attach '' as tempdb")
+                cs1.execute("""create table tempdb.tags_update as select * from tags_update where scannumber<=?""", (last_scan_id, ))
+                cs1.execute("""create table tempdb.workvirtuals_update as select * from workvirtuals_update where scannumber<=?""", (last_scan_id, ))
+                cs1.execute("""create table tempdb.tags as select * from tags where id in (select id from tempdb.workvirtuals_update)""")
+                cs1.execute("""create index tempdb.inxTempTagsUpdate on tags_update (scannumber)""")
+                cs1.execute("""create index tempdb.inxTempTagsUpdateId on tags_update (id, updatetype, updateorder)""")
+                cs1.execute("""create index tempdb.inxTempWorkvirtualsUpdate on workvirtuals_update (scannumber)""")
+                cs1.execute("""create index tempdb.inxTempTags on tags (id)""")
+                select_tu = 'tempdb.tags_update'
+                select_wv = 'tempdb.workvirtuals_update'
+                select_t  = 'tempdb.tags'
+        except sqlite3.Error, e:
+            errorstring = "Error copying tag updates: %s" % e.args[0]
+            filelog.write_error(errorstring)
+
+    # decide whether to bulk load
+    bulk_load = False
+    if bulk_load_fraction > 0 and scan_details:
+        last_scan_id = scan_details[-1][0]
+        try:
+            cs1.execute("""select count(*) from %s where scannumber<=? and updateorder=0""" % select_tu, (last_scan_id, ))
+            update_count, = cs1.fetchone()
+            cs2.execute("""select count(*) from tracks""")
+            track_count, = cs2.fetchone()
+            if update_count >= bulk_load_minimum and update_count >= track_count * bulk_load_fraction:
+                bulk_load = True
+                logstring = "Bulk load: %d updates, %d tracks" % (update_count, track_count)
+                filelog.write_log(logstring)
+        except sqlite3.Error, e:
+            errorstring = "Error counting tag updates: %s" % e.args[0]
+            filelog.write_error(errorstring)
+    if bulk_load:
+        phase_start = time.time()
+        try:
+            dropped = drop_bulk_indexes(db2)
+            logstring = "Bulk load: dropped %d indexes in %.1f seconds" % (dropped, time.time() - phase_start)
+            filelog.write_log(logstring)
+        except sqlite3.Error, e:
+            errorstring = "Error dropping indexes: %s" % e.args[0]
+            filelog.write_error(errorstring)
+        phase_start = time.time()
 
     # process outstanding scans
     scan_count = 0
@@ -290,14 +419,6 @@ def process_tags(args, options, tagdatabase, trackdatabase):
             filelog.write_verbose_log(logstring)
 
             # process tag records that exist for this scan
-            if tagdatabase != trackdatabase:
-                select_tu = 'tags_update'
-                select_wv = 'workvirtuals_update'
-                select_t  = 'tags'
-            else:
-                select_tu = 'tempdb.tags_update'
-                select_wv = 'tempdb.workvirtuals_update'
-                select_t  = 'tempdb.tags'
             if options.regenerate:
                 orderby_tu = 'id, updateorder'
                 orderby_wv = 'w.wvfile, w.plfile, w.id, w.title, w.type, w.occurs, w.updateorder'
@@ -1143,34 +1264,41 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                         logstring = "DELETE GenreArtist:" + str(delete)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute("""delete from GenreArtist where not exists (select 1 from GenreArtistAlbum where genre=? and artist=?) and genre=? and artist=?""", delete)
+                                        lookups.discard('GenreArtist', (o_genre, o_artist))
                                         delete = (o_genre, o_artist, album_id, o_duplicate, o_albumtype, album_id)
                                         logstring = "DELETE GenreArtistAlbum:" + str(delete)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute("""delete from GenreArtistAlbum where not exists (select 1 from GenreArtistAlbumTrack where genre=? and artist=? and album_id=? and duplicate=? and albumtype=?) and album_id=?""", delete)
+                                        lookups.discard_group('GenreArtistAlbum', album_id)
                                     for o_albumartist in o_albumartistlist:
                                         delete = (o_genre, o_albumartist, o_genre, o_albumartist)
                                         logstring = "DELETE GenreAlbumartist:" + str(delete)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute("""delete from GenreAlbumartist where not exists (select 1 from GenreAlbumartistAlbum where genre=? and albumartist=?) and genre=? and albumartist=?""", delete)
+                                        lookups.discard('GenreAlbumartist', (o_genre, o_albumartist))
                                         delete = (o_genre, o_albumartist, album_id, o_duplicate, o_albumtype, album_id)
                                         logstring = "DELETE GenreAlbumartistAlbum:" + str(delete)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute("""delete from GenreAlbumartistAlbum where not exists (select 1 from GenreAlbumartistAlbumTrack where genre=? and albumartist=? and album_id=? and duplicate=? and albumtype=?) and album_id=?""", delete)
+                                        lookups.discard_group('GenreAlbumartistAlbum', album_id)
                                 for o_artist in o_artistlist:
                                     delete = (o_artist, album_id, o_duplicate, o_albumtype, album_id)
                                     logstring = "DELETE ArtistAlbum:" + str(delete)
                                     filelog.write_verbose_log(logstring)
                                     cs2.execute("""delete from ArtistAlbum where not exists (select 1 from ArtistAlbumTrack where artist=? and album_id=? and duplicate=? and albumtype=?) and album_id=?""", delete)
+                                    lookups.discard_group('ArtistAlbum', album_id)
                                 for o_albumartist in o_albumartistlist:
                                     delete = (o_albumartist, album_id, o_duplicate, o_albumtype, album_id)
                                     logstring = "DELETE AlbumartistAlbum:" + str(delete)
                                     filelog.write_verbose_log(logstring)
                                     cs2.execute("""delete from AlbumartistAlbum where not exists (select 1 from AlbumartistAlbumTrack where albumartist=? and album_id=? and duplicate=? and albumtype=?) and album_id=?""", delete)
+                                    lookups.discard_group('AlbumartistAlbum', album_id)
                                 for o_composer in o_composerlist:
                                     delete = (o_composer, album_id, o_duplicate, o_albumtype, album_id)
                                     logstring = "DELETE ComposerAlbum:" + str(delete)
                                     filelog.write_verbose_log(logstring)
                                     cs2.execute("""delete from ComposerAlbum where not exists (select 1 from ComposerAlbumTrack where composer=? and album_id=? and duplicate=? and albumtype=?) and album_id=?""", delete)
+                                    lookups.discard_group('ComposerAlbum', album_id)
                         except sqlite3.Error, e:
                             errorstring = "Error deleting (genre)/(artist/albumartist/composer)/artist lookup details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1182,65 +1310,58 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                 for genre in genrelist:
                                     for artist in artistlist:
                                         check = (genre, artist)
-                                        cs2.execute("""select * from GenreArtist where genre=? and artist=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
+                                        if not lookups.exists(cs2, 'GenreArtist', """select * from GenreArtist where genre=? and artist=?""", check):
                                             insert = check + ('', '')
                                             logstring = "INSERT GenreArtist: %s" % str(insert)
                                             filelog.write_verbose_log(logstring)
                                             cs2.execute('insert into GenreArtist values (?,?,?,?)', insert)
+                                            lookups.add('GenreArtist', check)
                                         check = (album_id, genre, artist, album, duplicate, albumtype, artistsort)
-                                        cs2.execute("""select * from GenreArtistAlbum where album_id=? and genre=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
+                                        if not lookups.exists(cs2, 'GenreArtistAlbum', """select * from GenreArtistAlbum where album_id=? and genre=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check, album_id):
                                             insert = check + ('', '')
                                             logstring = "INSERT GenreArtistAlbum: %s" % str(insert)
                                             filelog.write_verbose_log(logstring)
                                             cs2.execute('insert into GenreArtistAlbum values (?,?,?,?,?,?,?,?,?)', insert)
+                                            lookups.add('GenreArtistAlbum', check, album_id)
                                     for albumartist in albumartistlist:
                                         check = (genre, albumartist)
-                                        cs2.execute("""select * from GenreAlbumartist where genre=? and albumartist=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
+                                        if not lookups.exists(cs2, 'GenreAlbumartist', """select * from GenreAlbumartist where genre=? and albumartist=?""", check):
                                             insert = check + ('', '')
                                             logstring = "INSERT GenreAlbumartist: %s" % str(insert)
                                             filelog.write_verbose_log(logstring)
                                             cs2.execute('insert into GenreAlbumartist values (?,?,?,?)', insert)
+                                            lookups.add('GenreAlbumartist', check)
                                         check = (album_id, genre, albumartist, album, duplicate, albumtype, albumartistsort)
-                                        cs2.execute("""select * from GenreAlbumartistAlbum where album_id=? and genre=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check)
-                                        crow = cs2.fetchone()
-                                        if not crow:
+                                        if not lookups.exists(cs2, 'GenreAlbumartistAlbum', """select * from GenreAlbumartistAlbum where album_id=? and genre=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check, album_id):
                                             insert = check + ('', '')
                                             logstring = "INSERT GenreAlbumartistAlbum: %s" % str(insert)
                                             filelog.write_verbose_log(logstring)
                                             cs2.execute('insert into GenreAlbumartistAlbum values (?,?,?,?,?,?,?,?,?)', insert)
+                                            lookups.add('GenreAlbumartistAlbum', check, album_id)
                                 for artist in artistlist:
                                     check = (album_id, artist, album, duplicate, albumtype, artistsort)
-                                    cs2.execute("""select * from ArtistAlbum where album_id=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
+                                    if not lookups.exists(cs2, 'ArtistAlbum', """select * from ArtistAlbum where album_id=? and artist=? and album=? and duplicate=? and albumtype=? and artistsort=?""", check, album_id):
                                         insert = check + ('', '')
                                         logstring = "INSERT ArtistAlbum:" + str(insert)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute('insert into ArtistAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                        lookups.add('ArtistAlbum', check, album_id)
                                 for albumartist in albumartistlist:
                                     check = (album_id, albumartist, album, duplicate, albumtype, albumartistsort)
-                                    cs2.execute("""select * from AlbumartistAlbum where album_id=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
+                                    if not lookups.exists(cs2, 'AlbumartistAlbum', """select * from AlbumartistAlbum where album_id=? and albumartist=? and album=? and duplicate=? and albumtype=? and albumartistsort=?""", check, album_id):
                                         insert = check + ('', '')
                                         logstring = "INSERT AlbumartistAlbum:" + str(insert)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute('insert into AlbumartistAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                        lookups.add('AlbumartistAlbum', check, album_id)
                                 for composer in composerlist:
                                     check = (album_id, composer, album, duplicate, albumtype, composersort)
-                                    cs2.execute("""select * from ComposerAlbum where album_id=? and composer=? and album=? and duplicate=? and albumtype=? and composersort=?""", check)
-                                    crow = cs2.fetchone()
-                                    if not crow:
+                                    if not lookups.exists(cs2, 'ComposerAlbum', """select * from ComposerAlbum where album_id=? and composer=? and album=? and duplicate=? and albumtype=? and composersort=?""", check, album_id):
                                         insert = check + ('', '')
                                         logstring = "INSERT ComposerAlbum:" + str(insert)
                                         filelog.write_verbose_log(logstring)
                                         cs2.execute('insert into ComposerAlbum values (?,?,?,?,?,?,?,?)', insert)
+                                        lookups.add('ComposerAlbum', check, album_id)
                         except sqlite3.Error, e:
                             errorstring = "Error inserting (genre)/(artist/albumartist/composer)/album lookup details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1274,6 +1395,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                             logstring = "DELETE ARTIST: %s" % o_artist
                             filelog.write_verbose_log(logstring)
                             cs2.execute("""delete from Artist where not exists (select 1 from ArtistAlbumTrack where artist=?) and artist=?""", delete)
+                            lookups.discard('Artist', (o_artist, ))
                         except sqlite3.Error, e:
                             errorstring = "Error deleting artist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1284,13 +1406,12 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
                         try:
                             # check whether we already have this artist (from a previous run or another track)
-                            cs2.execute("""select artist from Artist where artist=?""", (artist, ))
-                            crow = cs2.fetchone()
-                            if not crow:
+                            if not lookups.exists(cs2, 'Artist', """select artist from Artist where artist=?""", (artist, )):
                                 artists = (None, artist, '', '')
                                 logstring = "INSERT ARTIST: %s" % str(artists)
                                 filelog.write_verbose_log(logstring)
                                 cs2.execute('insert into Artist values (?,?,?,?)', artists)
+                                lookups.add('Artist', (artist, ))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting artist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1324,6 +1445,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                             logstring = "DELETE ALBUMARTIST: %s" % o_albumartist
                             filelog.write_verbose_log(logstring)
                             cs2.execute("""delete from Albumartist where not exists (select 1 from AlbumartistAlbumTrack where albumartist=?) and albumartist=?""", delete)
+                            lookups.discard('Albumartist', (o_albumartist, ))
                         except sqlite3.Error, e:
                             errorstring = "Error deleting albumartist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1334,13 +1456,12 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
                         try:
                             # check whether we already have this albumartist (from a previous run or another track)
-                            cs2.execute("""select albumartist from Albumartist where albumartist=?""", (albumartist, ))
-                            crow = cs2.fetchone()
-                            if not crow:
+                            if not lookups.exists(cs2, 'Albumartist', """select albumartist from Albumartist where albumartist=?""", (albumartist, )):
                                 albumartists = (None, albumartist, '', '')
                                 logstring = "INSERT ALBUMARTIST: %s" % str(albumartists)
                                 filelog.write_verbose_log(logstring)
                                 cs2.execute('insert into Albumartist values (?,?,?,?)', albumartists)
+                                lookups.add('Albumartist', (albumartist, ))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting albumartist details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1374,6 +1495,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                             logstring = "DELETE COMPOSER: %s" % o_composer
                             filelog.write_verbose_log(logstring)
                             cs2.execute("""delete from Composer where not exists (select 1 from ComposerAlbumTrack where composer=?) and composer=?""", delete)
+                            lookups.discard('Composer', (o_composer, ))
                         except sqlite3.Error, e:
                             errorstring = "Error deleting composer details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1384,13 +1506,12 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
                         try:
                             # check whether we already have this composer (from a previous run or another track)
-                            cs2.execute("""select composer from Composer where composer=?""", (composer, ))
-                            crow = cs2.fetchone()
-                            if not crow:
+                            if not lookups.exists(cs2, 'Composer', """select composer from Composer where composer=?""", (composer, )):
                                 composers = (None, composer, '', '')
                                 logstring = "INSERT COMPOSER: %s" % str(composers)
                                 filelog.write_verbose_log(logstring)
                                 cs2.execute('insert into Composer values (?,?,?,?)', composers)
+                                lookups.add('Composer', (composer, ))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting composer details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1430,6 +1551,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
                                         select 1 from GenreAlbumartistAlbumTrack where genre=?
                                         ) and Genre=?
                                         """, delete)
+                            lookups.discard('Genre', (o_genre, ))
                         except sqlite3.Error, e:
                             errorstring = "Error deleting genre details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1440,13 +1562,12 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
                         try:
                             # check whether we already have this genre (from a previous run or another track)
-                            cs2.execute("""select genre from Genre where genre=?""", (genre, ))
-                            crow = cs2.fetchone()
-                            if not crow:
+                            if not lookups.exists(cs2, 'Genre', """select genre from Genre where genre=?""", (genre, )):
                                 genres = (None, genre, '', '')
                                 logstring = "INSERT GENRE: %s" % str(genres)
                                 filelog.write_verbose_log(logstring)
                                 cs2.execute('insert into Genre values (?,?,?,?)', genres)
+                                lookups.add('Genre', (genre, ))
                         except sqlite3.Error, e:
                             errorstring = "Error inserting genre details: %s" % e.args[0]
                             filelog.write_error(errorstring)
@@ -1645,6 +1766,14 @@ def process_tags(args, options, tagdatabase, trackdatabase):
 
     cs1.close()
 
+    if bulk_load:
+        logstring = "Bulk load: loaded in %.1f seconds" % (time.time() - phase_start)
+        filelog.write_log(logstring)
+        phase_start = time.time()
+        restored = restore_bulk_indexes(db2)
+        logstring = "Bulk load: recreated %d indexes in %.1f seconds" % (restored, time.time() - phase_start)
+        filelog.write_log(logstring)
+
     if not options.quiet and not options.verbose:
         out = "\n"
         sys.stderr.write(out)
@@ -1692,6 +1821,7 @@ def process_tags(args, options, tagdatabase, trackdatabase):
     db2.commit()
     
     # update stats
+    phase_start = time.time()
     try:
         cs2.execute("""analyze""")
     except sqlite3.Error, e:
@@ -1699,9 +1829,17 @@ def process_tags(args, options, tagdatabase, trackdatabase):
         filelog.write_error(errorstring)
 
     db2.commit()
+
+    if bulk_load:
+        logstring = "Bulk load: analyzed in %.1f seconds" % (time.time() - phase_start)
+        filelog.write_log(logstring)
     
     cs2.close()
 
+    if cache_lookups:
+        logstring = "Lookup cache: %d hits, %d misses, %d entries" % (lookups.hits, lookups.misses, lookups.entries)
+        filelog.write_log(logstring)
+
     logstring = "Tags processed"
     filelog.write_log(logstring)
 
@@ -2473,12 +2611,121 @@ def create_database(database):
             c.execute('''create index inxTrackNumbersAlbumartist on TrackNumbers (albumartist, dummyalbum, duplicate, albumtype)''')
             c.execute('''create index inxTrackNumbersComposer on TrackNumbers (composer, dummyalbum, duplicate, albumtype)''')
 
+        # indexes the proxy looks cover art up through when rebuilding its
+        # cover cache (created here too for databases that predate them)
+        c.execute('''create index if not exists inxTrackFolderartids on tracks (folderartid)''')
+        c.execute('''create index if not exists inxTrackTrackartids on tracks (trackartid)''')
+
+        # full text search index on tracks, used by the proxy for searches
+        # - it is an external content table so only the index is stored,
+        #   and is kept in step with tracks by triggers
+        # - prefix indexes are kept for short prefixes, as searches are
+        #   run as the user types
+        c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="tracksearch"')
+        n, = c.fetchone()
+        if n == 0:
+            try:
+                create_search_index(c)
+            except sqlite3.OperationalError, e:
+                # this SQLite doesn't support FTS4 - the proxy will search tracks directly
+                errorstring = "Unable to create search index: %s, %s" % (database, e)
+                filelog.write_error(errorstring)
+
     except sqlite3.Error, e:
         errorstring = "Error creating database: %s, %s" % (database, e)
         filelog.write_error(errorstring)
     db.commit()
     c.close()
 
+search_fields = 'title, album, artist, albumartist, composer, genre'
+
+def create_search_index(c):
+    searchfields = search_fields
+    try:
+        c.execute('''create virtual table tracksearch using fts4(content="tracks", %s, 
+                                                                 prefix="1,2,3", tokenize=unicode61)
+                  ''' % searchfields)
+    except sqlite3.OperationalError:
+        # unicode61 tokenizer not available, use the default
+        c.execute('''create virtual table tracksearch using fts4(content="tracks", %s, 
+                                                                 prefix="1,2,3")
+                  ''' % searchfields)
+    create_search_triggers(c)
+    # index any tracks already in the database
+    c.execute("insert into tracksearch(tracksearch) values('rebuild')")
+
+def create_search_triggers(c):
+    searchfields = search_fields
+    newfields = ', '.join(['new.%s' % f.strip() for f in searchfields.split(',')])
+    # entries are removed before the tracks row changes, as FTS4 reads
+    # the old values from tracks to find the index entries to remove
+    c.execute('''create trigger trgTracksearchBeforeUpdate before update on tracks begin
+                     delete from tracksearch where docid = old.rowid;
+                 end''')
+    c.execute('''create trigger trgTracksearchBeforeDelete before delete on tracks begin
+                     delete from tracksearch where docid = old.rowid;
+                 end''')
+    c.execute('''create trigger trgTracksearchAfterUpdate after update on tracks begin
+                     insert into tracksearch(docid, %s) values(new.rowid, %s);
+                 end''' % (searchfields, newfields))
+    c.execute('''create trigger trgTracksearchAfterInsert after insert on tracks begin
+                     insert into tracksearch(docid, %s) values(new.rowid, %s);
+                 end''' % (searchfields, newfields))
+
+def drop_bulk_indexes(db):
+    '''
+        drop the secondary indexes on the track tables that movetags
+        doesn't use for its own lookups, and the search index triggers,
+        saving their definitions in bulkindexes so that they are
+        recreated even if the load is interrupted
+        return the number of indexes dropped
+    '''
+    c = db.cursor()
+    c.execute('''create table if not exists bulkindexes (name text, sql text)''')
+    tables = ','.join(['?'] * len(bulk_load_tables))
+    c.execute("""select name, sql from sqlite_master where type='index' and sql is not null and tbl_name in (%s)""" % tables, bulk_load_tables)
+    indexes = [(name, sql) for name, sql in c.fetchall() if not sql.lower().startswith('create unique') and not name in bulk_load_keep_indexes]
+    for name, sql in indexes:
+        c.execute('''insert into bulkindexes values (?, ?)''', (name, sql))
+        c.execute('''drop index %s''' % name)
+    # the search index is rebuilt in one pass rather than row by row
+    c.execute("""select name from sqlite_master where type='trigger' and name like 'trgTracksearch%'""")
+    triggers = c.fetchall()
+    for name, in triggers:
+        c.execute('''drop trigger %s''' % name)
+    if triggers:
+        c.execute('''insert into bulkindexes values ('tracksearch', '')''')
+    db.commit()
+    c.close()
+    return len(indexes)
+
+def restore_bulk_indexes(db):
+    '''
+        recreate any indexes dropped by drop_bulk_indexes
+        return the number of indexes recreated
+    '''
+    c = db.cursor()
+    count = 0
+    c.execute('SELECT count(*) FROM sqlite_master WHERE type="table" AND name="bulkindexes"')
+    n, = c.fetchone()
+    if n != 0:
+        c.execute('''select name, sql from bulkindexes''')
+        for name, sql in c.fetchall():
+            try:
+                if name == 'tracksearch':
+                    create_search_triggers(c)
+                    c.execute("insert into tracksearch(tracksearch) values('rebuild')")
+                else:
+                    c.execute(sql)
+                    count += 1
+            except sqlite3.Error, e:
+                errorstring = "Error recreating index: %s, %s" % (name, e)
+                filelog.write_error(errorstring)
+        c.execute('''drop table bulkindexes''')
+        db.commit()
+    c.close()
+    return count
+
 def empty_database(database):
 
     # check whether there are any track tables (check for last table in delete list below)
@@ -2521,6 +2768,7 @@ def empty_database(database):
             c.execute('''drop table if exists AlbumartistAlbumTrack''')
             c.execute('''drop table if exists ComposerAlbumTrack''')
             c.execute('''drop table if exists TrackNumbers''')
+            c.execute('''drop table if exists tracksearch''')
         except sqlite3.Error, e:
             errorstring = "Error dropping table: %s, %s" % (table, e)
             filelog.write_error(errorstring)
@@ -2559,6 +2807,9 @@ def process_command_line(argv):
     parser.add_option("-r", "--regenerate",
                       action="store_true", dest="regenerate", default=False,
                       help="regenerate database")
+    parser.add_option("-l", "--cache-lookups",
+                      action="store_true", dest="cache_lookups", default=False,
+                      help="cache lookup keys in memory for the whole run")
     parser.add_option("-v", "--verbose",
                       action="store_true", dest="verbose", default=False,
                       help="print verbose status messages to stdout")
@@ -53,10 +53,18 @@ class FileType(mutagen._util.DictMixin):
     Attributes:
     info -- stream information (length, bitrate, sample rate)
     tags -- metadata tags, if any
+    picture_offsets -- (offset, length) in the file of the data of each
+                       embedded picture found, for types that support
+                       scan mode
 
     Each file format has different potential tags and stream
     information.
 
+    Types with supports_scan set can be loaded with scan=True, which
+    reads tags and stream information but skips over the data of
+    embedded pictures rather than reading it (their offsets are still
+    recorded). A file loaded in scan mode can't be saved.
+
     FileTypes implement an interface very similar to Metadata; the
     dict interface, save, load, and delete calls on a FileType call
     the appropriate methods on its tag data.
@@ -65,6 +73,8 @@ class FileType(mutagen._util.DictMixin):
     info = None
     tags = None
     filename = None
+    picture_offsets = ()
+    supports_scan = False
     _mimes = ["application/octet-stream"]
 
     def __init__(self, filename=None, *args, **kwargs):
@@ -155,13 +165,16 @@ class FileType(mutagen._util.DictMixin):
 
     mime = property(__get_mime)
 
-def File(filename, options=None, easy=False):
+def File(filename, options=None, easy=False, scan=False):
     """Guess the type of the file and try to open it.
 
     The file type is decided by several things, such as the first 128
     bytes (which usually contains a file type identifier), the
     filename extension, and the presence of existing tags.
 
+    If scan is true, types that support it are loaded in scan mode
+    (see FileType).
+
     If no appropriate type could be found, None is returned.
     """
 
@@ -213,5 +226,6 @@ def File(filename, options=None, easy=False):
     results = zip(results, options)
     results.sort()
     (score, name), Kind = results[-1]
-    if score > 0: return Kind(filename)
-    else: return None
+    if score <= 0: return None
+    elif scan and Kind.supports_scan: return Kind(filename, scan=True)
+    else: return Kind(filename)
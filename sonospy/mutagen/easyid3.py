@@ -158,13 +158,13 @@ class EasyID3(DictMixin, Metadata):
         cls.RegisterKey(key, getter, setter, deleter)
     RegisterTXXXKey = classmethod(RegisterTXXXKey)
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, **kwargs):
         self.__id3 = ID3()
         self.load = self.__id3.load
         self.save = self.__id3.save
         self.delete = self.__id3.delete
         if filename is not None:
-            self.load(filename)
+            self.load(filename, **kwargs)
 
     filename = property(lambda s: s.__id3.filename,
                         lambda s, fn: setattr(s.__id3, 'filename', fn))
@@ -446,13 +446,19 @@ class Picture(MetadataBlock):
         except (AttributeError, TypeError): return False
 
     def load(self, data):
+        length = self.load_header(data)
+        self.data = data.read(length)
+
+    def load_header(self, data):
+        """Load the picture attributes, leaving data positioned at the
+        start of the picture data. Returns the picture data length."""
         self.type, length = struct.unpack('>2I', data.read(8))
         self.mime = data.read(length).decode('UTF-8', 'replace')
         length, = struct.unpack('>I', data.read(4))
         self.desc = data.read(length).decode('UTF-8', 'replace')
         (self.width, self.height, self.depth,
          self.colors, length) = struct.unpack('>5I', data.read(20))
-        self.data = data.read(length)
+        return length
 
     def write(self):
         f = StringIO()
@@ -507,10 +513,13 @@ class FLAC(FileType):
     tags -- metadata tags, if any
     cuesheet -- CueSheet object, if any
     seektable -- SeekTable object, if any
-    pictures -- list of embedded pictures
+    pictures -- list of embedded pictures (empty in scan mode)
+    picture_offsets -- (offset, length) of the data of each picture
     """
 
     _mimes = ["audio/x-flac", "application/x-flac"]
+    supports_scan = True
+    scanned = False
 
     METADATA_BLOCKS = [StreamInfo, Padding, None, SeekTable, VCFLACDict,
         CueSheet, Picture]
@@ -521,9 +530,16 @@ class FLAC(FileType):
                 filename.lower().endswith(".flac") * 3)
     score = staticmethod(score)
 
-    def __read_metadata_block(self, file):
+    def __read_metadata_block(self, file, scan=False):
         byte = ord(file.read(1))
         size = to_int_be(file.read(3))
+        start = file.tell()
+        if scan and byte & 0x7F == Picture.code:
+            # note where the picture data is and skip it
+            length = Picture().load_header(file)
+            self.picture_offsets.append((file.tell(), length))
+            file.seek(start + size)
+            return (byte >> 7) ^ 1
         try:
             data = file.read(size)
             if len(data) != size:
@@ -545,6 +561,9 @@ class FLAC(FileType):
             elif block.code == SeekTable.code:
                 if self.seektable is None: self.seektable = block
                 else: raise error("> 1 SeekTable block found")
+            elif block.code == Picture.code:
+                self.picture_offsets.append(
+                    (start + size - len(block.data), len(block.data)))
         return (byte >> 7) ^ 1
 
     def add_tags(self):
@@ -570,10 +589,15 @@ class FLAC(FileType):
 
     vc = property(lambda s: s.tags, doc="Alias for tags; don't use this.")
 
-    def load(self, filename):
-        """Load file information from a filename."""
+    def load(self, filename, scan=False):
+        """Load file information from a filename.
+
+        If scan is true, picture blocks are skipped rather than loaded,
+        and only their data offsets recorded."""
 
         self.metadata_blocks = []
+        self.picture_offsets = []
+        self.scanned = scan
         self.tags = None
         self.cuesheet = None
         self.seektable = None
@@ -581,7 +605,7 @@ class FLAC(FileType):
         fileobj = file(filename, "rb")
         try:
             self.__check_header(fileobj)
-            while self.__read_metadata_block(fileobj):
+            while self.__read_metadata_block(fileobj, scan):
                 pass
             if fileobj.read(2) not in ["\xff\xf8", "\xff\xf9"]:
                 raise FLACNoHeaderError("End of metadata did not start audio")
@@ -614,6 +638,8 @@ class FLAC(FileType):
         If no filename is given, the one most recently loaded is used.
         """
 
+        if self.scanned:
+            raise error("%r was loaded in scan mode" % self.filename)
         if filename is None: filename = self.filename
         f = open(filename, 'rb+')
 
@@ -680,11 +706,7 @@ class FLAC(FileType):
             code = byte & 0x7F
             size = to_int_be(fileobj.read(3))
             if code == Picture.code:
-                itype, length = struct.unpack('>2I', fileobj.read(8))
-                mime = fileobj.read(length).decode('UTF-8', 'replace')
-                length, = struct.unpack('>I', fileobj.read(4))
-                desc = fileobj.read(length).decode('UTF-8', 'replace')
-                (width, height, depth, colors, length) = struct.unpack('>5I', fileobj.read(20))
+                length = Picture().load_header(fileobj)
                 offset = fileobj.tell()
                 fileobj.close()
                 return offset, length
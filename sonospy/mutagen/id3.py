@@ -51,6 +51,48 @@ class ID3Warning(error, UserWarning): pass
 def is_valid_frame_id(frame_id):
     return frame_id.isalnum() and frame_id.isupper()
 
+class _FileSlice(object):
+    """A read only view of size bytes of a file from start, that can be
+    sliced like a string. Used to walk frame headers without reading
+    the frame data in between."""
+
+    def __init__(self, fileobj, start, size):
+        self.fileobj = fileobj
+        self.start = start
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self.size)
+        if stop <= start: return ''
+        self.fileobj.seek(self.start + start)
+        return self.fileobj.read(stop - start)
+
+def _picture_data_start(data, v22=False):
+    """Returns the offset of the picture data in APIC (or PIC) frame
+    data, or None if data isn't long enough to contain the header."""
+    if not data: return None
+    encoding = ord(data[0])
+    if v22: pos = 4
+    else:
+        pos = data.find('\x00', 1)
+        if pos == -1: return None
+        pos += 1
+    pos += 1    # picture type
+    if encoding in (1, 2):
+        # UTF-16, terminated by a null on a character boundary
+        end = data.find('\x00\x00', pos)
+        while end != -1 and (end - pos) % 2:
+            end = data.find('\x00\x00', end + 1)
+        size = 2
+    else:
+        end = data.find('\x00', pos)
+        size = 1
+    if end == -1: return None
+    return end + size
+
 class ID3(DictProxy, mutagen.Metadata):
     """A file with an ID3v2 tag.
 
@@ -65,6 +107,7 @@ class ID3(DictProxy, mutagen.Metadata):
 
     filename = None
     size = 0
+    scanned = False
     __flags = 0
     __readbytes = 0
     __crc = None
@@ -88,9 +131,10 @@ class ID3(DictProxy, mutagen.Metadata):
 
     def getpic(self):
         return self.picture, self.pictureoffset, self.picturesize
+    getpicture = getpic
 
 
-    def load(self, filename, known_frames=None, translate=True):
+    def load(self, filename, known_frames=None, translate=True, scan=False):
         """Load tags from a filename.
 
         Keyword arguments:
@@ -99,6 +143,9 @@ class ID3(DictProxy, mutagen.Metadata):
         translate -- Update all tags to ID3v2.4 internally. Mutagen is
                      only capable of writing ID3v2.4 tags, so if you
                      intend to save, this must be true.
+        scan -- Skip APIC frames rather than reading their picture data,
+                just noting where it is (see getpic). The tag can't be
+                saved.
 
         Example of loading a custom frame:
             my_frames = dict(mutagen.id3.Frames)
@@ -117,6 +164,7 @@ class ID3(DictProxy, mutagen.Metadata):
         self.picture = False
         self.pictureoffset = 0
         self.picturesize = 0
+        self.scanned = scan
         try:
             try:
                 self.__load_header()
@@ -142,7 +190,11 @@ class ID3(DictProxy, mutagen.Metadata):
                     if (2,3,0) <= self.version: frames = Frames
                     elif (2,2,0) <= self.version: frames = Frames_2_2
                 self.frameoffset = self.__fileobj.tell()
-                data = self.__fullread(self.size - 10)
+                if (scan and not (self.version < (2,4,0) and self.f_unsynch)
+                    and self.frameoffset + self.size - 10 <= self.__filesize):
+                    data = self.__scanread(self.size - 10, frames)
+                else:
+                    data = self.__fullread(self.size - 10)
                 for frame in self.__read_frames(data, frames=frames):
                     if isinstance(frame, Frame):
                         if frame.FrameID == 'APIC' and not self.picture:
@@ -272,6 +324,46 @@ class ID3(DictProxy, mutagen.Metadata):
             else:
                 self.__extdata = ""
 
+    def __scanread(self, size, frames):
+        """Read size bytes of frames as __fullread does, but seek past
+        APIC/PIC frames, noting where the picture data of the first is.
+        The picture frames are left out of the data returned."""
+        fileobj = self.__fileobj
+        start = fileobj.tell()
+        view = _FileSlice(fileobj, start, size)
+        if (2,3,0) <= self.version:
+            bpi = self.__determine_bpi(view, frames)
+            hsize = 10
+        else:
+            hsize = 6
+        parts = []
+        o = 0
+        while o + hsize <= size:
+            header = view[o:o + hsize]
+            if hsize == 10:
+                name, fsize, flags = unpack('>4sLH', header)
+                fsize = bpi(fsize)
+            else:
+                name, fsize = unpack('>3s3s', header)
+                fsize, = struct.unpack('>L', '\x00' + fsize)
+                flags = 0
+            if name.strip('\x00') == '': break
+            datastart = None
+            # compressed, encrypted etc frames are read whole
+            if name in ('APIC', 'PIC') and not flags:
+                prefix = view[o + hsize:o + hsize + min(fsize, 1024)]
+                datastart = _picture_data_start(prefix, hsize == 6)
+            if datastart is None:
+                parts.append(header + view[o + hsize:o + hsize + fsize])
+            elif not self.picture:
+                self.pictureoffset = start + o + hsize + datastart
+                self.picturesize = fsize - datastart
+                self.picture = True
+            o += hsize + fsize
+        fileobj.seek(start + size)
+        self.__readbytes += size
+        return ''.join(parts)
+
     def __determine_bpi(self, data, frames, EMPTY="\x00" * 10):
         if self.version < (2, 4, 0):
             return int
@@ -385,6 +477,9 @@ class ID3(DictProxy, mutagen.Metadata):
         The lack of a way to update only an ID3v1 tag is intentional.
         """
 
+        if self.scanned:
+            raise error("%r was loaded in scan mode" % self.filename)
+
         # Sort frames by 'importance'
         order = ["TIT2", "TPE1", "TRCK", "TALB", "TPOS", "TDRC", "TCON"]
         order = dict(zip(order, range(len(order))))
@@ -1993,6 +2088,7 @@ class ID3FileType(mutagen.FileType):
     """An unknown type of file with ID3 tags."""
 
     ID3 = ID3
+    supports_scan = True
     
     class _Info(object):
         length = 0
@@ -2025,8 +2121,12 @@ class ID3FileType(mutagen.FileType):
         if ID3 is None:
             ID3 = self.ID3
         self.filename = filename
+        self.picture_offsets = []
         try: self.tags = ID3(filename, **kwargs)
         except error: self.tags = None
+        if self.tags is not None:
+            picture, offset, length = self.tags.getpicture()
+            if picture: self.picture_offsets.append((offset, length))
         if self.tags is not None:
             try: offset = self.tags.size
             except AttributeError: offset = None
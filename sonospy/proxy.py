@@ -30,8 +30,12 @@ import codecs
 import operator
 import datetime
 import glob
+import threading
+import Queue
+from collections import OrderedDict
 
 from transcode import checktranscode, checksmapitranscode, checkstream, setalsadevice
+import transcode
 
 from xml.etree.ElementTree import _ElementInterface
 from xml.etree import cElementTree as ElementTree
@@ -44,6 +48,7 @@ from mediaserver import getFileType
 from mediaserver import getFile
 from mediaserver import fixcolonequals
 from mediaserver import fixMime
+from dbpool import ConnectionPool
 
 from brisa.core import log
 
@@ -52,7 +57,7 @@ from brisa.core import webserver, network
 from brisa.upnp.device import Device
 from brisa.upnp.device.service import Service
 from brisa.upnp.device.service import StateVariable
-from brisa.upnp.soap import HTTPProxy, HTTPRedirect
+from brisa.upnp.soap import HTTPProxy, HTTPRedirect, SOAPProxy
 from brisa.upnp.soap import build_soap_error
 from brisa.core.network import parse_url, get_ip_address, parse_xml
 from brisa.utils.looping_call import LoopingCall
@@ -62,6 +67,11 @@ from dateutil.relativedelta import relativedelta as datedelta
 
 enc = sys.getfilesystemencoding()
 
+# number of players whose last track is remembered for prefetching, and
+# number of prefetch requests that can wait for the prefetch thread
+prefetch_players = 32
+prefetch_requests_max = 8
+
 ################################
 # Proxy for internal mediaserver
 ################################
@@ -130,7 +140,7 @@ class Proxy(object):
             self.index_icons = {}
         else:
             self.index_icons = index_icons
-        log.debug('icons: %s' % self.index_icons)
+        log.debug('icons: %s', self.index_icons)
 
         # get db cache size
         self.db_cache_size = 2000
@@ -147,34 +157,152 @@ class Proxy(object):
         except ConfigParser.NoOptionError:
             pass
 
-        # get connection persistence
-        self.db_persist_connection = False
+        # get number of idle database connections to keep for the webserver threads
+        self.db_pool_size = 4
+        try:
+            db_pool_size_option = self.config.get('database', 'db_pool_size')
+            try:
+                self.db_pool_size = int(db_pool_size_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # get db memory map size (bytes, 0 to not memory map the database)
+        self.db_mmap_size = 0
+        try:
+            db_mmap_size_option = self.config.get('database', 'db_mmap_size')
+            try:
+                self.db_mmap_size = int(db_mmap_size_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # get number of track/cover file entries to hold for the webserver
+        self.resource_cache_entries = 10000
+        try:
+            resource_cache_entries_option = self.config.get('INI', 'resource_cache_entries')
+            try:
+                self.resource_cache_entries = int(resource_cache_entries_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+
+        # get embedded cover art cache sizes (in MB) and location
+        cover_cache_size = 20
+        try:
+            cover_cache_size_option = self.config.get('INI', 'cover_cache_size')
+            try:
+                cover_cache_size = int(cover_cache_size_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        cover_cache_disk_size = 100
+        try:
+            cover_cache_disk_size_option = self.config.get('INI', 'cover_cache_disk_size')
+            try:
+                cover_cache_disk_size = int(cover_cache_disk_size_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        cover_cache_dir = os.path.join(os.getcwd(), 'covercache')
+        try:
+            cover_cache_dir = self.config.get('INI', 'cover_cache_dir')
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        webserver.cover_cache.configure(cover_cache_size * 1024 * 1024, cover_cache_disk_size * 1024 * 1024, cover_cache_dir)
+
+        # get transcode output cache size (in MB) and location
+        transcode_cache_size = 1000
         try:
-            db_persist_connection_option = self.config.get('database', 'db_persist_connection')
-            if db_persist_connection_option:
-                if db_persist_connection_option.lower() == 'y':
-                    self.db_persist_connection = True
+            transcode_cache_size_option = self.config.get('INI', 'transcode_cache_size')
+            try:
+                transcode_cache_size = int(transcode_cache_size_option)
+            except ValueError:
+                pass
         except ConfigParser.NoSectionError:
             pass
         except ConfigParser.NoOptionError:
             pass
+        transcode_cache_dir = os.path.join(os.getcwd(), 'transcodecache')
+        try:
+            transcode_cache_dir = self.config.get('INI', 'transcode_cache_dir')
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        transcode.transcode_cache.configure(transcode_cache_dir, transcode_cache_size * 1024 * 1024)
+
+        # get maximum concurrent transcodes and how long to queue for one
+        max_transcodes = 4
+        try:
+            max_transcodes_option = self.config.get('INI', 'max_transcodes')
+            try:
+                max_transcodes = int(max_transcodes_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        transcode_queue_timeout = 30
+        try:
+            transcode_queue_timeout_option = self.config.get('INI', 'transcode_queue_timeout')
+            try:
+                transcode_queue_timeout = int(transcode_queue_timeout_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        transcode.transcode_manager.configure(max_transcodes, transcode_queue_timeout)
+
+        # get number of queued tracks to transcode ahead of the player
+        self.prefetch_transcodes = 0
+        try:
+            prefetch_transcodes_option = self.config.get('INI', 'prefetch_transcodes')
+            try:
+                self.prefetch_transcodes = int(prefetch_transcodes_option)
+            except ValueError:
+                pass
+        except ConfigParser.NoSectionError:
+            pass
+        except ConfigParser.NoOptionError:
+            pass
+        self.prefetch_last = OrderedDict()
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_requests = Queue.Queue(prefetch_requests_max)
+        self.prefetch_thread = None
 
         # check database
+        self.db_pool = None
         error = None
         if self.dbspec != None:
             if not os.access(self.dbspec, os.R_OK):
                 error = "Unable to access database file"
             else:
                 try:
-                    if self.db_persist_connection:
-                        db = sqlite3.connect(self.dbspec, check_same_thread = False)
-                    else:
-                        db = sqlite3.connect(self.dbspec)
+                    self.db_pool = ConnectionPool(self.dbspec, self.db_pool_size, self.db_cache_size, self.db_mmap_size)
+                    db = self.db_pool.connect()
                     cs = db.execute("PRAGMA cache_size;")
-                    log.debug('cache_size before: %s', cs.fetchone()[0])
-                    db.execute("PRAGMA cache_size = %s;" % self.db_cache_size)
-                    cs = db.execute("PRAGMA cache_size;")
-                    log.debug('cache_size after: %s', cs.fetchone()[0])
+                    log.debug('cache_size: %s', cs.fetchone()[0])
                     cs.close()
                     c = db.cursor()
                 except sqlite3.Error, e:
@@ -190,12 +318,8 @@ class Proxy(object):
         if error:
             raise ValueError(error)
         if self.dbspec != None:
-            if self.db_persist_connection:
-                self.db = db
-            else:
-                self.db = None
-                db.close()
-            log.debug(self.db)
+            c.close()
+            db.close()
         if os.name != 'nt':
             setalsadevice()
 
@@ -274,7 +398,7 @@ class Proxy(object):
     def _serve_pm_file(self):
         # serve presentation map XML from Proxy
         pm_xml_path = os.path.join(os.getcwd(), self.presentation_map_file)
-        log.debug("pm file: %s" % pm_xml_path)
+        log.debug("pm file: %s", pm_xml_path)
         pmstaticfile = webserver.StaticFile(self.presentation_map_file, pm_xml_path)
         self.root_device.webserver.add_static_file(pmstaticfile)
 
@@ -284,10 +408,10 @@ class Proxy(object):
             image_list = glob.glob(image_root)
             for image_spec in image_list:
                 image_path, image_name = os.path.split(image_spec)
-                log.debug("image file: %s" % image_spec)
+                log.debug("image file: %s", image_spec)
                 staticfile = webserver.StaticFile(image_name, image_spec)
                 self.wmpwebserver.add_static_file(staticfile)
-        log.debug('icons: %s' % self.index_icons)
+        log.debug('icons: %s', self.index_icons)
 
     def _load(self):
         self._add_root_device()
@@ -326,7 +450,7 @@ class Proxy(object):
     def get_Track(self, objectname):
         # get track details from passed objectname
         # and create a staticfile for the track and albumart (if that exists)
-        log.debug("proxy.get_Track objectname: %s" % objectname)
+        log.debug("proxy.get_Track objectname: %s", objectname)
         # object name is either:
         #   db + id + type_extension e.g. database.sqlite.6000022.flac (also could be database.sqlite.6000022.jpg)
         # or
@@ -337,6 +461,7 @@ class Proxy(object):
         objectfacets = objectname.split('.')
         lenfacets = len(objectfacets)
         # find id
+        idpos = None
         for i in range(lenfacets-1,-1,-1):
             if len(objectfacets[i]) == 32:
                 try:
@@ -346,6 +471,10 @@ class Proxy(object):
                     break
                 except ValueError:
                     pass
+        if idpos == None:
+            # no track id - may be a cover
+            self.get_Cover(objectname)
+            return
         objectID = objectfacets[idpos]
 #        # check whether we have a transcode
 #        transcode = False
@@ -354,18 +483,14 @@ class Proxy(object):
         # get dbname
         dbfacets = objectname.split('.' + objectID + '.')
         dbname = dbfacets[0]
-        log.debug("proxy.get_Track objectID: %s" % objectID)
-        log.debug("proxy.get_Track dbname: %s" % dbname)
+        log.debug("proxy.get_Track objectID: %s", objectID)
+        log.debug("proxy.get_Track dbname: %s", dbname)
         # try and open the database in the same folder as the proxy database
         # if it is the proxy database, that will work
         # if it isn't, then it will only work if the database specified is where the proxy database is
         # TODO: work out whether we want to store the database path somewhere
         try:
-            if self.db_persist_connection:
-                db = self.db
-            else:
-                db = sqlite3.connect(os.path.join(self.dbpath, dbname))
-            log.debug(self.db)
+            db = self.connect_db(dbname)
             c = db.cursor()
         except sqlite3.Error, e:
             log.debug("error opening database: %s %s %s", self.dbpath, dbname, e.args[0])
@@ -379,7 +504,7 @@ class Proxy(object):
         log.debug("id: %s", id)
         mime = fixMime(mime)
         cover, artid = self.cdservice.mediaServer.choosecover(folderart, trackart, folderartid, trackartid)
-        log.debug("cover: %s, artid: %s" % (cover, artid))
+        log.debug("cover: %s, artid: %s", cover, artid)
 
         wsfile = filename
         wspath = os.path.join(path, filename)
@@ -396,14 +521,160 @@ class Proxy(object):
         log.debug("newtype: %s", newtype)
 
         if transcode:
-            log.debug('\nobjectname: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s' % (objectname, wsfile, wspath, contenttype, newtype))
+            log.debug('\nobjectname: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s\ntranscodetype: %s', objectname, wsfile, wspath, contenttype, newtype)
             dummystaticfile = webserver.TranscodedFileSonos(objectname, wsfile, wspath, newtype, contenttype, cover=cover)
             self.wmpcontroller.add_transcoded_file(dummystaticfile)
         else:
-            log.debug('\nobjectname: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s' % (objectname, wsfile, wspath, contenttype))
+            log.debug('\nobjectname: %s\nwsfile: %s\nwspath: %s\ncontenttype: %s', objectname, wsfile, wspath, contenttype)
             dummystaticfile = webserver.StaticFileSonos(objectname, wsfile, wspath, contenttype, cover=cover)
             self.wmpcontroller.add_static_file(dummystaticfile)
 
+        self.add_Cover(dbname, cover, artid)
+
+        c.close()
+        db.close()
+
+    def check_prefetch(self, environ):
+        # called for each track request - if this is the start of a track
+        # (not a seek or a retry), look for queued tracks to transcode ahead
+        objectname = environ.get('PATH_INFO', '').split('/')[-1]
+        address = environ.get('REMOTE_ADDR', '')
+        if not objectname or not address:
+            return
+        trackrange = environ.get('HTTP_RANGE', '')
+        if trackrange and not trackrange.replace(' ', '').startswith('bytes=0-'):
+            return
+        self.prefetch_lock.acquire()
+        try:
+            if self.prefetch_last.get(address, None) == objectname:
+                return
+            # only remember the players seen most recently
+            self.prefetch_last.pop(address, None)
+            self.prefetch_last[address] = objectname
+            while len(self.prefetch_last) > prefetch_players:
+                self.prefetch_last.popitem(last=False)
+            if self.prefetch_thread is None:
+                self.prefetch_thread = threading.Thread(target=self.run_prefetches,
+                                                        name='TranscodePrefetch')
+                self.prefetch_thread.setDaemon(True)
+                self.prefetch_thread.start()
+        finally:
+            self.prefetch_lock.release()
+        try:
+            self.prefetch_requests.put_nowait((address, objectname))
+        except Queue.Full:
+            log.debug("proxy.check_prefetch too many prefetches waiting, skipped: %s", objectname)
+
+    def run_prefetches(self):
+        # prefetches can read several whole transcodes, so they run one at
+        # a time on their own thread rather than holding a worker of the
+        # shared async call pool
+        while True:
+            address, objectname = self.prefetch_requests.get()
+            try:
+                self.prefetch_queue(address, objectname)
+            except Exception, e:
+                log.error("proxy.prefetch_queue failed: %s", e)
+
+    def prefetch_queue(self, address, objectname):
+        # the player at address has started objectname - if that needs
+        # transcoding, transcode the tracks queued after it into the
+        # transcode cache so they start without waiting for the encoder
+        trackfile = self.wmpcontroller.get_file(objectname)
+        if trackfile is None:
+            self.get_Track(objectname)
+            trackfile = self.wmpcontroller.get_file(objectname)
+        if not isinstance(trackfile, webserver.TranscodedFileSonos) or trackfile.stream:
+            return
+        try:
+            avt = SOAPProxy('http://%s:1400/MediaRenderer/AVTransport/Control' % address,
+                            ('u', 'urn:schemas-upnp-org:service:AVTransport:1'))
+            position = avt.call_remote('GetPositionInfo', InstanceID=0)
+            track = int(position['Track'])
+            # the player can request the next track before its position moves on,
+            # so browse from the current track and look for objectname
+            cd = SOAPProxy('http://%s:1400/MediaServer/ContentDirectory/Control' % address,
+                           ('u', 'urn:schemas-upnp-org:service:ContentDirectory:1'))
+            queue = cd.call_remote('Browse', ObjectID='Q:0', BrowseFlag='BrowseDirectChildren',
+                                   Filter='res', StartingIndex=max(track - 1, 0),
+                                   RequestedCount=self.prefetch_transcodes + 2, SortCriteria='')
+            result = queue['Result']
+            if isinstance(result, unicode):
+                result = result.encode('utf-8')
+            didl = ElementTree.fromstring(result)
+        except Exception, e:
+            log.debug("proxy.prefetch_queue queue lookup failed: %s", e)
+            return
+        queuenames = []
+        for res in didl.getiterator('{urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/}res'):
+            url = res.text or ''
+            if '/WMPNSSv3/' in url:
+                queuenames.append(url.split('?')[0].split('/')[-1])
+            else:
+                # not one of ours
+                queuenames.append(None)
+        if objectname not in queuenames:
+            return
+        nextpos = queuenames.index(objectname) + 1
+        for name in queuenames[nextpos:nextpos + self.prefetch_transcodes]:
+            if not name:
+                continue
+            nextfile = self.wmpcontroller.get_file(name)
+            if nextfile is None:
+                try:
+                    self.get_Track(name)
+                except Exception, e:
+                    log.debug("proxy.prefetch_queue get_Track failed: %s", e)
+                    continue
+                nextfile = self.wmpcontroller.get_file(name)
+            if isinstance(nextfile, webserver.TranscodedFileSonos) and not nextfile.stream:
+                transcode.prefetch(nextfile.path, nextfile.transcodetype)
+
+    def get_Cover(self, objectname):
+        # get cover details from passed objectname
+        # and create a staticfile for the cover
+        log.debug("proxy.get_Cover objectname: %s", objectname)
+        # object name is db + artid + type_extension e.g. database.sqlite.27.jpg
+        # (type_extension is coverart for embedded art)
+        objectfacets = objectname.split('.')
+        if len(objectfacets) < 3 or not objectfacets[-2].isdigit():
+            log.debug("proxy.get_Cover not a cover: %s", objectname)
+            return
+        artid = objectfacets[-2]
+        dbname = '.'.join(objectfacets[:-2])
+        try:
+            db = self.connect_db(dbname)
+            c = db.cursor()
+        except sqlite3.Error, e:
+            log.debug("error opening database: %s %s %s", self.dbpath, dbname, e.args[0])
+            return
+
+        statement = "select folderart, trackart, folderartid, trackartid from tracks where folderartid = ? or trackartid = ? limit 1"
+        log.debug("statement: %s", statement)
+        c.execute(statement, (artid, artid))
+        row = c.fetchone()
+        if row:
+            folderart, trackart, folderartid, trackartid = row
+            if str(folderartid) == artid:
+                cover = folderart
+            else:
+                cover = trackart
+            log.debug("cover: %s, artid: %s", cover, artid)
+            self.add_Cover(dbname, cover, artid)
+
+        c.close()
+        db.close()
+
+    def connect_db(self, dbname):
+        # use a pooled connection if dbname is the proxy database
+        dbspec = os.path.join(self.dbpath, dbname)
+        if self.db_pool != None and os.path.abspath(dbspec) == os.path.abspath(self.dbspec):
+            return self.db_pool.connect()
+        else:
+            return sqlite3.connect(dbspec)
+
+    def add_Cover(self, dbname, cover, artid):
+        # create a staticfile for the cover (if there is one)
         if cover.startswith('EMBEDDED_'):
             # art is embedded for this file
             coverparts = cover.split('_')
@@ -425,14 +696,15 @@ class Proxy(object):
             dummycoverstaticfile = webserver.StaticFileSonos(dummycoverfile, cvfile, cvpath)    # TODO: pass contenttype
             self.wmpcontroller2.add_static_file(dummycoverstaticfile)
 
-        c.close()
-        if not self.db_persist_connection:
-            db.close()
-
 class ProxyServerController(webserver.SonosResource):
 
     def __init__(self, proxy, res):
-        webserver.SonosResource.__init__(self, res, proxy)
+        webserver.SonosResource.__init__(self, res, proxy, max_files=proxy.resource_cache_entries)
+
+    def application(self, environ, start_response):
+        if self.name == 'WMPNSSv3' and self.proxy.prefetch_transcodes > 0:
+            self.proxy.check_prefetch(environ)
+        return webserver.SonosResource.application(self, environ, start_response)
 
 ###############
 ###############
@@ -447,6 +719,15 @@ class Smapi(Service):
 #    service_type = 'urn:schemas-upnp-org:service:smapi:1'
     scpd_xml_path = os.path.join(os.getcwd(), 'smapi-scpd.xml')
 
+    # result templates
+    # (fields are escaped by the caller before being substituted)
+
+    total_template = '<ns0:index>%s</ns0:index><ns0:count>%s</ns0:count><ns0:total>%s</ns0:total>'
+    collection_template = '<ns0:mediaCollection><ns0:id>%s</ns0:id><ns0:title>%s</ns0:title>%s<ns0:itemType>container</ns0:itemType><ns0:canPlay>%i</ns0:canPlay><ns0:canScroll>%i</ns0:canScroll><ns0:canEnumerate>%i</ns0:canEnumerate></ns0:mediaCollection>'
+    albumart_template = '<ns0:albumArtURI>%s</ns0:albumArtURI>'
+    metadata_template = '<ns0:mediaMetadata><ns0:id>%s</ns0:id><ns0:title>%s</ns0:title><ns0:mimeType>%s</ns0:mimeType><ns0:itemType>%s</ns0:itemType>%s</ns0:mediaMetadata>'
+    trackmetadata_template = '<ns0:trackMetadata><ns0:aristId>%s</ns0:aristId><ns0:artist>%s</ns0:artist><ns0:composerId>%s</ns0:composerId><ns0:composer>%s</ns0:composer><ns0:albumId>%s</ns0:albumId><ns0:album>%s</ns0:album><ns0:albumArtURI>%s</ns0:albumArtURI><ns0:albumArtistId>%s</ns0:albumArtistId><ns0:albumArtist>%s</ns0:albumArtist><ns0:genreId>%s</ns0:genreId><ns0:genre>%s</ns0:genre><ns0:duration>%s</ns0:duration></ns0:trackMetadata>'
+
     def __init__(self, proxyaddress, proxy , webserverurl, wmpurl, dbspec, wmpudn, ininame):
 
         self.proxyaddress = proxyaddress
@@ -568,11 +849,11 @@ What do we do if a result is not in alpha order? - spec says it has to be
 
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         collectionID = kwargs['{http://www.sonos.com/Services/1.1}id']
-        log.debug("id: %s" % collectionID)
+        log.debug("id: %s", collectionID)
 
         collectionIDval = None
         try:
@@ -582,7 +863,22 @@ What do we do if a result is not in alpha order? - spec says it has to be
 
         result = ''
         res = ''
-        if collectionIDval:
+
+        # the indices only change when the container update id changes
+        # (which empties the store), so reuse any we have already built
+        self.mediaServer.get_containerupdateid()
+        scrollkey = (controllername, collectionID)
+        self.mediaServer.query_cache_lock.acquire()
+        try:
+            cached = self.mediaServer.scroll_indices.get(scrollkey)
+        finally:
+            self.mediaServer.query_cache_lock.release()
+        if cached != None:
+
+            res = cached
+            log.debug('scroll indices reused')
+
+        elif collectionIDval:
 
             browsetype, browsebyid = self.mediaServer.get_index(collectionIDval)
             log.debug(browsetype)
@@ -648,6 +944,12 @@ What do we do if a result is not in alpha order? - spec says it has to be
                 log.debug(alpha)
                 res = res.upper()
 
+            self.mediaServer.query_cache_lock.acquire()
+            try:
+                self.mediaServer.scroll_indices[scrollkey] = res
+            finally:
+                self.mediaServer.query_cache_lock.release()
+
         result = {'{http://www.sonos.com/Services/1.1}getScrollIndicesResult': '%s' % (res)}
         log.debug("SMAPI_GETSCROLLINDICES ret: %s\n", result)
         return result
@@ -691,7 +993,7 @@ What do we do if a result is not in alpha order? - spec says it has to be
 #        res = '''<ns0:mediaMetadata><ns0:id>Talbumartist__0_0_0__7da3dd8d08cc9d3ac60206449cae886e</ns0:id><ns0:title>Eat for Two</ns0:title><ns0:mimeType>audio/mpeg</ns0:mimeType><ns0:itemType>track</ns0:itemType><ns0:trackMetadata><ns0:aristId></ns0:aristId><ns0:artist>10,000 Maniacs</ns0:artist><ns0:composerId></ns0:composerId><ns0:composer></ns0:composer><ns0:albumId></ns0:albumId><ns0:album>Blind Man's Zoo</ns0:album><ns0:albumArtURI>http://192.168.1.71:10243/wmp/chow.29.jpg</ns0:albumArtURI><ns0:albumArtistId></ns0:albumArtistId><ns0:albumArtist>10,000 Maniacs</ns0:albumArtist><ns0:genreId></ns0:genreId><ns0:genre></ns0:genre><ns0:duration>212</ns0:duration></ns0:trackMetadata></ns0:mediaMetadata><ns0:relatedText><ns0:id>Talbumartist__0_0_0__7da3dd8d08cc9d3ac60206449cae886e</ns0:id><ns0:type>ALBUM_NOTES</ns0:type></ns0:relatedText>'''
 
         id = kwargs['{http://www.sonos.com/Services/1.1}id']
-        log.debug("id: %s" % id)
+        log.debug("id: %s", id)
         if not id.startswith('T'):
             ret = u''
             ret += '<ns0:mediaCollection>'
@@ -786,20 +1088,20 @@ What do we do if a result is not in alpha order? - spec says it has to be
         # extract args and convert to MediaServer ones
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         id = kwargs['{http://www.sonos.com/Services/1.1}id']
-        log.debug("id: %s" % id)
+        log.debug("id: %s", id)
         index = int(kwargs['{http://www.sonos.com/Services/1.1}index'])
-        log.debug("index: %s" % index)
+        log.debug("index: %s", index)
         count = int(kwargs['{http://www.sonos.com/Services/1.1}count'])
-        log.debug("count: %s" % count)
+        log.debug("count: %s", count)
         recursive = kwargs.get('{http://www.sonos.com/Services/1.1}recursive', False)
         if recursive == 'true' or recursive == '1': recursive = True
-        log.debug("recursive: %s" % recursive)
+        log.debug("recursive: %s", recursive)
         term = kwargs.get('{http://www.sonos.com/Services/1.1}term', None)
-        log.debug("term: %s" % term)
+        log.debug("term: %s", term)
 
         try:
             # we don't know query type, call wrapper
@@ -835,11 +1137,11 @@ What do we do if a result is not in alpha order? - spec says it has to be
         # extract args and convert to MediaServer ones
         controllername = kwargs.get('Controller', '')
         controlleraddress = kwargs.get('Address', '')
-        log.debug('Controller: %s' % controllername)
-        log.debug('Address: %s' % controlleraddress)
+        log.debug('Controller: %s', controllername)
+        log.debug('Address: %s', controlleraddress)
 
         queryID = kwargs['{http://www.sonos.com/Services/1.1}id']
-        log.debug("id: %s" % queryID)
+        log.debug("id: %s", queryID)
 
         BrowseFlag = 'BrowseDirectChildren'
         index = 0
@@ -880,7 +1182,7 @@ What do we do if a result is not in alpha order? - spec says it has to be
         log.debug(items)
         log.debug(total)
 
-        ret = ''
+        ret = []
         count = 0
 
         if total <= 0:
@@ -952,25 +1254,18 @@ What do we do if a result is not in alpha order? - spec says it has to be
             count += 1
             if len(item) == 2 or len(item) == 3 or len(item) == 4:
                 # is a container
-                ret += '<ns0:mediaCollection>'
-                ret += '<ns0:id>%s</ns0:id>' % (id)
-                ret += '<ns0:title>%s</ns0:title>' % (title)
+                albumart = ''
                 if albumarturi != None:
-                    ret += '<ns0:albumArtURI>%s</ns0:albumArtURI>' % (albumarturi)
-                ret += '<ns0:itemType>container</ns0:itemType>'
-                ret += '<ns0:canPlay>%i</ns0:canPlay>' % (canplay)
-                ret += '<ns0:canScroll>%i</ns0:canScroll>' % (canscroll)
-                ret += '<ns0:canEnumerate>%i</ns0:canEnumerate>' % (canenumerate)
-                ret += '</ns0:mediaCollection>'
+                    albumart = self.albumart_template % (albumarturi)
+                ret.append(self.collection_template % (id, title, albumart, canplay, canscroll, canenumerate))
             else:
                 # is a track
-                ret += self.make_metadataresult([item], total, index, nototal=True)
+                ret.append(self.make_metadataresult([item], total, index, nototal=True))
 
+        ret = ''.join(ret)
         log.debug(ret)
 
-        pre  = '<ns0:index>%s</ns0:index>' % (index)
-        pre += '<ns0:count>%s</ns0:count>' % (count)
-        pre += '<ns0:total>%s</ns0:total>' % (total)
+        pre = self.total_template % (index, count, total)
 
         res = '%s%s' % (pre, ret)
 
@@ -981,7 +1276,7 @@ What do we do if a result is not in alpha order? - spec says it has to be
 
     def make_metadataresult(self, items, total, index, nototal=False):
 
-        ret = ''
+        ret = []
         count = 0
         for (id, title, mimetype, uri, itemtype, metadatatype, metadata) in items:
 
@@ -991,47 +1286,26 @@ What do we do if a result is not in alpha order? - spec says it has to be
                 meta = self.make_streammetadataresult(metadata)
 
             count += 1
-            ret += '<ns0:mediaMetadata>'
-            ret += '<ns0:id>%s</ns0:id>' % (id)
-            ret += '<ns0:title>%s</ns0:title>' % (title)
-            ret += '<ns0:mimeType>%s</ns0:mimeType>' % (mimetype)
-            ret += '<ns0:itemType>%s</ns0:itemType>' % (itemtype)
-            ret += meta
-            ret += '</ns0:mediaMetadata>'
+            ret.append(self.metadata_template % (id, title, mimetype, itemtype, meta))
 
         if nototal:
             pre = ''
         else:
-            pre  = '<ns0:index>%s</ns0:index>' % (index)
-            pre += '<ns0:count>%s</ns0:count>' % (count)
-            pre += '<ns0:total>%s</ns0:total>' % (total)
+            pre = self.total_template % (index, count, total)
 
-        res = '%s%s' % (pre, ret)
+        res = '%s%s' % (pre, ''.join(ret))
 
         return res
 
     def make_trackmetadataresult(self, metadata):
 
-        ret = ''
-
         aristId, artist, composerId, composer, \
         albumId, album, albumArtURI, albumArtistId, \
         albumArtist, genreId, genre, duration = metadata
 
-        ret += '<ns0:trackMetadata>'
-        ret += '<ns0:aristId>%s</ns0:aristId>' % (aristId)
-        ret += '<ns0:artist>%s</ns0:artist>' % (artist)
-        ret += '<ns0:composerId>%s</ns0:composerId>' % (composerId)
-        ret += '<ns0:composer>%s</ns0:composer>' % (composer)
-        ret += '<ns0:albumId>%s</ns0:albumId>' % (albumId)
-        ret += '<ns0:album>%s</ns0:album>' % (album)
-        ret += '<ns0:albumArtURI>%s</ns0:albumArtURI>' % (albumArtURI)
-        ret += '<ns0:albumArtistId>%s</ns0:albumArtistId>' % (albumArtistId)
-        ret += '<ns0:albumArtist>%s</ns0:albumArtist>' % (albumArtist)
-        ret += '<ns0:genreId>%s</ns0:genreId>' % (genreId)
-        ret += '<ns0:genre>%s</ns0:genre>' % (genre)
-        ret += '<ns0:duration>%s</ns0:duration>' % (duration)
-        ret += '</ns0:trackMetadata>'
+        ret = self.trackmetadata_template % (aristId, artist, composerId, composer, \
+                                             albumId, album, albumArtURI, albumArtistId, \
+                                             albumArtist, genreId, genre, duration)
 
         # fix WMP urls if necessary
         ret = ret.replace(self.webserverurl, self.wmpurl)
@@ -1102,7 +1376,7 @@ class ContentDirectory(Service):
         if updated == True:
             self.systemupdateid += 1
             self._state_variables['SystemUpdateID'].update(self.systemupdateid)
-            log.debug("SystemUpdateID value: %s" % self._state_variables['SystemUpdateID'].get_value())
+            log.debug("SystemUpdateID value: %s", self._state_variables['SystemUpdateID'].get_value())
 
     def set_containerupdateid(self):
 
@@ -1111,7 +1385,7 @@ class ContentDirectory(Service):
         if updated == True:
             self.systemupdateid += 1
             self._state_variables['SystemUpdateID'].update(systemupdateid)
-            log.debug("SystemUpdateID value: %s" % self._state_variables['SystemUpdateID'].get_value())
+            log.debug("SystemUpdateID value: %s", self._state_variables['SystemUpdateID'].get_value())
 
     def load_user_index_flag(self):
 
@@ -1137,7 +1411,7 @@ class ContentDirectory(Service):
         log.debug("PROXY_RELOADINI: %s", kwargs)
 
         invalidate = kwargs.get('Invalidate', '')
-        log.debug('Invalidate: %s' % invalidate)
+        log.debug('Invalidate: %s', invalidate)
 
         import ConfigParser
         import StringIO
@@ -1169,7 +1443,7 @@ class ContentDirectory(Service):
         log.debug("PROXY_INVALIDATECD: %s", kwargs)
 
         invalidate = kwargs.get('Invalidate', '')
-        log.debug('Invalidate: %s' % invalidate)
+        log.debug('Invalidate: %s', invalidate)
 
         self.mediaServer.set_containerupdateid()
 
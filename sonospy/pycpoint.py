@@ -42,7 +42,8 @@ import StringIO
 import codecs
 import urllib
 
-from data import ListDataController, GetDataController, PlayController, GetDeviceController, SetRendererController, PollRendererController, ActionRendererController, PollServerController, PollQueueController
+from browsestore import BrowseStore
+from data import ListDataController, GetDataController, PlayController, GetDeviceController, SetRendererController, PollRendererController, ActionRendererController, PollServerController, PollQueueController, LongPollController, ChangeNotifier
 
 #import log
 from brisa.core import log
@@ -743,6 +744,10 @@ Music/Rating                101     object.container
         # webserver resources to serve data
         #######################################################################
 
+        # signalled when renderer, queue or browse data changes, for the
+        # long-poll versions of the data resources
+        self.data_changed = ChangeNotifier()
+
         if not self.options.proxyonly:
 
             self.data_delim = '_|_'
@@ -769,12 +774,36 @@ Music/Rating                101     object.container
 
             self.rootmenus = []
             
-            self.gdatasets = {}
-            self.gdatakeys = {}
-            self.gdataparentkey = {}
-            self.gdatatracks = {}
-            self.gdata_lastindex = {}
-            self.gdataparent = {}
+            # browsed entries and result sets, bounded as pycpoint can be
+            # left running for a long time
+            browse_store_entries = 10000
+            try:
+                browse_store_entries = int(self.config.get('INI', 'browse_store_entries'))
+            except ConfigParser.NoSectionError:
+                pass
+            except ConfigParser.NoOptionError:
+                pass
+            except ValueError:
+                pass
+            browse_store_sets = 100
+            try:
+                browse_store_sets = int(self.config.get('INI', 'browse_store_sets'))
+            except ConfigParser.NoSectionError:
+                pass
+            except ConfigParser.NoOptionError:
+                pass
+            except ValueError:
+                pass
+            browse_store_age = 3600
+            try:
+                browse_store_age = int(self.config.get('INI', 'browse_store_age'))
+            except ConfigParser.NoSectionError:
+                pass
+            except ConfigParser.NoOptionError:
+                pass
+            except ValueError:
+                pass
+            self.browse_store = BrowseStore(browse_store_entries, browse_store_sets, browse_store_age)
 
             self.queue_entry = None
             
@@ -788,6 +817,35 @@ Music/Rating                101     object.container
             rootmenucontroller = GetDataController(self.rootmenus, 'rootMenus', self.getrootmenus)
             getdatacontroller = GetDataController(None, 'getData', self.getdata)
             playcontroller = PlayController('playData', self.playdata)
+            browsestatscontroller = GetDataController(None, 'browseStats', self.getbrowsestats)
+
+            # long-poll versions of the polls - these take the same query but
+            # wait for a change rather than returning NOCHANGE/NOTREADY
+            long_poll_timeout = 25
+            try:
+                long_poll_timeout = int(self.config.get('INI', 'long_poll_timeout'))
+            except ConfigParser.NoSectionError:
+                pass
+            except ConfigParser.NoOptionError:
+                pass
+            except ValueError:
+                pass
+            long_poll_waiters = 4
+            try:
+                long_poll_waiters = int(self.config.get('INI', 'long_poll_waiters'))
+            except ConfigParser.NoSectionError:
+                pass
+            except ConfigParser.NoOptionError:
+                pass
+            except ValueError:
+                pass
+            nochange = ['NOCHANGE::0' + self.data_delim]
+            notready = ['NOTREADY' + self.data_delim]
+            busy = ['BUSY' + self.data_delim]
+            waitrenderercontroller = LongPollController(self.rendererdata, 'rendererWait', self.pollrenderer, self.data_changed, nochange, long_poll_timeout, long_poll_waiters, self.renderer_poll_interval, busy=busy)
+            waitservercontroller = LongPollController(self.servermetadata, 'serverWait', self.pollserver, self.data_changed, nochange, long_poll_timeout, long_poll_waiters, busy=busy)
+            waitqueuecontroller = LongPollController(self.queuedata, 'queueWait', self.pollqueue, self.data_changed, nochange, long_poll_timeout, long_poll_waiters, busy=busy)
+            waitdatacontroller = LongPollController(None, 'getDataWait', self.getdata, self.data_changed, notready, long_poll_timeout, long_poll_waiters, busy=busy)
 
             ws = self.control_point._event_listener.srv
             res = webserver.CustomResource('data')
@@ -801,6 +859,11 @@ Music/Rating                101     object.container
             res.add_resource(rootmenucontroller)
             res.add_resource(getdatacontroller)
             res.add_resource(playcontroller)
+            res.add_resource(browsestatscontroller)
+            res.add_resource(waitrenderercontroller)
+            res.add_resource(waitservercontroller)
+            res.add_resource(waitqueuecontroller)
+            res.add_resource(waitdatacontroller)
             ws.add_resource(res)
 
             # start MSEARCH for controlpoint
@@ -854,6 +917,14 @@ Music/Rating                101     object.container
         self.devicedata.remove(entry + self.data_delim)
         del self.devicedatakeys[entry]
 
+    def getbrowsestats(self, param):
+        # report the size of the browse store, for sizing it in the ini
+        stats = self.browse_store.stats()
+        statsdata = []
+        for k in ['entries', 'parents', 'sets', 'indices', 'entry_bytes', 'set_bytes', 'evicted']:
+            statsdata.append(k.upper() + '::' + str(stats[k]) + self.data_delim)
+        return statsdata
+
     def getrootmenus(self, param):
         query = param.split('=')
         entry = query[1]
@@ -883,7 +954,7 @@ Music/Rating                101     object.container
         del self.rootdata[:]
         self.rootdatakeys.clear()
         self.rootdata_lastindex = 0
-        self.gdatasets.clear()
+        self.browse_store.clear()
         self.set_server_device(device)
         # sort the root data
         self.rootdata = sorted(self.rootdata, key=self.gettitle)
@@ -1006,7 +1077,7 @@ Music/Rating                101     object.container
 
         setparent = entryref
         if first_call == True:
-            self.gdata_lastindex[setparent] = 0
+            self.browse_store.reset_index(setparent)
 
         # remove data from end of entry
         colpos = entry.rfind('::')
@@ -1071,20 +1142,23 @@ Music/Rating                101     object.container
         # get set key
         setkey = entryref + ':' + str(dataseq)
 
+        gdata = self.browse_store.lookup(entrykey)
         if entrykey in self.rootdatakeys:
             id, type = self.rootdatakeys[entrykey]
         elif entrykey in self.queuedatakeys:
             id, type = self.queuedatakeys[entrykey]
-        elif entrykey in self.gdatakeys:
-            id, type = self.gdatakeys[entrykey]
+        elif gdata != None:
+            id, type = gdata
         else:
             # check for special case (after checking in key stores in case they have more up to date info)
             if id_passed == True:
                 id = s_id
                 type = s_type
             else:
-                print "entry '" + str(entrykey) + "' not found in rootdata/queuedata/gdata."
-                return []
+                # entry has been dropped from the browse store - the UI
+                # needs to browse to it again
+                log.info("entry '%s' not found in rootdata/queuedata/gdata", entrykey)
+                return ['NOTFOUND::' + entrykey + self.data_delim]
         
         # save queue entry if queue
         if id == 'Q:0' and first_call == True:
@@ -1101,30 +1175,33 @@ Music/Rating                101     object.container
         print "setkey: " + str(setkey)
         print "first_call: " + str(first_call)
         print "dataseq: " + str(dataseq)
-        if setkey in self.gdatasets:
-            print "len: " + str(len(self.gdatasets[setkey]))
+        dataset = self.browse_store.get_set(setkey)
+        if dataset != None:
+            print "len: " + str(len(dataset))
         
         if first_call == True:
             # first time through, process the browse
             self.process_browse(type, id, searchstring=searchstring, searchoperator=searchoperator, name=rootname, sequence=dataseq, count=datacount, setkey=setkey, entryname=entryname)
-            return self.gdatasets[setkey]
+            dataset = self.browse_store.get_set(setkey)
+            if dataset != None:
+                return dataset
         else:
             # not first time, check if the data is ready from the first browse initiated async calls
-            if setkey in self.gdatasets:
+            if dataset != None:
                 if dataseq == 1:
                     # special case where initial browse has already been done - don't know count so just return what we have
-                    return self.gdatasets[setkey]
-                setsize = len(self.gdatasets[setkey])
+                    return dataset
+                setsize = len(dataset)
                 if setsize == datacount + 1:    # +1 to cater for the result entry
                     # data for this set is complete, return it
-                    return self.gdatasets[setkey]
+                    return dataset
                 elif setsize == datacount + 2:    # +1 to cater for the result entry, plus Napster index starts at zero and affects the last set in a multiple return
                     # TODO: make this Napster specific
                     # data for this set is complete, return it
-                    return self.gdatasets[setkey]
-            # not ready, return wait with count so far
-            dataset = ['NOTREADY' + self.data_delim]
-            return dataset
+                    return dataset
+        # not ready, return wait with count so far
+        dataset = ['NOTREADY' + self.data_delim]
+        return dataset
 
     def browse_queue(self, param):
 
@@ -1176,14 +1253,15 @@ Music/Rating                101     object.container
         setkey = entryref + ':' + str(dataseq)
         setparent = entryref
 
+        gdata = self.browse_store.lookup(entrykey)
         if entrykey in self.rootdatakeys:
             id, type = self.rootdatakeys[entrykey]
         elif entrykey in self.queuedatakeys:
             id, type = self.queuedatakeys[entrykey]
-        elif entrykey in self.gdatakeys:
-            id, type = self.gdatakeys[entrykey]
+        elif gdata != None:
+            id, type = gdata
         else:
-            print "entry '" + str(entrykey) + "' not found in rootdata/queuedata/gdata."
+            log.info("entry '%s' not found in rootdata/queuedata/gdata", entrykey)
             return
 
         # get name of root entry (only need this for a couple of browses, consider moving it to process_browse)
@@ -1194,7 +1272,7 @@ Music/Rating                101     object.container
             rootname = ''
         
         # process the browse
-        self.gdata_lastindex[setparent] = 0
+        self.browse_store.reset_index(setparent)
         self.process_browse(type, id, searchstring=searchstring, searchoperator=searchoperator, name=rootname, sequence=dataseq, count=datacount, setkey=setkey)
 
     def getentrytitle(self, gdatakeys, ref):
@@ -1225,7 +1303,7 @@ Music/Rating                101     object.container
 
     def update_gdata(self, title, id, type, res=None, xml=None, searchtype=None, searchtitle=None, searchoperators=None, sequence=0, setkey='', parentid=None, extras=None):
         setparent = setkey.split(':')[0]
-        ref = self.gdataparent[setparent] + '_' + str(self.gdata_lastindex[setparent]+1)
+        ref = setparent + '_' + str(self.browse_store.next_index(setparent))
         if res != None:
             entrytype = 'T'
         else:
@@ -1239,11 +1317,7 @@ Music/Rating                101     object.container
         menu = self.get_server_menu_type(id, type)
         new_entry = ref + '::' + entrytype + '::' + menu + '::' + title
 
-        self.gdatakeys[new_entry] = (id, type)
-        if parentid != None:
-            self.gdataparentkey[id] = parentid
-        if res != None:
-            self.gdatatracks[new_entry] = (res, xml)
+        self.browse_store.add(new_entry, id, type, res, xml, parentid)
 
         # append id and type in case receiver is caching
         new_entry += '::' + id + '::' + type
@@ -1257,24 +1331,22 @@ Music/Rating                101     object.container
         # append any extras to end of entry    
         if extras != None:
             new_entry += self.extras_delim + extras
-        self.gdata_lastindex[setparent] += 1
 
         if sequence != 0:
-            self.gdatasets[setkey].append(new_entry + self.data_delim)
+            self.browse_store.add_to_set(setkey, new_entry + self.data_delim)
 
 
     def initialise_gdata_dataset(self, sequence=0, setkey=''):
         if sequence != 0:
-            setparent = setkey.split(':')[0]
-            self.gdatasets[setkey] = []
-            self.gdataparent[setparent] = setparent
+            self.browse_store.new_set(setkey)
 
     def finalise_gdata_dataset(self, sequence=0, returned=0, total=0, setkey=''):
         if sequence != 0:
-            if len(self.gdatasets[setkey]) == 0:
+            if not self.browse_store.get_set(setkey):
                 # nothing was returned, add a dummy entry for display
                 self.update_gdata('Nothing found', 'DUMMY', 'DUMMY', sequence=sequence, setkey=setkey)
-            self.gdatasets[setkey].append("RETURN::" + str(returned) + ':' + str(total) + self.data_delim)
+            self.browse_store.add_to_set(setkey, "RETURN::" + str(returned) + ':' + str(total) + self.data_delim)
+            self.data_changed.changed()
 
     def codeoperators(self, operators):
         # replace symbol operators with symbol=code
@@ -1364,6 +1436,13 @@ Music/Rating                101     object.container
         self.get_renderer_data()
         return self.rendererdata
 
+    def renderer_poll_interval(self):
+        # while playing the position changes without an event, so
+        # long polls on the renderer re-read it every second
+        if self.play_state == 'PLAYING':
+            return 1
+        return None
+
     def actionrenderer(self, param):
         # param will be in utf-8, whereas data is stored in unicode
         param = param.decode('utf-8', 'replace')
@@ -1553,9 +1632,14 @@ Music/Rating                101     object.container
                 type = self.get_root_type(entryref)
 #                if type != 'SONOSPYMEDIASERVER' and type != 'SonospyMediaServer_ROOT':
                 if type != 'SONOSPYMEDIASERVER' and type != 'SonospyMediaServer_ROOT' and type != 'SonospyServerSearch_ROOT':
-                    id, type = self.gdatakeys[entry]
-                if entry in self.gdatatracks.keys():
-                    res, xml = self.gdatatracks[entry]
+                    gdata = self.browse_store.lookup(entry)
+                    if gdata == None:
+                        log.info("play entry '%s' not found in gdata", entry)
+                        return ['NOTFOUND::' + entry + self.data_delim]
+                    id, type = gdata
+                track = self.browse_store.track(entry)
+                if track != None:
+                    res, xml = track
                 else:
                     res = ''
                     xml = ''
@@ -1590,11 +1674,18 @@ Music/Rating                101     object.container
             if type == 'SONOSPYMEDIASERVER' or type == 'SonospyMediaServer_ROOT' or type == 'SonospyServerSearch_ROOT':
                 id = entrysid
             else:
-                id, type = self.gdatakeys[entry]
+                gdata = self.browse_store.lookup(entry)
+                if gdata == None:
+                    # dropped from the browse store - the UI needs to
+                    # browse to it again
+                    log.info("play entry '%s' not found in gdata", entry)
+                    return ['NOTFOUND::' + entry + self.data_delim]
+                id, type = gdata
 #            print "id: " + str(id)
 #            print "type: " + str(type)
-            if entry in self.gdatatracks.keys():
-                res, xml = self.gdatatracks[entry]
+            track = self.browse_store.track(entry)
+            if track != None:
+                res, xml = track
             else:
                 res = ''
                 xml = ''
@@ -3902,7 +3993,7 @@ Music/Rating                101     object.container
                 action = 'BROWSE'
                 sortcriteria = self.msms_search_browse_sortcriteria['DEFAULT']
         else:
-            parentid = self.gdataparentkey[id]
+            parentid = self.browse_store.parent(id)
             if parentid in self.msms_search_lookup_item.keys():
                 searchitem = self.msms_search_lookup_item[parentid]
             else:
@@ -3986,7 +4077,7 @@ Music/Rating                101     object.container
                 action = 'BROWSE'
                 sortcriteria = self.msms_search_browse_sortcriteria['DEFAULT']
         else:
-            parentid = self.gdataparentkey[id]
+            parentid = self.browse_store.parent(id)
             if parentid in self.msms_search_lookup_item.keys():
                 searchitem = self.msms_search_lookup_item[parentid]
             else:
@@ -4108,9 +4199,6 @@ Music/Rating                101     object.container
         else:
             sort = ''
 
-        # initialise ref
-        self.gdataparent[entryref] = entryref
-
         search = False
         if root != None:
             # root items - need to add search option
@@ -4272,7 +4360,7 @@ Music/Rating                101     object.container
         # TODO: fix this properly
         title = title.replace('\n',' ')
         
-        ref = self.gdataparent[setparent] + '_' + str(self.gdata_lastindex[setparent]+1)
+        ref = setparent + '_' + str(self.browse_store.next_index(setparent))
         
         if res != None:
             entrytype = 'T'
@@ -4300,7 +4388,6 @@ Music/Rating                101     object.container
         # append any extras to end of entry    
         if extras != None:
             new_entry += self.extras_delim + extras
-        self.gdata_lastindex[setparent] += 1
 
         return new_entry + self.data_delim
 
@@ -5705,6 +5792,7 @@ Music/Rating                101     object.container
         if 'LastChange' in changed_vars and changed_vars['LastChange'] != None:
             if self.control_point.get_rc_service().event_sid == sid:    
                 self.process_device_event_seq(sid, seq, changed_vars)
+                self.data_changed.changed()
                 return
     
         seq = int(seq)
@@ -5739,6 +5827,7 @@ Music/Rating                101     object.container
                 (sid, seq, changed_vars) = self.event_queue.get(False)
 #                print str(datetime.datetime.now()) + " @@@@@@    dequeued"
                 self.process_device_event_seq(sid, seq, changed_vars)
+                self.data_changed.changed()
 #                print str(datetime.datetime.now()) + " @@@@@@    after process"
             except Empty:
                 to_process = False
@@ -5768,6 +5857,7 @@ Music/Rating                101     object.container
                     if self.queue_entry != None:
                         self.browse_queue(self.queue_entry)
                         self.queue_updateid = containerupdate[1]
+                        self.data_changed.changed()
 
 
     def process_device_event_seq(self, sid, seq, changed_vars):
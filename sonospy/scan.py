@@ -57,6 +57,9 @@ def process_command_line(argv):
     parser.add_option("-c", "--ctime",
                       action="store_true", dest="ctime", default=False,
                       help="user ctime rather than mtime to detect file changes")
+    parser.add_option("-n", "--workers", dest="workers", type="int",
+                      help="read tags using WORKERS processes", action="store",
+                      metavar="WORKERS")
     parser.add_option("-q", "--quiet",
                       action="store_true", dest="quiet", default=False,
                       help="don't print status messages to stdout")
@@ -71,6 +74,9 @@ def process_command_line(argv):
                       help="how to process 'the' before artist name (before/after/remove)", 
                       action="store",
                       metavar="THE")
+    parser.add_option("-l", "--cache-lookups",
+                      action="store_true", dest="cache_lookups", default=False,
+                      help="cache lookup keys in memory for the whole run")
                       
     settings, args = parser.parse_args(argv)
     return settings, args
@@ -115,6 +121,8 @@ def main(argv=None):
             cmd += " -r"
         if options.ctime:
             cmd += " -c"
+        if options.workers:
+            cmd += " -n " + str(options.workers)
         if options.quiet:
             cmd += " -q"
         if options.verbose:
@@ -135,6 +143,8 @@ def main(argv=None):
                 cmd = cmdroot + "./movetags.py" + " -s " + options.database  + " -d " + options.database
             if options.the_processing:
                 cmd += " -t " + options.the_processing
+            if options.cache_lookups:
+                cmd += " -l"
             if options.regenerate:
                 cmd += " -r"
             if options.extract:
@@ -1,4 +1,9 @@
 import re
+import string
+import sqlite3
+from collections import defaultdict
+
+import filelog
 
 def truncate_number(number):
     # find integer portion of number passed as string
@@ -33,3 +38,154 @@ def adjust_tracknumber(tracknumber):
                 tracknumber = ''
     return tracknumber
 
+def set_scan_pragmas(db, journal_mode, synchronous, cache_size, temp_store):
+    # set pragmas suited to bulk writes during a scan
+    # (WAL allows the proxy to read the database while a scan is writing it)
+    if journal_mode:
+        db.execute("PRAGMA journal_mode = %s;" % journal_mode)
+    if synchronous:
+        db.execute("PRAGMA synchronous = %s;" % synchronous)
+    if cache_size:
+        db.execute("PRAGMA cache_size = %s;" % cache_size)
+    if temp_store:
+        db.execute("PRAGMA temp_store = %s;" % temp_store)
+
+class BatchWriter(object):
+    '''
+        Accumulates rows to be written to a table and writes them with
+        executemany. Rows are kept per statement and statements are
+        written in the order first seen, so callers must flush a table
+        before reading anything from it that pending rows could affect.
+        When batch_size rows are pending they are written, and committed
+        unless autocommit has been turned off (e.g. while another connection
+        is reading the table, which would block a commit in rollback
+        journal mode).
+        Callers can keep their own index of the rows pending for a table
+        (see index()) so that they only need to flush it when a read
+        really depends on those rows.
+    '''
+
+    def __init__(self, db, batch_size):
+        self.db = db
+        self.batch_size = batch_size
+        self.pending = {}
+        self.statements = []
+        self.count = 0
+        self.autocommit = True
+        self.indexes = {}
+
+    def index(self, table, name):
+        # return a dict for the caller to index the rows pending for
+        # table by, which is emptied whenever they are written
+        return self.indexes.setdefault((table, name), {})
+
+    def add(self, table, statement, row):
+        key = (table, statement)
+        if not key in self.pending:
+            self.pending[key] = []
+            self.statements.append(key)
+        self.pending[key].append(row)
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush(commit=self.autocommit)
+
+    def flush(self, table=None, commit=False):
+        cs = self.db.cursor()
+        for key in self.statements[:]:
+            ptable, statement = key
+            if table and ptable != table: continue
+            rows = self.pending.pop(key)
+            self.statements.remove(key)
+            self.count -= len(rows)
+            self.write_rows(cs, ptable, statement, rows)
+        for (itable, name), index in self.indexes.iteritems():
+            if not table or itable == table:
+                index.clear()
+        cs.close()
+        if commit:
+            self.db.commit()
+
+    def write_rows(self, cs, table, statement, rows):
+        # if a row fails, log it and carry on from the row after it
+        # (executemany pulls the next row only once the previous one
+        # has been written, so done counts the rows written)
+        start = 0
+        while start < len(rows):
+            done = [start]
+            def params():
+                for row in rows[done[0]:]:
+                    yield row
+                    done[0] += 1
+            try:
+                cs.executemany(statement, params())
+                break
+            except sqlite3.Error, e:
+                errorstring = "Error writing %s row: %s : %s" % (table, e.args[0], rows[done[0]])
+                filelog.write_error(errorstring)
+                start = done[0] + 1
+
+# SQLite NOCASE only folds ASCII characters, so keys compared in Python
+# must be folded the same way
+_nocase_unicode = dict((ord(u), ord(l)) for u, l in zip(string.ascii_uppercase, string.ascii_lowercase))
+_nocase_str = string.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def nocase_key(key):
+    nkey = []
+    for k in key:
+        if isinstance(k, unicode):
+            k = k.translate(_nocase_unicode)
+        elif isinstance(k, str):
+            k = k.translate(_nocase_str)
+        nkey.append(k)
+    return tuple(nkey)
+
+class LookupCache(object):
+    '''
+        Remembers keys known to exist in lookup tables, so that the select
+        made before inserting into a lookup table can be skipped for keys
+        already seen in this run. Keys are removed when their rows may have
+        been deleted. Keys can be grouped (e.g. by album_id) where deletes
+        are made by group. Once max_entries keys are held no more are added
+        (max_entries of 0 disables the cache).
+    '''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = 0
+        self.keys = defaultdict(set)
+        self.groups = defaultdict(lambda: defaultdict(set))
+        self.hits = 0
+        self.misses = 0
+
+    def exists(self, cs, table, statement, key, group=None):
+        # check the cache, then the database
+        if nocase_key(key) in self.keys[table]:
+            self.hits += 1
+            return True
+        self.misses += 1
+        cs.execute(statement, key)
+        if cs.fetchone():
+            self.add(table, key, group)
+            return True
+        return False
+
+    def add(self, table, key, group=None):
+        if self.entries >= self.max_entries: return
+        key = nocase_key(key)
+        if key in self.keys[table]: return
+        self.keys[table].add(key)
+        self.entries += 1
+        if group != None:
+            self.groups[table][group].add(key)
+
+    def discard(self, table, key):
+        key = nocase_key(key)
+        if key in self.keys[table]:
+            self.keys[table].remove(key)
+            self.entries -= 1
+
+    def discard_group(self, table, group):
+        for key in self.groups[table].pop(group, ()):
+            if key in self.keys[table]:
+                self.keys[table].remove(key)
+                self.entries -= 1
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+# -*- encoding: utf8 -*-
+#
+# times debug logging that isn't output, as on the request path when
+# pycpoint runs without -d/-m (console logging, module filtered out)
+#
+# run from the sonospy directory:  python testcode/logbench.py
+#
+import os
+import sys
+import timeit
+import logging
+
+sys.path.insert(0, os.getcwd())
+
+# console logging, as pycpoint is normally run
+from brisa.core import config
+config.set_parameter('brisa', 'logging_output', 'console')
+config.set_parameter('brisa', 'logging', 'DEBUG')
+from brisa.core import log
+
+# discard anything that does get through
+for h in log.root_logger.handlers:
+    h.stream = open(os.devnull, 'w')
+
+loops = 100000
+
+headers = dict(('X-Header-%s' % i, 'value %s' % i) for i in range(20))
+data = '<s:Envelope>%s</s:Envelope>' % ('<arg>value</arg>' * 50)
+
+def eager():
+    # message formatted by the caller, filtered after the record is made
+    log.root_logger.debug('#### HTTPTransport call - data : %s' % str(data))
+    log.root_logger.debug('headers: %s' % str(headers))
+
+def deferred():
+    # message formatted only if output
+    log.debug('#### HTTPTransport call - data : %s', data)
+    log.debug('headers: %s', headers)
+
+def guarded():
+    if log.is_enabled():
+        log.debug('headers: %s' % str(headers))
+
+def run(label):
+    for name in ('eager', 'deferred', 'guarded'):
+        t = timeit.Timer('%s()' % name, 'from __main__ import %s' % name)
+        secs = min(t.repeat(3, loops))
+        print '%-32s %-10s %7.2f us/call' % (label, name, secs / loops * 1000000)
+
+print 'filtered: %s' % log.filtered
+run('module filtered out')
+log.root_logger.setLevel(logging.INFO)
+log.modcheck['all'] = True
+run('level above debug')
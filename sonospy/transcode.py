@@ -2,6 +2,10 @@
 import subprocess
 import os
 import codecs
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from brisa.core import log
 
 transcodetable_extension = {'mp2': 'mp3', 'pc': 'wav', 'ac3': 'mp3'}
@@ -106,12 +110,400 @@ def checkstream(filename, filetype):
 
     return stream, newtype
 
+# transcode types that are live (so their output cannot be cached)
+live_transcodetypes = ['pc.wav']
+
+def is_live(transcodetype):
+    # live inputs (line in, radio streams) run for as long as they are
+    # played, so they are neither cached nor counted against max_pipelines
+    return transcodetype in live_transcodetypes or transcodetype.startswith('stream.')
+
+class TranscodeCache(object):
+    """ Size capped directory of transcoded output, keyed on the source path,
+    its mtime and the transcode type. Output is teed into the cache while it
+    is streamed to the first client; once complete it can be served as a
+    static file (with a real length and byte range support).
+    """
+
+    def __init__(self, cachedir=None, max_bytes=0):
+        self.lock = threading.Lock()
+        self.configure(cachedir, max_bytes)
+
+    def configure(self, cachedir, max_bytes):
+        self.lock.acquire()
+        try:
+            self.cachedir = cachedir
+            self.max_bytes = max_bytes
+            self.files = OrderedDict()
+            self.bytes = 0
+            self.filling = set()
+            self.hits = 0
+            self.misses = 0
+            if self.cachedir and self.max_bytes > 0:
+                try:
+                    if not os.path.isdir(self.cachedir):
+                        os.makedirs(self.cachedir)
+                    entries = []
+                    for f in os.listdir(self.cachedir):
+                        fpath = os.path.join(self.cachedir, f)
+                        if f.endswith('.part'):
+                            # left over from an interrupted fill
+                            os.remove(fpath)
+                            continue
+                        st = os.stat(fpath)
+                        entries.append((st.st_mtime, f, st.st_size))
+                    for mtime, f, size in sorted(entries):
+                        self.files[f] = size
+                        self.bytes += size
+                    self.trim()
+                except (IOError, OSError), e:
+                    log.warning('Transcode cache directory %s not usable: %s' % (self.cachedir, e))
+                    self.cachedir = None
+            else:
+                self.cachedir = None
+        finally:
+            self.lock.release()
+
+    def cachename(self, inputfile, mtime, transcodetype):
+        if isinstance(inputfile, unicode):
+            inputfile = inputfile.encode('utf-8')
+        return '%s.%s' % (hashlib.md5('%s|%s|%s' % (inputfile, mtime, transcodetype)).hexdigest(), transcodetype.split('.')[-1])
+
+    def lookup(self, inputfile, mtime, transcodetype, count=True):
+        """ Returns the path of the cached output, or None if it is not cached
+        (count is False for lookups that should not affect the hit/miss counts).
+        """
+        if not self.cachedir or transcodetype in live_transcodetypes:
+            return None
+        name = self.cachename(inputfile, mtime, transcodetype)
+        self.lock.acquire()
+        try:
+            if name in self.files:
+                fpath = os.path.join(self.cachedir, name)
+                if os.path.exists(fpath):
+                    self.files[name] = self.files.pop(name)
+                    if count:
+                        self.hits += 1
+                        log.debug('Transcode cache hit: %s hits, %s misses' % (self.hits, self.misses))
+                    return fpath
+                self.bytes -= self.files.pop(name)
+            if name in self.filling:
+                # being cached
+                return None
+            if count:
+                self.misses += 1
+            return None
+        finally:
+            self.lock.release()
+
+    def tee(self, inputfile, mtime, transcodetype, stream):
+        """ Returns an iterable over stream that also writes it to the cache
+        (or stream itself if it cannot be cached, or is already being cached).
+        """
+        if not self.cachedir or transcodetype in live_transcodetypes:
+            return stream
+        name = self.cachename(inputfile, mtime, transcodetype)
+        self.lock.acquire()
+        try:
+            if name in self.filling:
+                return stream
+            self.filling.add(name)
+        finally:
+            self.lock.release()
+        try:
+            part = open(os.path.join(self.cachedir, name + '.part'), 'wb')
+        except (IOError, OSError), e:
+            log.debug('Transcode cache write failed: %s' % e)
+            self.lock.acquire()
+            self.filling.discard(name)
+            self.lock.release()
+            return stream
+        return TranscodeTee(self, name, stream, part)
+
+    def complete(self, name, part, completed):
+        """ Called by TranscodeTee when its stream ends or is closed. """
+        partpath = os.path.join(self.cachedir, name + '.part')
+        fpath = os.path.join(self.cachedir, name)
+        part.close()
+        self.lock.acquire()
+        try:
+            self.filling.discard(name)
+            if completed:
+                try:
+                    size = os.path.getsize(partpath)
+                    if size == 0:
+                        log.info('Transcode output empty, not cached: %s' % name)
+                        os.remove(partpath)
+                        return
+                    if size > self.max_bytes:
+                        os.remove(partpath)
+                        return
+                    if os.path.exists(fpath):
+                        os.remove(fpath)
+                    os.rename(partpath, fpath)
+                except OSError, e:
+                    log.debug('Transcode cache store failed: %s' % e)
+                    return
+                self.files[name] = size
+                self.bytes += size
+                self.trim()
+                log.debug('Transcode cache stored %s: %s files, %s bytes' % (name, len(self.files), self.bytes))
+            else:
+                # client went away before the end of the stream, or the
+                # transcode failed
+                try:
+                    os.remove(partpath)
+                except OSError:
+                    pass
+        finally:
+            self.lock.release()
+
+    def trim(self):
+        while self.bytes > self.max_bytes and self.files:
+            name, size = self.files.popitem(last=False)
+            self.bytes -= size
+            try:
+                os.remove(os.path.join(self.cachedir, name))
+            except OSError:
+                pass
+
+class TranscodeTee(object):
+    """ Iterable over a transcode stream that writes what it reads to a cache
+    part file, which is stored by the cache if the stream is read to the end
+    and the transcode succeeded.
+    """
+
+    def __init__(self, cache, name, stream, part):
+        self.cache = cache
+        self.name = name
+        self.stream = stream
+        self.part = part
+        self.done = False
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.stream.read(chunk_size)
+                if not chunk:
+                    break
+                self.part.write(chunk)
+                yield chunk
+            self.stream.close()
+            if self.stream.succeeded():
+                self.finish(True)
+            else:
+                log.info('Transcode failed, not cached: %s (exit codes %s)' % (self.name, self.stream.returncodes))
+        finally:
+            self.finish(False)
+
+    def close(self):
+        # called by the WSGI server when the response is finished or abandoned
+        self.finish(False)
+        self.stream.close()
+
+    def finish(self, completed):
+        if not self.done:
+            self.done = True
+            self.cache.complete(self.name, self.part, completed)
+
+transcode_cache = TranscodeCache()
+chunk_size = 2**16
+
+class TranscodeBusy(Exception):
+    """ Raised when no transcode pipeline becomes free within the queue timeout. """
+    pass
+
+class TranscodeManager(object):
+    """ Limits the number of transcode pipelines running at once, queueing
+    requests for a pipeline until one is free, and counts the pipelines
+    killed because their client went away. Live pipelines are counted
+    but not limited, as they hold a pipeline for as long as a zone plays
+    them.
+    """
+
+    def __init__(self, max_pipelines=4, queue_timeout=30):
+        self.condition = threading.Condition()
+        self.active = 0
+        self.live = 0
+        self.queued = 0
+        self.killed = 0
+        self.configure(max_pipelines, queue_timeout)
+
+    def configure(self, max_pipelines, queue_timeout):
+        # max_pipelines of 0 means no limit
+        self.max_pipelines = max_pipelines
+        self.queue_timeout = queue_timeout
+
+    def acquire(self, wait=True, live=False):
+        # returns True once a pipeline slot is held - if wait is False,
+        # returns False rather than queueing when no slot is free
+        self.condition.acquire()
+        try:
+            if live:
+                self.live += 1
+                log.debug('Live transcode started: %s active, %s live, %s queued, %s killed' % self.stats())
+                return True
+            if self.max_pipelines > 0 and self.active >= self.max_pipelines:
+                if not wait:
+                    return False
+                self.queued += 1
+                log.debug('Transcode queued: %s active, %s live, %s queued, %s killed' % self.stats())
+                deadline = time.time() + self.queue_timeout
+                try:
+                    while self.active >= self.max_pipelines:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            log.warning('Transcode refused: %s active, %s live, %s queued, %s killed' % self.stats())
+                            raise TranscodeBusy('%s transcodes already running' % self.active)
+                        self.condition.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.active += 1
+            log.debug('Transcode started: %s active, %s live, %s queued, %s killed' % self.stats())
+            return True
+        finally:
+            self.condition.release()
+
+    def release(self, killed=False, live=False):
+        self.condition.acquire()
+        try:
+            if live:
+                self.live -= 1
+            else:
+                self.active -= 1
+                self.condition.notify()
+            if killed:
+                self.killed += 1
+            log.debug('Transcode ended: %s active, %s live, %s queued, %s killed' % self.stats())
+        finally:
+            self.condition.release()
+
+    def stats(self):
+        return self.active, self.live, self.queued, self.killed
+
+transcode_manager = TranscodeManager()
+
+class TranscodePipeline(object):
+    """ File-like wrapper around the output of a transcode pipeline. When
+    the output has been read to the end, or the pipeline is closed (e.g. the
+    WSGI server closes the response when the client goes away), the
+    processes are killed if still running and reaped, and the pipeline's
+    slot in the transcode manager is released.
+    """
+
+    def __init__(self, procs):
+        self.procs = procs
+        self.stdout = procs[-1].stdout
+        self.closed = False
+        self.eof = False
+        self.returncodes = None
+        # set by transcode() for pipelines that don't hold a limited slot
+        self.live = False
+        # the children hold their own copies of the intermediate pipes, so
+        # an early exit downstream gets back to the upstream processes
+        for p in procs[:-1]:
+            p.stdout.close()
+
+    def read(self, size=-1):
+        data = self.stdout.read(size)
+        if not data:
+            self.eof = True
+            self.close()
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        killed = False
+        for p in self.procs:
+            # at the end of the output the processes are exiting anyway
+            if not self.eof and p.poll() is None:
+                try:
+                    p.kill()
+                    killed = True
+                except OSError:
+                    pass
+        self.returncodes = [p.wait() for p in self.procs]
+        self.stdout.close()
+        transcode_manager.release(killed, self.live)
+
+    def succeeded(self):
+        # True if the output was read to the end and every process exited
+        # cleanly - a crashed encoder or unreadable source also ends the
+        # output, but with a partial (or empty) result
+        return self.eof and self.returncodes is not None and not [r for r in self.returncodes if r != 0]
+
+    def __del__(self):
+        self.close()
+
 def transcode(inputfile, transcodetype):
 
+    # wait for a free pipeline slot - the slot is released when the
+    # returned pipeline is read to the end or closed (live transcodes
+    # don't wait)
+    live = is_live(transcodetype)
+    transcode_manager.acquire(live=live)
+    try:
+        stream = start_transcode(inputfile, transcodetype)
+    except:
+        transcode_manager.release(live=live)
+        raise
+    stream.live = live
+    return stream
+
+def prefetch(inputfile, transcodetype, niceness=10):
+
+    # transcode inputfile into the transcode cache at low priority, so that
+    # a later request for it is served from the cache.
+    # Nothing is done if the output is already cached (or being cached),
+    # can't be cached, or no pipeline is free - prefetches never queue
+    # ahead of (or wait behind) tracks that are playing
+    if is_live(transcodetype):
+        return False
+    try:
+        mtime = os.stat(inputfile).st_mtime
+    except OSError:
+        return False
+    if transcode_cache.lookup(inputfile, mtime, transcodetype, count=False):
+        return False
+    if not transcode_manager.acquire(wait=False):
+        return False
+    try:
+        stream = start_transcode(inputfile, transcodetype, niceness)
+    except:
+        transcode_manager.release()
+        raise
+    tee = transcode_cache.tee(inputfile, mtime, transcodetype, stream)
+    if tee is stream:
+        stream.close()
+        return False
+    log.debug('Transcode prefetch: %s' % inputfile)
+    for chunk in tee:
+        pass
+    return True
+
+def lower_priority(niceness):
+
+    # return a preexec_fn that lowers the priority of a transcode process
+    if niceness and hasattr(os, 'nice'):
+        return lambda: os.nice(niceness)
+    return None
+
+def start_transcode(inputfile, transcodetype, niceness=0):
+
     log.debug(inputfile)
     log.debug(transcodetype)
 
     devnull = file(os.devnull, 'ab')
+    preexec = lower_priority(niceness)
 
     if transcodetype == 'mp2.mp3':
         # transcode using lame
@@ -127,8 +519,9 @@ def transcode(inputfile, transcodetype):
                 inputfile,
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
-        return sub.stdout
+                stderr=devnull,
+                preexec_fn=preexec)
+        return TranscodePipeline([sub])
 
     if transcodetype == 'ac3.mp3':
         # transcode using ffmpeg
@@ -144,8 +537,9 @@ def transcode(inputfile, transcodetype):
                 "-f", "mp3",
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
-        return sub.stdout
+                stderr=devnull,
+                preexec_fn=preexec)
+        return TranscodePipeline([sub])
 
     if transcodetype == 'mp4.mp3' or transcodetype == 'm4a.mp3':
         # transcode using ffmpeg
@@ -159,8 +553,9 @@ def transcode(inputfile, transcodetype):
                 "-f", "mp3",
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
-        return sub.stdout
+                stderr=devnull,
+                preexec_fn=preexec)
+        return TranscodePipeline([sub])
 
     elif transcodetype == 'pc.wav':
         # parec --device=alsa_output.pci-0000_00_1b.0.analog-stereo.monitor --format=s16le --rate=44100 --channels=2 | sox --type raw -s2L --rate 44100 --channels 2 - --type wav -
@@ -173,7 +568,8 @@ def transcode(inputfile, transcodetype):
                 "--rate=44100",
                 "--channels=2"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
         p2 = subprocess.Popen([
                 "sox",
                 "--type", "raw",
@@ -185,8 +581,9 @@ def transcode(inputfile, transcodetype):
                 "-"],
                 stdin=p1.stdout,
                 stdout=subprocess.PIPE,
-                stderr=devnull)
-        return p2.stdout
+                stderr=devnull,
+                preexec_fn=preexec)
+        return TranscodePipeline([p1, p2])
 
     elif transcodetype == 'flac.mp3.old':
         # transcode using vlc
@@ -200,9 +597,10 @@ def transcode(inputfile, transcodetype):
             inputfile,
             "--sout=file/mp3:-"],
             stdout=subprocess.PIPE,
-            stderr=devnull)
+            stderr=devnull,
+            preexec_fn=preexec)
 
-        return p1.stdout
+        return TranscodePipeline([p1])
 
     elif transcodetype == 'flac.mp3':
         # transcode using flac/lame
@@ -214,7 +612,8 @@ def transcode(inputfile, transcodetype):
                 "-d",
                 "-c"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
         p2 = subprocess.Popen([
                 "lame",
@@ -228,9 +627,10 @@ def transcode(inputfile, transcodetype):
                 "-"],
                 stdin=p1.stdout,
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
-        return p2.stdout
+        return TranscodePipeline([p1, p2])
 
     elif transcodetype == 'flac.ogg':
         # transcode using flac
@@ -246,9 +646,10 @@ def transcode(inputfile, transcodetype):
                 "--ogg",
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
-        return p1.stdout
+        return TranscodePipeline([p1])
         
     elif transcodetype == 'flac.wav':
         # transcode using sox
@@ -265,8 +666,9 @@ def transcode(inputfile, transcodetype):
                 "--type", "wav",
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
-        return p1.stdout
+                stderr=devnull,
+                preexec_fn=preexec)
+        return TranscodePipeline([p1])
 
     elif transcodetype.startswith('stream.'):
         # transcode using vlc
@@ -280,9 +682,10 @@ def transcode(inputfile, transcodetype):
             inputfile,
             "--sout=file/wav:-"],
             stdout=subprocess.PIPE,
-            stderr=devnull)
+            stderr=devnull,
+            preexec_fn=preexec)
 
-        return p1.stdout
+        return TranscodePipeline([p1])
 
         # temp testing with mplayer follows
         # (mplayer does not seem to like redirecting to stdout)
@@ -320,7 +723,8 @@ def transcode(inputfile, transcodetype):
                 "-t", "flac",
                 "-"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
     elif transcodefacets[0].endswith('6') and transcodefacets[1] == '16_48_2' and transcodefacets[2] == 'flac':
         # transcode using sox
@@ -335,7 +739,8 @@ def transcode(inputfile, transcodetype):
                 "-",
                 "remix", "1-3", "4-6"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
     # this one doesn't do anything, left as example
     elif transcodetype == '@@@@@@':
@@ -347,7 +752,8 @@ def transcode(inputfile, transcodetype):
                 "-d",
                 "-c"],
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
         p2 = subprocess.Popen([
                 "sox",
@@ -359,17 +765,19 @@ def transcode(inputfile, transcodetype):
                 "-"],
                 stdin=p1.stdout,
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
 
         p3 = subprocess.Popen([
                 "flac",
                 "-"],
                 stdin=p2.stdout,
                 stdout=subprocess.PIPE,
-                stderr=devnull)
+                stderr=devnull,
+                preexec_fn=preexec)
                 
-        sub = p3
+        return TranscodePipeline([p1, p2, p3])
 
-    return sub.stdout
+    return TranscodePipeline([sub])
 
 
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*- 
 import urllib
+import urllib2
 import re
 from xml.sax.saxutils import escape, unescape
 import os
@@ -11,6 +12,10 @@ if os.name != 'nt':
 
 socket.setdefaulttimeout(15)
 
+# the controlpoint holds long polls (the *Wait resources) for up to
+# long_poll_timeout seconds (25 by default), so wait longer than that
+long_poll_timeout = 60
+
 def get_ip_address(ifname):
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -99,6 +104,25 @@ def get_return(datadict):
         ret = retstring.split('::')[1]
     return ret
 
+def get_notfound(datadict):
+    # if the controlpoint no longer holds the entry that was passed (its
+    # browse results are only kept for a while), return a script telling
+    # the user to browse to it again
+    if datadict and datadict[0].startswith('NOTFOUND::'):
+        return 'setmessagebar("That entry is no longer available, please browse to it again");'
+    return None
+
+def waitdata(waitresource, pollresource, pentry):
+    # long poll the controlpoint - the request is held until the data
+    # changes (or times out), so the browser can poll again as soon as
+    # this returns. If the controlpoint is already holding as many
+    # requests as it will, it replies BUSY - back off and poll instead
+    datastring=urllib2.urlopen('http://' + ip_address + ':50101/data/' + waitresource + '?data=' + pentry, None, long_poll_timeout).read()
+    if datastring.startswith('BUSY'):
+        time.sleep(1)
+        datastring=urllib.urlopen('http://' + ip_address + ':50101/data/' + pollresource + '?data=' + pentry).read()
+    return datastring
+
 def index():
     response.flash = T('Welcome to sonospy')
     # default page - get list of servers and renderers to display
@@ -304,7 +328,7 @@ def pollrenderer():
     ptype = request.vars.renderertype
     ptarget = request.vars.renderertarget
     pentry = ptype + '::' + ptitle
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/rendererPoll?data='+pentry).read()
+    datastring = waitdata('rendererWait', 'rendererPoll', pentry)
     datadict = unwrap_data(datastring)
     out = formatrendererstatus(datadict)
     return out
@@ -371,7 +395,7 @@ def pollserver():
     ptype = request.vars.servertype
     qdata = request.vars.queuedata
     pentry = ptype + '::' + ptitle
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/serverPoll?data='+pentry).read()
+    datastring = waitdata('serverWait', 'serverPoll', pentry)
     datadict = unwrap_data(datastring)
 
     print "pollserver return: " + str(datadict)
@@ -397,7 +421,7 @@ def pollqueue():
     qentry = escape(request.vars.queueentry, url_escape_entities)
     qcall = request.vars.queuecall
 
-    datastring=urllib.urlopen('http://' + ip_address + ':50101/data/queuePoll?data='+qentry).read()
+    datastring = waitdata('queueWait', 'queuePoll', qentry)
     datadict = unwrap_data(datastring)
     out = ''
     for item in datadict:
@@ -593,15 +617,18 @@ def getdata():
 
     gotdata = False
     while gotdata == False:
-        # get data from the server
-        datastring=urllib.urlopen('http://' + ip_address + ':50101/data/getData?data='+pentry).read()
+        # get data from the server - this waits until the data is ready,
+        # or until the controlpoint times the request out
+        datastring = waitdata('getDataWait', 'getData', pentry)
         datadict = unwrap_data(datastring)
         # check whether we have received any data
-        if datadict[0].startswith('NOTREADY'):
-            time.sleep(0.3)
-        else:
+        if not datadict[0].startswith('NOTREADY'):
             gotdata = True            
 
+    notfound = get_notfound(datadict)
+    if notfound != None:
+        return notfound
+
     # remove any message
     messagescript = ''
     message = get_message(datadict)
@@ -923,6 +950,9 @@ def calloption():
         pentry = pid + '::' + ptype + '::' + pmenu + '::' + ptitle + ":::" + poption
     print "entry: " + str(pentry)
     datastring=urllib.urlopen('http://' + ip_address + ':50101/data/playData?data='+pentry).read()
+    notfound = get_notfound(unwrap_data(datastring))
+    if notfound != None:
+        return notfound
 
     return ""
 
@@ -938,6 +968,9 @@ def calloptionmulti():
     pentry = 'MULTI' + ':::' + poption + ':::' + pdata
     print "entry: " + str(pentry)
     datastring=urllib.urlopen('http://' + ip_address + ':50101/data/playData?data='+pentry).read()
+    notfound = get_notfound(unwrap_data(datastring))
+    if notfound != None:
+        return notfound
 
     return ""
 